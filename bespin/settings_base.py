@@ -138,6 +138,105 @@ REQUIRED_GROUP_MANAGER_GROUP = None
 
 REQUIRE_JOB_TOKENS = False
 
+# Signed DukeDS file urls (e.g. job readme urls) are cached until this many seconds before they expire
+DDS_FILE_URL_CACHE_EXPIRATION_MARGIN_SECONDS = 60
+# How long to cache a DukeDS file url that doesn't include an expiration time
+DDS_FILE_URL_CACHE_DEFAULT_SECONDS = 60
+
+# Seconds to wait for DukeDS to respond to a single request
+DDS_REQUEST_TIMEOUT_SECONDS = 15
+# DukeDS circuit breaker opens when this fraction of the most recent DDS_CIRCUIT_BREAKER_WINDOW_SIZE calls fail
+DDS_CIRCUIT_BREAKER_FAILURE_RATE = 0.5
+# Minimum number of recent calls before the failure rate is checked
+DDS_CIRCUIT_BREAKER_MINIMUM_CALLS = 10
+DDS_CIRCUIT_BREAKER_WINDOW_SIZE = 20
+# Seconds the circuit breaker stays open before allowing a probe call through
+DDS_CIRCUIT_BREAKER_RESET_SECONDS = 30
+
+# Maximum number of outbox messages the dispatchoutbox command claims and sends per batch
+OUTBOX_DISPATCH_BATCH_SIZE = 100
+# Seconds the dispatchoutbox command waits before checking an empty outbox again
+OUTBOX_DISPATCH_POLL_SECONDS = 1.0
+# Seconds a dispatcher holds its claim on a batch of outbox messages, unsent messages are claimed again afterwards
+OUTBOX_CLAIM_SECONDS = 5 * 60
+
+# Seconds each process caches the LandoConnection used by a JobSettings
+LANDO_CONNECTION_CACHE_SECONDS = 60
+
+# Number of queued job starts/restarts the runjobworker command processes at the same time
+JOB_WORKER_POOL_SIZE = 4
+# Seconds the runjobworker command waits before checking for queued jobs again
+JOB_WORKER_POLL_SECONDS = 1.0
+# Seconds the job worker waits before retrying a queued job after a temporary failure, doubled after each failure
+JOB_WORKER_RETRY_BACKOFF_BASE_SECONDS = 30
+JOB_WORKER_RETRY_BACKOFF_MAX_SECONDS = 30 * 60
+# Number of temporary failures after which the job worker moves a queued job to ERROR
+JOB_WORKER_MAX_ATTEMPTS = 10
+
+# Seconds a response is kept for replay when a request with the same Idempotency-Key header is retried
+IDEMPOTENCY_KEY_TTL_SECONDS = 24 * 60 * 60
+
+# Seconds a cached workflow version-info document is served before it is revalidated with its url
+VERSION_INFO_CACHE_SECONDS = 24 * 60 * 60
+# Seconds to wait for a version-info url to respond before serving the cached document
+VERSION_INFO_REQUEST_TIMEOUT_SECONDS = 5
+# Seconds the cached version-info document is served without trying its url again after revalidation failed
+VERSION_INFO_RETRY_SECONDS = 5 * 60
+
+# max-age in seconds of the Cache-Control header on workflow methods document responses
+METHODS_DOCUMENT_CACHE_SECONDS = 24 * 60 * 60
+# Number of DOI citations resolved at the same time when importing a methods document
+DOI_CITATION_POOL_SIZE = 8
+
+# Directory where the workflow importers cache parsed CWL documents by content hash, None to disable the cache.
+# It is created readable only by its owner and is not used if another user owns it or can access it.
+CWL_DOCUMENT_CACHE_DIR = os.path.join(BASE_DIR, 'cwl-cache')
+# Python interpreter the workflow importers run to parse CWL documents. Set explicitly because under mod_wsgi
+# sys.executable is the Apache binary, the default is the interpreter of the installation running the project.
+CWL_PARSER_PYTHON = os.path.join(sys.prefix, 'bin', 'python3')
+# Seconds the workflow importers wait for the CWL parser before giving up
+CWL_PARSER_TIMEOUT_SECONDS = 5 * 60
+
+# Seconds each process caches an EmailTemplate looked up by name
+EMAIL_TEMPLATE_CACHE_SECONDS = 60
+
+# Maximum number of email messages the sendemails command sends over one SMTP connection
+EMAIL_BATCH_SIZE = 100
+# Maximum number of email messages sent per second by the sendemails command, None for no limit
+EMAIL_SEND_RATE_LIMIT = None
+# Seconds the sendemails command waits before retrying a failed message, doubled after each failure
+EMAIL_RETRY_BACKOFF_BASE_SECONDS = 60
+EMAIL_RETRY_BACKOFF_MAX_SECONDS = 60 * 60
+# Number of failed attempts after which the sendemails command stops retrying a message
+EMAIL_MAX_SEND_ATTEMPTS = 5
+# Seconds a sender holds its claim on a message, after which a message left in Sending state is sent again
+EMAIL_SEND_CLAIM_SECONDS = 5 * 60
+# Seconds the sendemails command waits before checking for messages to send again
+EMAIL_SEND_POLL_SECONDS = 10.0
+# Days the purgeemailmessages command keeps sent email messages
+EMAIL_MESSAGE_RETENTION_DAYS = 90
+# Number of email messages returned per page by the admin email message endpoints
+EMAIL_MESSAGE_PAGE_SIZE = 100
+
+# Number of jobs returned per page by the admin endpoint listing jobs that used a DukeDS file or project
+DDS_INPUT_JOBS_PAGE_SIZE = 100
+
+# Buffer job state change notifications and send each recipient one digest email per window instead
+# Requires an EmailTemplate named 'job-digest' and the sendemails command to be running
+EMAIL_DIGEST_ENABLED = False
+# Seconds notifications are buffered after the first pending notification for a recipient
+EMAIL_DIGEST_WINDOW_SECONDS = 15 * 60
+
+# Maximum number of job state changes the sendjobnotifications command mails per batch
+JOB_NOTIFICATION_BATCH_SIZE = 100
+# Seconds the sendjobnotifications command waits before checking for job state changes again
+JOB_NOTIFICATION_POLL_SECONDS = 1.0
+# Seconds the sendjobnotifications command waits before retrying a failed job state change, doubled after each failure
+JOB_NOTIFICATION_RETRY_BACKOFF_BASE_SECONDS = 60
+JOB_NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS = 60 * 60
+# Number of failed attempts after which the sendjobnotifications command stops retrying a job state change
+JOB_NOTIFICATION_MAX_ATTEMPTS = 5
+
 # Configure djangorestframework-jwt
 JWT_AUTH = {
     # Allow token refresh
@@ -34,6 +34,15 @@ DATABASES = {
 
 STATIC_ROOT=os.getenv('BESPIN_STATIC_ROOT')
 
+# To share cached values (e.g. DukeDS file urls) between worker processes, set BESPIN_CACHE_LOCATION to a directory
+if os.getenv('BESPIN_CACHE_LOCATION') is not None:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('BESPIN_CACHE_LOCATION'),
+        }
+    }
+
 #SECURE_SSL_REDIRECT = True
 #SESSION_COOKIE_SECURE = True
 #CSRF_COOKIE_SECURE = True
@@ -1,7 +1,7 @@
 import json
-from rest_framework import viewsets, permissions, status, mixins, generics
+from rest_framework import viewsets, permissions, status, mixins, generics, views
 from rest_framework.response import Response
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
 from bespin_api_v2.serializers import AdminWorkflowSerializer, AdminWorkflowVersionSerializer, JobStrategySerializer, \
@@ -10,14 +10,19 @@ from bespin_api_v2.serializers import AdminWorkflowSerializer, AdminWorkflowVers
     AdminDDSUserCredSerializer, JobErrorSerializer, AdminJobDDSOutputProjectSerializer, AdminShareGroupSerializer, \
     WorkflowMethodsDocumentSerializer, WorkflowVersionToolDetailsSerializer, JobSerializer, \
     AdminEmailMessageSerializer, AdminEmailTemplateSerializer, AdminLandoConnectionSerializer, \
-    AdminJobStrategySerializer, AdminJobSettingsSerializer
+    AdminJobStrategySerializer, AdminJobSettingsSerializer, AdminJobBulkActionSerializer
 from gcb_web_auth.models import DDSUserCredential
-from data.api import JobsViewSet as V1JobsViewSet, WorkflowVersionSortedListMixin, ExcludeDeprecatedWorkflowsMixin
+from data.api import JobsViewSet as V1JobsViewSet, WorkflowVersionSortedListMixin, ExcludeDeprecatedWorkflowsMixin, \
+    JobStateNotificationMixin, AdminEmailMessageMixin, WorkflowMethodsDocumentMixin, \
+    WorkflowVersionToolDetailsFilterMixin, JobOrderFilterMixin, DDSInputJobsPagination
 from data.models import Workflow, WorkflowVersion, JobStrategy, WorkflowConfiguration, JobFileStageGroup, ShareGroup, \
     Job, JobError, JobDDSOutputProject, WorkflowMethodsDocument, WorkflowVersionToolDetails, EmailMessage, \
-    EmailTemplate, LandoConnection, JobSettings
+    EmailTemplate, LandoConnection, JobSettings, DDSJobInputFile
 from data.exceptions import BespinAPIException
-from data.mailer import EmailMessageSender, JobMailer
+from data.lando import LandoJobs
+from data.idempotency import idempotent
+from bespin_api_v2.catalog import get_catalog_snapshot
+from collections import OrderedDict
 
 
 class CreateListRetrieveModelViewSet(mixins.CreateModelMixin,
@@ -36,13 +41,13 @@ class AdminWorkflowViewSet(CreateListRetrieveModelViewSet):
 class AdminWorkflowVersionViewSet(WorkflowVersionSortedListMixin, CreateListRetrieveModelViewSet):
     permission_classes = (permissions.IsAdminUser,)
     serializer_class = AdminWorkflowVersionSerializer
-    queryset = WorkflowVersion.objects.all()
+    queryset = WorkflowVersion.objects.with_related()
 
     def perform_create(self, serializer):
         serializer.save(enable_ui=False)
 
 
-class AdminWorkflowVersionToolDetailsViewSet(CreateListRetrieveModelViewSet):
+class AdminWorkflowVersionToolDetailsViewSet(WorkflowVersionToolDetailsFilterMixin, CreateListRetrieveModelViewSet):
     permission_classes = (permissions.IsAdminUser,)
     serializer_class = WorkflowVersionToolDetailsSerializer
     queryset = WorkflowVersionToolDetails.objects.all()
@@ -64,7 +69,7 @@ class JobStrategyViewSet(viewsets.ReadOnlyModelViewSet):
 
 class WorkflowVersionsViewSet(WorkflowVersionSortedListMixin, ExcludeDeprecatedWorkflowsMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = WorkflowVersion.objects.all()
+    queryset = WorkflowVersion.objects.with_related()
     serializer_class = WorkflowVersionSerializer
     filter_backends = (DjangoFilterBackend,)
     filter_fields = ('workflow', 'workflow__tag', 'workflow__state', 'version',)
@@ -87,6 +92,25 @@ class ShareGroupViewSet(viewsets.ReadOnlyModelViewSet):
     filter_fields = ('name', 'email', )
 
 
+class CatalogView(views.APIView):
+    """
+    Workflows, workflow versions, workflow configurations, job strategies and share groups in one response.
+    Responds with 304 Not Modified when the If-None-Match header matches the current ETag.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        snapshot = get_catalog_snapshot()
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if snapshot.etag in [value.strip() for value in if_none_match.split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(snapshot.data)
+        response['ETag'] = snapshot.etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
 class JobTemplateInitView(generics.CreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = JobTemplateMinimalSerializer
@@ -105,27 +129,64 @@ class JobTemplateCreateJobView(generics.CreateAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = JobTemplateSerializer
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super(JobTemplateCreateJobView, self).create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         job_template = serializer.save()
         job_template.create_and_populate_job(self.request.user)
 
 
-class AdminJobsViewSet(viewsets.ModelViewSet):
+class AdminJobsViewSet(JobStateNotificationMixin, JobOrderFilterMixin, viewsets.ModelViewSet):
     permission_classes = (permissions.IsAdminUser,)
     serializer_class = AdminJobSerializer
     queryset = Job.objects.all()
     filter_backends = (DjangoFilterBackend,)
-    filter_fields = ('vm_instance_name',)
+    filter_fields = ('vm_instance_name', 'workflow_version',)
 
-    def perform_update(self, serializer):
-        # Overrides perform update to notify about state changes
-        # If the job state changed, notify about the state change
-        original_state = self.get_object().state
-        serializer.save()
-        new_state = self.get_object().state
-        if original_state != new_state:
-            mailer = JobMailer(self.get_object())
-            mailer.mail_current_state()
+    @list_route(methods=['get'], url_path='dds-input-jobs')
+    def dds_input_jobs(self, request):
+        """
+        Jobs that staged the DukeDS file given by the file_id query parameter and/or files from the project given by
+        the project_id query parameter, newest first. Paginated using the X-Total-Count and Link headers.
+        """
+        file_filters = {}
+        for param in ('file_id', 'project_id'):
+            if request.query_params.get(param):
+                file_filters[param] = request.query_params[param]
+        if not file_filters:
+            raise BespinAPIException(status.HTTP_400_BAD_REQUEST,
+                                     'A file_id or project_id query parameter is required.')
+        stage_group_ids = DDSJobInputFile.objects.filter(**file_filters).values('stage_group_id')
+        jobs = Job.objects.filter(stage_group_id__in=stage_group_ids).order_by('-created', '-id')
+        paginator = DDSInputJobsPagination()
+        page = paginator.paginate_queryset(jobs, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @list_route(methods=['post'], serializer_class=AdminJobBulkActionSerializer, url_path='bulk-action')
+    def bulk_action(self, request):
+        """
+        Start, cancel or restart many jobs selected by id or by fund_code/state.
+        Responds with the outcome for each selected job.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if 'job_ids' in data:
+            job_ids = list(OrderedDict.fromkeys(data['job_ids']))
+        else:
+            jobs = Job.objects.exclude(state=Job.JOB_STATE_DELETED).order_by('id')
+            if 'fund_code' in data:
+                jobs = jobs.filter(fund_code=data['fund_code'])
+            if 'state' in data:
+                jobs = jobs.filter(state=data['state'])
+            job_ids = list(jobs.values_list('id', flat=True))
+        results = LandoJobs(data['action']).run(job_ids)
+        response_data = dict(serializer.data)
+        response_data['results'] = results
+        return Response(response_data, status=status.HTTP_200_OK)
 
 
 class AdminJobFileStageGroupViewSet(viewsets.ReadOnlyModelViewSet):
@@ -164,31 +225,16 @@ class AdminShareGroupViewSet(viewsets.ModelViewSet):
     queryset = ShareGroup.objects.all()
 
 
-class WorkflowMethodsDocumentViewSet(viewsets.ReadOnlyModelViewSet):
-    permission_classes = (permissions.IsAuthenticated,)
-    queryset = WorkflowMethodsDocument.objects.all()
-    serializer_class = WorkflowMethodsDocumentSerializer
+class WorkflowMethodsDocumentViewSet(WorkflowMethodsDocumentMixin, viewsets.ReadOnlyModelViewSet):
+    pass
 
 
 class JobsViewSet(V1JobsViewSet):
     serializer_class = JobSerializer
 
 
-class AdminEmailMessageViewSet(viewsets.ModelViewSet):
-    permission_classes = (permissions.IsAdminUser,)
+class AdminEmailMessageViewSet(AdminEmailMessageMixin, viewsets.ModelViewSet):
     serializer_class = AdminEmailMessageSerializer
-    queryset = EmailMessage.objects.all()
-
-    @detail_route(methods=['post'], url_path='send')
-    def send(self, request, pk=None):
-        """
-        Send an email message
-        """
-        message = self.get_object()
-        sender = EmailMessageSender(message)
-        sender.send()
-        serializer = self.get_serializer(message)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class AdminEmailTemplateViewSet(viewsets.ModelViewSet):
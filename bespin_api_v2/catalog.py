@@ -0,0 +1,57 @@
+"""
+Snapshot of the workflows, versions, configurations, job strategies and share groups the UI loads on startup.
+The snapshot is built once per CatalogSnapshot version and served with a strong ETag.
+"""
+from django.core.serializers.json import DjangoJSONEncoder
+from data.models import Workflow, WorkflowVersion, WorkflowConfiguration, JobStrategy, ShareGroup, CatalogSnapshot
+from data.serializers import WorkflowSerializer
+from bespin_api_v2.serializers import WorkflowVersionSerializer, WorkflowConfigurationSerializer, \
+    JobStrategySerializer, ShareGroupSerializer
+import hashlib
+import json
+
+
+def build_catalog_data(version):
+    """
+    Serialize the catalog using the same serializers and default filtering as the individual v2 list endpoints.
+    :param version: int: version of the snapshot being built
+    :return: dict: JSON-compatible catalog
+    """
+    workflows = Workflow.objects.exclude(state=Workflow.WORKFLOW_STATE_DEPRECATED).prefetch_related('versions')
+    workflow_versions = WorkflowVersion.sorted_queryset(
+        WorkflowVersion.objects.with_related().exclude(workflow__state=Workflow.WORKFLOW_STATE_DEPRECATED))
+    data = {
+        'version': version,
+        'workflows': WorkflowSerializer(workflows, many=True).data,
+        'workflow_versions': WorkflowVersionSerializer(workflow_versions, many=True).data,
+        'workflow_configurations': WorkflowConfigurationSerializer(WorkflowConfiguration.objects.all(), many=True).data,
+        'job_strategies': JobStrategySerializer(JobStrategy.objects.select_related('job_flavor'), many=True).data,
+        'share_groups': ShareGroupSerializer(ShareGroup.objects.prefetch_related('users'), many=True).data,
+    }
+    return json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+
+def make_etag(data):
+    """
+    :param data: dict: JSON-compatible catalog
+    :return: str: strong ETag derived from the catalog contents
+    """
+    content = json.dumps(data, sort_keys=True)
+    return '"{}"'.format(hashlib.sha256(content.encode('utf-8')).hexdigest())
+
+
+def get_catalog_snapshot():
+    """
+    Return the latest catalog snapshot, building its data if this is the first request since a change.
+    :return: CatalogSnapshot: snapshot with data and etag filled in
+    """
+    snapshot = CatalogSnapshot.objects.order_by('-version').first()
+    if snapshot is None:
+        snapshot = CatalogSnapshot.invalidate()
+    if snapshot.data is None:
+        snapshot.data = build_catalog_data(snapshot.version)
+        snapshot.etag = make_etag(snapshot.data)
+        CatalogSnapshot.objects.filter(version=snapshot.version, data__isnull=True) \
+            .update(data=snapshot.data, etag=snapshot.etag)
+        CatalogSnapshot.objects.filter(version__lt=snapshot.version).delete()
+    return snapshot
@@ -13,6 +13,7 @@ from data.serializers import JobFileStageGroupSerializer, AdminDDSUserCredSerial
     WorkflowMethodsDocumentSerializer, WorkflowVersionToolDetailsSerializer, \
     JobDDSOutputProjectSerializer, UserSerializer, AdminCloudSettingsSerializer
 from data.jobusage import JobUsage
+from data.lando import LandoJobs
 
 
 class JSONStrField(serializers.Field):
@@ -175,6 +176,28 @@ class AdminJobSerializer(serializers.ModelSerializer):
         read_only_fields = ('share_group', 'job_settings',)
 
 
+class AdminJobBulkActionSerializer(serializers.Serializer):
+    """
+    Selects jobs by id (job_ids) or by filter (fund_code and/or state) to start, cancel or restart.
+    results contains the outcome for each selected job.
+    """
+    action = serializers.ChoiceField(choices=LandoJobs.ACTIONS)
+    job_ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    fund_code = serializers.CharField(required=False)
+    state = serializers.ChoiceField(choices=Job.JOB_STATES, required=False)
+    results = serializers.ListField(child=serializers.DictField(), read_only=True)
+
+    def validate(self, data):
+        has_job_ids = 'job_ids' in data
+        has_filter = 'fund_code' in data or 'state' in data
+        if has_job_ids == has_filter:
+            raise serializers.ValidationError("Specify either job_ids or a filter (fund_code and/or state).")
+        return data
+
+    class Meta:
+        resource_name = 'job-bulk-actions'
+
+
 class JobUsageSerializer(serializers.Serializer):
     vm_hours = serializers.FloatField()
     cpu_hours = serializers.FloatField()
@@ -1,12 +1,18 @@
 import json
 from django.core.urlresolvers import reverse
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from data.tests_api import UserLogin
 from data.models import Workflow, WorkflowVersion, WorkflowConfiguration, JobStrategy, ShareGroup, JobFlavor, \
     JobSettings, CloudSettingsOpenStack, VMProject, JobFileStageGroup, DDSUserCredential, DDSEndpoint, Job, \
-    JobRuntimeK8s, LandoConnection, JobRuntimeStepK8s, EmailMessage, EmailTemplate, WorkflowVersionToolDetails
+    JobRuntimeK8s, LandoConnection, JobRuntimeStepK8s, EmailMessage, EmailTemplate, WorkflowVersionToolDetails, \
+    JobActivity, OutboxMessage, JobStateNotification, CatalogSnapshot, DDSJobInputFile, DDSUser
 from data.tests_models import create_vm_job_settings
+from data.mailer import EmailMessageBatchSender
 from bespin_api_v2.jobtemplate import STRING_VALUE_PLACEHOLDER, INT_VALUE_PLACEHOLDER, \
     REQUIRED_ERROR_MESSAGE, PLACEHOLDER_ERROR_MESSAGE
 from mock import patch, Mock
@@ -788,6 +794,19 @@ class WorkflowVersionsTestCase(APITestCase):
             fields=[{"name": "threads", "type": "int"}, {"name": "items", "type": "string"}],
         )
 
+    def test_list_query_count_independent_of_versions(self):
+        self.user_login.become_normal_user()
+        url = reverse('v2-workflowversion-list')
+        with CaptureQueriesContext(connection) as few_version_queries:
+            self.client.get(url)
+        for i in range(3):
+            workflow = Workflow.objects.create(name='workflow{}'.format(i), tag='tag{}'.format(i))
+            WorkflowVersion.objects.create(workflow=workflow, version='1', url='', fields=[])
+        with CaptureQueriesContext(connection) as many_version_queries:
+            response = self.client.get(url)
+        self.assertEqual(len(response.data), 6)
+        self.assertLessEqual(len(many_version_queries), len(few_version_queries))
+
     def test_list_filter_on_tag(self):
         self.user_login.become_normal_user()
         url = reverse('v2-workflowversion-list')
@@ -1132,8 +1151,7 @@ class JobsTestCase(APITestCase):
                                    })
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-    @patch('bespin_api_v2.api.JobMailer')
-    def testAdminUserUpdatesStateAndStep(self, MockJobMailer):
+    def testAdminUserUpdatesStateAndStep(self):
         """
         Admin should be able to change job state and job step.
         """
@@ -1157,12 +1175,9 @@ class JobsTestCase(APITestCase):
         self.assertEqual(Job.JOB_STATE_RUNNING, job.state)
         self.assertEqual(Job.JOB_STEP_CREATE_VM, job.step)
 
-    @patch('bespin_api_v2.api.JobMailer')
-    def test_mails_when_job_state_changes(self, MockJobMailer):
-        mock_mail_current_state = Mock()
-        MockJobMailer.return_value.mail_current_state = mock_mail_current_state
+    def test_queues_notification_when_job_state_changes(self):
         """
-        Admin should be able to change job state and job step.
+        Changing the job state should queue a notification to be mailed by the sendjobnotifications command.
         """
         admin_user = self.user_login.become_admin_user()
         job = Job.objects.create(name='somejob',
@@ -1181,14 +1196,13 @@ class JobsTestCase(APITestCase):
                                         'step': Job.JOB_STEP_CREATE_VM,
                                     })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(mock_mail_current_state.called)
+        notification = JobStateNotification.objects.get()
+        self.assertEqual(notification.job, job)
+        self.assertEqual(notification.state, Job.JOB_STATE_RUNNING)
 
-    @patch('bespin_api_v2.api.JobMailer')
-    def test_does_not_mail_when_job_state_stays(self, MockJobMailer):
-        mock_mail_current_state = Mock()
-        MockJobMailer.return_value.mail_current_state = mock_mail_current_state
+    def test_does_not_queue_notification_when_job_state_stays(self):
         """
-        Admin should be able to change job state and job step.
+        Changing only the job step should not queue a notification.
         """
         admin_user = self.user_login.become_admin_user()
         job = Job.objects.create(name='somejob',
@@ -1208,7 +1222,7 @@ class JobsTestCase(APITestCase):
                                         'step': Job.JOB_STEP_RUNNING,
                                     })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertFalse(mock_mail_current_state.called)
+        self.assertFalse(JobStateNotification.objects.exists())
 
 
 class EmailMessageTestCase(APITestCase):
@@ -1327,6 +1341,61 @@ class EmailMessageTestCase(APITestCase):
         message = EmailMessage.objects.get(id=message.id)
         self.assertEqual(message.state, 'E')
 
+    def test_admin_list_paginated(self):
+        for i in range(3):
+            EmailMessage.objects.create(body='body{}'.format(i), subject='subject', sender_email='sender@example.com',
+                                        to_email='recipient@university.edu')
+        url = reverse('v2-admin_emailmessage-list')
+        self.user_login.become_admin_user()
+        response = self.client.get(url, {'page_size': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(['body0', 'body1'], [message['body'] for message in response.data])
+        self.assertEqual(response['X-Total-Count'], '3')
+        self.assertIn('rel="next"', response['Link'])
+
+        response = self.client.get(url, {'page_size': 2, 'page': 2}, format='json')
+        self.assertEqual(['body2'], [message['body'] for message in response.data])
+        self.assertIn('rel="prev"', response['Link'])
+
+    def test_admin_list_filter_by_state(self):
+        EmailMessage.objects.create(body='body1', subject='subject1', sender_email='sender1@example.com',
+                                    to_email='recipient1@university.edu', state=EmailMessage.MESSAGE_STATE_SENT)
+        EmailMessage.objects.create(body='body2', subject='subject2', sender_email='sender2@example.com',
+                                    to_email='recipient2@university.edu', state=EmailMessage.MESSAGE_STATE_ERROR)
+        url = reverse('v2-admin_emailmessage-list')
+        self.user_login.become_admin_user()
+        response = self.client.get(url, {'state': EmailMessage.MESSAGE_STATE_ERROR}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(['body2'], [message['body'] for message in response.data])
+
+    @patch('data.mailer.get_connection')
+    def test_admin_retry_errors(self, mock_get_connection):
+        sent_message = EmailMessage.objects.create(body='body1', subject='subject1', sender_email='sender@example.com',
+                                                   to_email='recipient1@university.edu',
+                                                   state=EmailMessage.MESSAGE_STATE_SENT)
+        for i in range(2):
+            EmailMessage.objects.create(body='body', subject='subject', sender_email='sender@example.com',
+                                        to_email='recipient{}@university.edu'.format(i),
+                                        state=EmailMessage.MESSAGE_STATE_ERROR, errors='Mailbox full',
+                                        send_attempts=5, next_attempt=timezone.now(), queued_to_mailer=True)
+        url = reverse('v2-admin_emailmessage-list') + 'retry-errors/'
+        self.user_login.become_admin_user()
+        response = self.client.post(url, format='json', data={})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(['N', 'N'], [message['state'] for message in response.data])
+        self.assertEqual([0, 0], [message['send_attempts'] for message in response.data])
+        self.assertEqual([None, None], [message['next_attempt'] for message in response.data])
+        self.assertNotIn(sent_message.id, [message['id'] for message in response.data])
+        # messages are sent later by the sendemails command, not during the request
+        mock_get_connection.assert_not_called()
+        self.assertEqual(len(EmailMessageBatchSender().get_ready_messages()), 2)
+
+    def test_admin_retry_errors_requires_admin(self):
+        url = reverse('v2-admin_emailmessage-list') + 'retry-errors/'
+        self.user_login.become_normal_user()
+        response = self.client.post(url, format='json', data={})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class EmailTemplateTestCase(APITestCase):
 
@@ -1546,3 +1615,225 @@ class AdminJobSettingsViewSetTestCase(APITestCase, AdminCreateListRetrieveMixin)
             'lando_connection': self.lando_connection.id,
             'job_runtime_k8s': self.runtime_k8s.id
         }
+
+
+class AdminJobBulkActionTestCase(APITestCase):
+    def setUp(self):
+        self.user_login = UserLogin(self.client)
+        workflow = Workflow.objects.create(name='RnaSeq')
+        self.workflow_version = WorkflowVersion.objects.create(workflow=workflow, version="v1", url='', fields=[])
+        self.share_group = ShareGroup.objects.create(name='Results Checkers')
+        self.job_flavor = JobFlavor.objects.create(name='flavor1')
+        self.job_settings = create_vm_job_settings(name='vm')
+        self.job_user = User.objects.create_user('job_user')
+        self.url = reverse('v2-admin_job-list') + 'bulk-action/'
+
+    def create_job(self, state, fund_code='', step=''):
+        stage_group = JobFileStageGroup.objects.create(user=self.job_user)
+        return Job.objects.create(name='somejob', workflow_version=self.workflow_version, job_order={},
+                                  user=self.job_user, share_group=self.share_group, job_settings=self.job_settings,
+                                  job_flavor=self.job_flavor, stage_group=stage_group, state=state, step=step,
+                                  fund_code=fund_code)
+
+    def test_requires_admin(self):
+        self.user_login.become_normal_user()
+        response = self.client.post(self.url, format='json', data={'action': 'cancel', 'job_ids': [1]})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_requires_job_ids_or_filter(self):
+        self.user_login.become_admin_user()
+        response = self.client.post(self.url, format='json', data={'action': 'cancel'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(self.url, format='json', data={'action': 'cancel', 'job_ids': [1],
+                                                                   'state': Job.JOB_STATE_RUNNING})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cancel_by_job_ids(self):
+        self.user_login.become_admin_user()
+        job1 = self.create_job(Job.JOB_STATE_RUNNING)
+        job2 = self.create_job(Job.JOB_STATE_STARTING)
+        missing_job_id = job2.id + 100
+        response = self.client.post(self.url, format='json', data={
+            'action': 'cancel',
+            'job_ids': [job1.id, job2.id, missing_job_id]
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['job'] for result in results], [job1.id, job2.id, missing_job_id])
+        self.assertEqual([result['success'] for result in results], [True, True, False])
+        self.assertEqual(results[2]['error'], 'Job {} not found.'.format(missing_job_id))
+        self.assertEqual(Job.objects.get(pk=job1.id).state, Job.JOB_STATE_CANCELING)
+        self.assertEqual(Job.objects.get(pk=job2.id).state, Job.JOB_STATE_CANCELING)
+        self.assertEqual(JobActivity.objects.filter(state=Job.JOB_STATE_CANCELING).count(), 2)
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+
+    @patch('data.lando.give_download_permissions')
+    @patch('data.lando.has_download_permissions')
+    def test_restart_by_filter(self, mock_has_download_permissions, mock_give_download_permissions):
+        self.user_login.become_admin_user()
+        job1 = self.create_job(Job.JOB_STATE_ERROR, fund_code='123')
+        job2 = self.create_job(Job.JOB_STATE_ERROR, fund_code='123', step=Job.JOB_STEP_RECORD_OUTPUT_PROJECT)
+        job3 = self.create_job(Job.JOB_STATE_ERROR, fund_code='456')
+        response = self.client.post(self.url, format='json', data={
+            'action': 'restart',
+            'fund_code': '123',
+            'state': Job.JOB_STATE_ERROR,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['job'] for result in results], [job1.id, job2.id])
+        self.assertEqual([result['success'] for result in results], [True, False])
+        self.assertIn('Restart not allowed', results[1]['error'])
+        self.assertEqual(Job.objects.get(pk=job1.id).state, Job.JOB_STATE_RESTART_QUEUED)
+        self.assertEqual(Job.objects.get(pk=job2.id).state, Job.JOB_STATE_ERROR)
+        self.assertEqual(Job.objects.get(pk=job3.id).state, Job.JOB_STATE_ERROR)
+        # the job worker gives download permissions as the job owner and sends the restart message
+        self.assertFalse(mock_has_download_permissions.called)
+        self.assertFalse(mock_give_download_permissions.called)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    @patch('data.lando.give_download_permissions')
+    @patch('data.lando.has_download_permissions')
+    def test_start_only_authorized_jobs(self, mock_has_download_permissions, mock_give_download_permissions):
+        self.user_login.become_admin_user()
+        job1 = self.create_job(Job.JOB_STATE_AUTHORIZED)
+        job2 = self.create_job(Job.JOB_STATE_NEW)
+        response = self.client.post(self.url, format='json', data={
+            'action': 'start',
+            'job_ids': [job1.id, job2.id],
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['success'] for result in results], [True, False])
+        self.assertEqual(results[0]['state'], Job.JOB_STATE_START_QUEUED)
+        self.assertEqual(results[1]['error'], 'Job needs authorization token before it can start.')
+        job1 = Job.objects.get(pk=job1.id)
+        self.assertEqual(job1.state, Job.JOB_STATE_START_QUEUED)
+        self.assertEqual((job1.queue_attempts, job1.queue_next_attempt), (0, None))
+        self.assertEqual(Job.objects.get(pk=job2.id).state, Job.JOB_STATE_NEW)
+        self.assertFalse(mock_give_download_permissions.called)
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+
+class AdminDDSInputJobsTestCase(APITestCase):
+    def setUp(self):
+        self.user_login = UserLogin(self.client)
+        workflow = Workflow.objects.create(name='RnaSeq')
+        self.workflow_version = WorkflowVersion.objects.create(workflow=workflow, version="v1", url='', fields=[])
+        self.share_group = ShareGroup.objects.create(name='Results Checkers')
+        self.job_flavor = JobFlavor.objects.create(name='flavor1')
+        self.job_settings = create_vm_job_settings(name='vm')
+        self.job_user = User.objects.create_user('job_user')
+        endpoint = DDSEndpoint.objects.create(name='DukeDS', agent_key='secret', api_root='https://someserver.com/api')
+        self.credentials = DDSUserCredential.objects.create(endpoint=endpoint, user=self.job_user, token='secret1',
+                                                            dds_id='1')
+        self.url = reverse('v2-admin_job-list') + 'dds-input-jobs/'
+
+    def create_job(self, files):
+        stage_group = JobFileStageGroup.objects.create(user=self.job_user)
+        for sequence, (project_id, file_id) in enumerate(files):
+            DDSJobInputFile.objects.create(stage_group=stage_group, project_id=project_id, file_id=file_id,
+                                           dds_user_credentials=self.credentials, destination_path='data.txt',
+                                           sequence_group=1, sequence=sequence)
+        return Job.objects.create(name='somejob', workflow_version=self.workflow_version, job_order={},
+                                  user=self.job_user, share_group=self.share_group, job_settings=self.job_settings,
+                                  job_flavor=self.job_flavor, stage_group=stage_group)
+
+    def test_requires_admin(self):
+        self.user_login.become_normal_user()
+        response = self.client.get(self.url, {'file_id': 'file1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_requires_file_or_project(self):
+        self.user_login.become_admin_user()
+        response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_jobs_by_file_and_project(self):
+        self.user_login.become_admin_user()
+        job1 = self.create_job([('project1', 'file1'), ('project1', 'file2')])
+        job2 = self.create_job([('project1', 'file2')])
+        self.create_job([('project2', 'file3')])
+
+        response = self.client.get(self.url, {'file_id': 'file1'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([job['id'] for job in response.data], [job1.id])
+
+        response = self.client.get(self.url, {'project_id': 'project1'}, format='json')
+        self.assertEqual([job['id'] for job in response.data], [job2.id, job1.id])
+        self.assertEqual(response['X-Total-Count'], '2')
+
+        response = self.client.get(self.url, {'project_id': 'project1', 'page_size': 1}, format='json')
+        self.assertEqual([job['id'] for job in response.data], [job2.id])
+        self.assertIn('rel="next"', response['Link'])
+
+
+class CatalogTestCase(APITestCase):
+    def setUp(self):
+        self.user_login = UserLogin(self.client)
+        self.workflow = Workflow.objects.create(name='Exome Seq', tag='exomeseq')
+        self.workflow_version = WorkflowVersion.objects.create(workflow=self.workflow, version='1', url='', fields=[])
+        deprecated_workflow = Workflow.objects.create(name='Old', tag='old', state=Workflow.WORKFLOW_STATE_DEPRECATED)
+        WorkflowVersion.objects.create(workflow=deprecated_workflow, version='1', url='', fields=[])
+        self.share_group = ShareGroup.objects.create(name='Results Checkers')
+        job_flavor = JobFlavor.objects.create(name='large')
+        self.job_strategy = JobStrategy.objects.create(name='default', job_settings=create_vm_job_settings(),
+                                                       job_flavor=job_flavor)
+        WorkflowConfiguration.objects.create(tag='b37xGen', workflow=self.workflow, system_job_order={},
+                                             default_job_strategy=self.job_strategy, share_group=self.share_group)
+
+    def test_requires_login(self):
+        response = self.client.get(reverse('v2-catalog'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_catalog(self):
+        self.user_login.become_normal_user()
+        response = self.client.get(reverse('v2-catalog'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['tag'] for item in response.data['workflows']], ['exomeseq'])
+        self.assertEqual(response.data['workflows'][0]['versions'], [self.workflow_version.id])
+        self.assertEqual([item['id'] for item in response.data['workflow_versions']], [self.workflow_version.id])
+        self.assertEqual([item['tag'] for item in response.data['workflow_configurations']], ['b37xGen'])
+        self.assertEqual(response.data['job_strategies'][0]['job_flavor']['name'], 'large')
+        self.assertEqual([item['name'] for item in response.data['share_groups']], ['Results Checkers'])
+        self.assertEqual(response.data['version'], CatalogSnapshot.objects.get().version)
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_not_modified_when_etag_matches(self):
+        self.user_login.become_normal_user()
+        etag = self.client.get(reverse('v2-catalog'))['ETag']
+        with patch('bespin_api_v2.catalog.build_catalog_data') as mock_build_catalog_data:
+            response = self.client.get(reverse('v2-catalog'), HTTP_IF_NONE_MATCH=etag)
+            self.assertFalse(mock_build_catalog_data.called)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_changes_bump_version(self):
+        self.user_login.become_normal_user()
+        response = self.client.get(reverse('v2-catalog'))
+        version, etag = response.data['version'], response['ETag']
+
+        ShareGroup.objects.create(name='Other Group')
+        response = self.client.get(reverse('v2-catalog'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(response.data['version'], version)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['share_groups']), 2)
+        self.assertEqual(CatalogSnapshot.objects.count(), 1)
+
+    def test_share_group_membership_changes_bump_version(self):
+        self.user_login.become_normal_user()
+        version = self.client.get(reverse('v2-catalog')).data['version']
+        dds_user = DDSUser.objects.create(name='Joe', dds_id='123')
+
+        self.share_group.users.add(dds_user)
+        response = self.client.get(reverse('v2-catalog'))
+        self.assertGreater(response.data['version'], version)
+        self.assertEqual(response.data['share_groups'][0]['users'], [dds_user.id])
+        version = response.data['version']
+
+        # deleting the user cascades through the membership table
+        dds_user.delete()
+        response = self.client.get(reverse('v2-catalog'))
+        self.assertGreater(response.data['version'], version)
+        self.assertEqual(response.data['share_groups'][0]['users'], [])
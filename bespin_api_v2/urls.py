@@ -39,4 +39,5 @@ urlpatterns = [
     url(r'job-templates/init', api.JobTemplateInitView.as_view(), name='v2-jobtemplate_init'),
     url(r'job-templates/validate', api.JobTemplateValidateView.as_view(), name='v2-jobtemplate_validate'),
     url(r'job-templates/create-job', api.JobTemplateCreateJobView.as_view(), name='v2-jobtemplate_createjob'),
+    url(r'^catalog/$', api.CatalogView.as_view(), name='v2-catalog'),
 ]
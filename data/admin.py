@@ -31,8 +31,14 @@ admin.site.register(ShareGroup)
 admin.site.register(DDSUser)
 admin.site.register(WorkflowMethodsDocument)
 admin.site.register(WorkflowVersionToolDetails)
+admin.site.register(WorkflowVersionTool)
 admin.site.register(EmailTemplate)
 admin.site.register(EmailMessage)
+admin.site.register(EmailNotification)
+admin.site.register(JobStateNotification)
+admin.site.register(OutboxMessage)
+admin.site.register(VersionInfoDocument)
+admin.site.register(DOICitation)
 admin.site.register(JobSettings)
 admin.site.register(JobRuntimeOpenStack)
 admin.site.register(JobRuntimeK8s)
@@ -1,8 +1,10 @@
 from rest_framework import viewsets, permissions, status, mixins
 from data.util import get_user_projects, get_user_project, get_user_project_content, get_user_folder_content, \
-    get_readme_file_url, get_workflow_version_info
+    get_readme_file_url, get_workflow_version_info, dds_circuit_breaker
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import StaticHTMLRenderer
 from data.exceptions import DataServiceUnavailable, WrappedDataServiceException, BespinAPIException, JobTokenException
 from data.models import *
 from django.db import IntegrityError
@@ -10,12 +12,16 @@ from data.serializers import *
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import detail_route, list_route
 from data.lando import LandoJob
+from data.idempotency import idempotent
 from django.db.models import Q
 from django.db import transaction
+from django.conf import settings
+from django.utils.cache import patch_cache_control
 from data.jobfactory import create_job_factory_for_answer_set
-from data.mailer import EmailMessageSender, JobMailer
+from data.mailer import EmailMessageSender, queue_job_state_notification
 from data.importers import WorkflowQuestionnaireImporter, ImporterException
 from rest_framework.authtoken.models import Token
+import json
 
 
 class DDSViewSet(viewsets.ReadOnlyModelViewSet):
@@ -24,7 +30,7 @@ class DDSViewSet(viewsets.ReadOnlyModelViewSet):
     def _ds_operation(self, func, *args):
         try:
             return func(*args)
-        except WrappedDataServiceException:
+        except (WrappedDataServiceException, DataServiceUnavailable):
             raise # passes along status code, e.g. 404
         except Exception as e:
             raise DataServiceUnavailable(e)
@@ -66,6 +72,39 @@ class DDSResourcesViewSet(DDSViewSet):
             raise BespinAPIException(400, 'Getting dds-resources requires either a project_id or folder_id query parameter')
 
 
+class AdminDDSCircuitBreakerViewSet(viewsets.GenericViewSet):
+    """
+    Shows the state and counters of the circuit breaker protecting DukeDS calls in this process.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    serializer_class = CircuitBreakerSerializer
+
+    def list(self, request):
+        serializer = self.get_serializer([dds_circuit_breaker], many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class HeaderPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination that keeps the response body a list.
+    The total count and next/previous page links are returned in the X-Total-Count and Link headers.
+    Without a page_size class attribute results are only paginated when the page_size query parameter is given.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_paginated_response(self, data):
+        response = Response(data)
+        response['X-Total-Count'] = self.page.paginator.count
+        links = []
+        for rel, url in (('next', self.get_next_link()), ('prev', self.get_previous_link())):
+            if url:
+                links.append('<{}>; rel="{}"'.format(url, rel))
+        if links:
+            response['Link'] = ', '.join(links)
+        return response
+
+
 class ExcludeDeprecatedWorkflowsMixin(object):
     """
     Mixin to dynamically build a queryset that excludes deprecated workflows from the listing
@@ -97,7 +136,7 @@ class ExcludeDeprecatedWorkflowsMixin(object):
 
 class WorkflowsViewSet(ExcludeDeprecatedWorkflowsMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = Workflow.objects.all()
+    queryset = Workflow.objects.prefetch_related('versions')
     serializer_class = WorkflowSerializer
     filter_backends = (DjangoFilterBackend,)
     filter_fields = ('tag','state', )
@@ -106,19 +145,19 @@ class WorkflowsViewSet(ExcludeDeprecatedWorkflowsMixin, viewsets.ReadOnlyModelVi
 
 class WorkflowVersionSortedListMixin(object):
     """
-    Overrides list method and returns a list that is sorted using WorkflowVersion.sort_workflow_then_version_key.
-    NOTE: This removes DRF pagination support.
+    Orders versions by workflow and then by the stored WorkflowVersion.version_sort_key in SQL.
+    Pagination is applied when the page_size query parameter is given.
     """
-    def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        items = sorted(queryset, key=WorkflowVersion.sort_workflow_then_version_key)
-        serializer = self.get_serializer(items, many=True)
-        return Response(serializer.data)
+    pagination_class = HeaderPageNumberPagination
+
+    def filter_queryset(self, queryset):
+        queryset = super(WorkflowVersionSortedListMixin, self).filter_queryset(queryset)
+        return WorkflowVersion.sorted_queryset(queryset)
 
 
 class WorkflowVersionsViewSet(WorkflowVersionSortedListMixin, ExcludeDeprecatedWorkflowsMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = (permissions.IsAuthenticated,)
-    queryset = WorkflowVersion.objects.all()
+    queryset = WorkflowVersion.objects.with_related().prefetch_related('questionnaires')
     serializer_class = WorkflowVersionSerializer
     filter_backends = (DjangoFilterBackend,)
     filter_fields = ('workflow', 'enable_ui', 'workflow__state')
@@ -132,24 +171,90 @@ class WorkflowVersionsViewSet(WorkflowVersionSortedListMixin, ExcludeDeprecatedW
         return Response(serializer.data)
 
 
-class WorkflowMethodsDocumentViewSet(viewsets.ReadOnlyModelViewSet):
+class WorkflowMethodsDocumentMixin(object):
+    """
+    Serves methods documents with their pre-rendered HTML and long-lived Cache-Control headers.
+    GET <id>/html/ returns the rendered HTML itself as text/html.
+    """
     permission_classes = (permissions.IsAuthenticated,)
     queryset = WorkflowMethodsDocument.objects.all()
     serializer_class = WorkflowMethodsDocumentSerializer
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(WorkflowMethodsDocumentMixin, self).finalize_response(request, response, *args, **kwargs)
+        if request.method == 'GET' and status.is_success(response.status_code):
+            patch_cache_control(response, private=True, max_age=settings.METHODS_DOCUMENT_CACHE_SECONDS)
+        return response
+
+    @detail_route(methods=['get'], renderer_classes=(StaticHTMLRenderer,))
+    def html(self, request, pk=None):
+        methods_document = self.get_object()
+        return Response(methods_document.content_html, content_type='text/html')
+
+
+class WorkflowMethodsDocumentViewSet(WorkflowMethodsDocumentMixin, viewsets.ReadOnlyModelViewSet):
+    pass
 
-class WorkflowVersionToolDetailsViewSet(viewsets.ReadOnlyModelViewSet):
+
+class WorkflowVersionToolDetailsFilterMixin(object):
+    """
+    Filters tool details by the tools they contain using the indexed WorkflowVersionTool rows.
+    Query parameters: tool_name, tool_version (exact), tool_version_min (inclusive) and tool_version_max (exclusive).
+    Version ranges compare the zero padded parts of versions, so tool_version_max=1.9 includes 1.8.2 but not 1.10.
+    """
+    def filter_queryset(self, queryset):
+        queryset = super(WorkflowVersionToolDetailsFilterMixin, self).filter_queryset(queryset)
+        params = self.request.query_params
+        tool_filters = {}
+        if params.get('tool_name'):
+            tool_filters['name'] = params['tool_name']
+        if params.get('tool_version'):
+            tool_filters['version'] = params['tool_version']
+        if params.get('tool_version_min'):
+            tool_filters['version_sort_key__gte'] = WorkflowVersion.make_version_sort_key(params['tool_version_min'])
+        if params.get('tool_version_max'):
+            tool_filters['version_sort_key__lt'] = WorkflowVersion.make_version_sort_key(params['tool_version_max'])
+        if tool_filters:
+            tools = WorkflowVersionTool.objects.filter(**tool_filters)
+            queryset = queryset.filter(id__in=tools.values('tool_details_id'))
+        return queryset
+
+
+class WorkflowVersionToolDetailsViewSet(WorkflowVersionToolDetailsFilterMixin, viewsets.ReadOnlyModelViewSet):
     permission_class = (permissions.IsAuthenticated,)
     queryset = WorkflowVersionToolDetails.objects.all()
     serializer_class = WorkflowVersionToolDetailsSerializer
 
 
-class JobsViewSet(mixins.RetrieveModelMixin,
+class JobOrderFilterMixin(object):
+    """
+    Filters jobs whose job order contains the JSON object passed in the job_order query parameter,
+    e.g. ?job_order={"threads": 16}. Uses the GIN index on Job.job_order_data.
+    """
+    def filter_queryset(self, queryset):
+        queryset = super(JobOrderFilterMixin, self).filter_queryset(queryset)
+        job_order = self.request.query_params.get('job_order')
+        if job_order:
+            try:
+                job_order_data = json.loads(job_order)
+            except ValueError:
+                job_order_data = None
+            if not isinstance(job_order_data, dict):
+                raise BespinAPIException(status.HTTP_400_BAD_REQUEST,
+                                         'The job_order query parameter must be a JSON object.')
+            queryset = queryset.filter(job_order_data__contains=job_order_data)
+        return queryset
+
+
+class JobsViewSet(JobOrderFilterMixin,
+                  mixins.RetrieveModelMixin,
                   mixins.ListModelMixin,
                   mixins.DestroyModelMixin,
                   viewsets.GenericViewSet):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = JobSerializer
+    filter_backends = (DjangoFilterBackend,)
+    filter_fields = ('workflow_version',)
 
     # If job is in NEW or AUTHORIZED states it can be truly deleted
     DESTROY_ALLOWED_STATES = (Job.JOB_STATE_NEW, Job.JOB_STATE_AUTHORIZED,)
@@ -159,11 +264,15 @@ class JobsViewSet(mixins.RetrieveModelMixin,
     def get_queryset(self):
         return Job.objects.filter(user=self.request.user).exclude(state=Job.JOB_STATE_DELETED)
 
+    @idempotent
     @detail_route(methods=['post'])
     def start(self, request, pk=None):
+        """
+        Queues the job to be started by the job worker, the job state moves to STARTING once the worker is done.
+        """
         try:
-            LandoJob(pk, request.user).start()
-            return self._serialize_job_response(pk)
+            LandoJob(pk, request.user).queue_start()
+            return self._serialize_job_response(pk, job_status=status.HTTP_202_ACCEPTED)
         except Job.DoesNotExist:
             raise NotFound("Job {} not found.".format(pk))
 
@@ -175,11 +284,15 @@ class JobsViewSet(mixins.RetrieveModelMixin,
         except Job.DoesNotExist:
             raise NotFound("Job {} not found.".format(pk))
 
+    @idempotent
     @detail_route(methods=['post'])
     def restart(self, request, pk=None):
+        """
+        Queues the job to be restarted by the job worker, the job state moves to RESTARTING once the worker is done.
+        """
         try:
-            LandoJob(pk, request.user).restart()
-            return self._serialize_job_response(pk)
+            LandoJob(pk, request.user).queue_restart()
+            return self._serialize_job_response(pk, job_status=status.HTTP_202_ACCEPTED)
         except Job.DoesNotExist:
             raise NotFound("Job {} not found.".format(pk))
 
@@ -237,22 +350,27 @@ class JobsViewSet(mixins.RetrieveModelMixin,
             raise BespinAPIException(400, 'You may only delete jobs in NEW, AUTHORIZED , CANCEL, ERROR, or FINISHED states.')
 
 
-class AdminJobsViewSet(viewsets.ModelViewSet):
+class JobStateNotificationMixin(object):
+    """
+    Overrides perform_update to queue a notification when the job state changes.
+    The notification is saved in the same transaction as the change and mailed by the sendjobnotifications command
+    so slow mail delivery does not slow down job updates.
+    """
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            original_state = Job.objects.select_for_update().values_list('state', flat=True) \
+                .get(pk=serializer.instance.pk)
+            job = serializer.save()
+            if original_state != job.state:
+                queue_job_state_notification(job)
+
+
+class AdminJobsViewSet(JobStateNotificationMixin, JobOrderFilterMixin, viewsets.ModelViewSet):
     permission_classes = (permissions.IsAdminUser,)
     serializer_class = AdminJobSerializer
     queryset = Job.objects.all()
     filter_backends = (DjangoFilterBackend,)
-    filter_fields = ('vm_instance_name',)
-
-    def perform_update(self, serializer):
-        # Overrides perform update to notify about state changes
-        # If the job state changed, notify about the state change
-        original_state = self.get_object().state
-        serializer.save()
-        new_state = self.get_object().state
-        if original_state != new_state:
-            mailer = JobMailer(self.get_object())
-            mailer.mail_current_state()
+    filter_fields = ('vm_instance_name', 'workflow_version',)
 
 
 class DDSJobInputFileViewSet(viewsets.ModelViewSet):
@@ -408,6 +526,7 @@ class JobAnswerSetViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return JobAnswerSet.objects.filter(user=self.request.user)
 
+    @idempotent
     @transaction.atomic
     @detail_route(methods=['post'], serializer_class=JobSerializer, url_path='create-job')
     def create_job(self, request, pk=None):
@@ -439,10 +558,28 @@ class ShareGroupViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ShareGroup.objects.all()
 
 
-class AdminEmailMessageViewSet(viewsets.ModelViewSet):
+class EmailMessagePagination(HeaderPageNumberPagination):
+    page_size = settings.EMAIL_MESSAGE_PAGE_SIZE
+
+
+class DDSInputJobsPagination(HeaderPageNumberPagination):
+    page_size = settings.DDS_INPUT_JOBS_PAGE_SIZE
+
+
+class AdminEmailMessageMixin(object):
+    """
+    Paginated list of email messages filterable by state, recipient and creation time,
+    with actions to send one message or queue all failed messages to be retried.
+    """
     permission_classes = (permissions.IsAdminUser,)
-    serializer_class = AdminEmailMessageSerializer
-    queryset = EmailMessage.objects.all()
+    queryset = EmailMessage.objects.order_by('id')
+    pagination_class = EmailMessagePagination
+    filter_backends = (DjangoFilterBackend,)
+    filter_fields = {
+        'state': ['exact'],
+        'to_email': ['exact'],
+        'created': ['gte', 'lt'],
+    }
 
     @detail_route(methods=['post'], url_path='send')
     def send(self, request, pk=None):
@@ -455,6 +592,26 @@ class AdminEmailMessageViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @list_route(methods=['post'], url_path='retry-errors')
+    def retry_errors(self, request):
+        """
+        Reset all email messages in ERROR state to NEW with their attempts cleared, to be sent by sendemails.
+        Responds with the reset messages.
+        """
+        with transaction.atomic():
+            message_ids = list(EmailMessage.objects.select_for_update()
+                               .filter(state=EmailMessage.MESSAGE_STATE_ERROR).values_list('id', flat=True))
+            # messages bespin-mailer failed to send are handed to the batch sender as well
+            EmailMessage.objects.filter(id__in=message_ids).update(
+                state=EmailMessage.MESSAGE_STATE_NEW, send_attempts=0, next_attempt=None, queued_to_mailer=False)
+        retried_messages = EmailMessage.objects.filter(id__in=message_ids).order_by('id')
+        serializer = self.get_serializer(retried_messages, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AdminEmailMessageViewSet(AdminEmailMessageMixin, viewsets.ModelViewSet):
+    serializer_class = AdminEmailMessageSerializer
+
 
 class AdminEmailTemplateViewSet(viewsets.ModelViewSet):
     permission_classes = (permissions.IsAdminUser,)
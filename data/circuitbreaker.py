@@ -0,0 +1,170 @@
+"""
+Circuit breaker that stops calling a remote service (DukeDS) while it is failing.
+When too many recent calls fail the breaker opens and calls are rejected immediately with DataServiceUnavailable
+instead of tying up a web worker. After a cool down period a single probe call is allowed through(half-open),
+if it succeeds the breaker closes again otherwise it re-opens.
+"""
+from data.exceptions import DataServiceUnavailable
+from collections import deque
+from functools import wraps
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+SERVER_ERROR_STATUS_CODE = 500
+
+
+class CircuitBreaker(object):
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_rate_threshold, minimum_calls, window_size, reset_seconds,
+                 failure_exceptions=(IOError,), clock=time.time):
+        """
+        :param name: str: name of the service this breaker protects
+        :param failure_rate_threshold: float: fraction (0.0-1.0) of failed calls in the window that opens the breaker
+        :param minimum_calls: int: number of calls required in the window before the failure rate is checked
+        :param window_size: int: number of most recent call outcomes used to calculate the failure rate
+        :param reset_seconds: int: seconds to wait while open before allowing a probe call
+        :param failure_exceptions: tuple: exception types without a status_code that count as failures
+        :param clock: func(): returns the current time in seconds
+        """
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.reset_seconds = reset_seconds
+        self.failure_exceptions = failure_exceptions
+        self.clock = clock
+        self.state = self.STATE_CLOSED
+        self.opened_at = None
+        self.probe_in_progress = False
+        self.recent_outcomes = deque(maxlen=window_size)
+        self.lock = threading.Lock()
+        # counters
+        self.total_calls = 0
+        self.total_successes = 0
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.times_opened = 0
+
+    @property
+    def failure_rate(self):
+        if not self.recent_outcomes:
+            return 0.0
+        failures = len([success for success in self.recent_outcomes if not success])
+        return float(failures) / len(self.recent_outcomes)
+
+    @property
+    def current_state(self):
+        with self.lock:
+            if self.state == self.STATE_OPEN and self._reset_time_elapsed():
+                return self.STATE_HALF_OPEN
+            return self.state
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run func if the breaker allows it, recording the outcome.
+        :param func: function to call
+        :return: value returned by func
+        """
+        self._before_call()
+        outcome_recorded = False
+        try:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._record_outcome(success=not self.is_failure(e))
+                outcome_recorded = True
+                raise
+            self._record_outcome(success=True)
+            outcome_recorded = True
+            return result
+        finally:
+            if not outcome_recorded:
+                # func was interrupted by a BaseException such as KeyboardInterrupt or SystemExit
+                self._release_probe()
+
+    def is_failure(self, exception):
+        """
+        Server errors (5XX), timeouts and connection errors count against the service.
+        Client errors (such as 404 not found) show the service is healthy.
+        :param exception: Exception: raised by the protected call
+        :return: boolean: True if this exception should count against the service
+        """
+        status_code = getattr(exception, 'status_code', None)
+        if isinstance(status_code, int):
+            return status_code >= SERVER_ERROR_STATUS_CODE
+        return isinstance(exception, self.failure_exceptions)
+
+    def reset(self):
+        with self.lock:
+            self.state = self.STATE_CLOSED
+            self.opened_at = None
+            self.probe_in_progress = False
+            self.recent_outcomes.clear()
+
+    def _reset_time_elapsed(self):
+        return self.clock() - self.opened_at >= self.reset_seconds
+
+    def _before_call(self):
+        with self.lock:
+            if self.state == self.STATE_OPEN:
+                if self._reset_time_elapsed():
+                    self.state = self.STATE_HALF_OPEN
+                else:
+                    self._reject()
+            if self.state == self.STATE_HALF_OPEN:
+                if self.probe_in_progress:
+                    self._reject()
+                self.probe_in_progress = True
+            # rejected calls are only counted in total_rejected
+            self.total_calls += 1
+
+    def _release_probe(self):
+        with self.lock:
+            if self.state == self.STATE_HALF_OPEN:
+                self.probe_in_progress = False
+
+    def _reject(self):
+        self.total_rejected += 1
+        raise DataServiceUnavailable('{} is unavailable, try again later.'.format(self.name))
+
+    def _record_outcome(self, success):
+        with self.lock:
+            if success:
+                self.total_successes += 1
+            else:
+                self.total_failures += 1
+            if self.state == self.STATE_HALF_OPEN:
+                self.probe_in_progress = False
+                if success:
+                    logger.info('Closing %s circuit breaker after successful probe.', self.name)
+                    self.state = self.STATE_CLOSED
+                    self.recent_outcomes.clear()
+                else:
+                    self._open()
+            else:
+                self.recent_outcomes.append(success)
+                if self.state == self.STATE_CLOSED and self._failure_threshold_reached():
+                    self._open()
+
+    def _failure_threshold_reached(self):
+        return len(self.recent_outcomes) >= self.minimum_calls and \
+               self.failure_rate >= self.failure_rate_threshold
+
+    def _open(self):
+        logger.warning('Opening %s circuit breaker.', self.name)
+        self.state = self.STATE_OPEN
+        self.opened_at = self.clock()
+        self.times_opened += 1
+
+    def protect(self, func):
+        """
+        Decorator that routes calls to func through this circuit breaker.
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(func, *args, **kwargs)
+        return wrapper
@@ -0,0 +1,93 @@
+"""
+Parses CWL documents with cwltool in a separate Python interpreter.
+The importers run this module with `python -m data.cwlparser <url> [<path>]` so the memory cwltool and schema-salad
+allocate is released when the worker exits instead of staying in the long-lived web server process.
+It writes the parse_cwl_document results to stdout as JSON and exits non-zero on failure.
+This module does not import Django so the worker starts without loading the project settings.
+"""
+from cwltool.context import LoadingContext
+from cwltool.workflow import default_make_tool
+from cwltool.resolver import tool_resolver
+from cwltool.load_tool import load_tool
+from schema_salad.ref_resolver import DefaultFetcher
+import functools
+import json
+import sys
+
+# Root level CWL document keys available from CWLDocument.get
+CWL_DOCUMENT_ROOT_KEYS = ('label', 'doc')
+
+
+class DownloadedDocumentFetcher(DefaultFetcher):
+    """
+    Fetcher that reads one URL from a local copy already downloaded, so the document is parsed from the
+    exact bytes it is cached under while ids in the document stay relative to its URL.
+    """
+    def __init__(self, cache, session, url, path):
+        super(DownloadedDocumentFetcher, self).__init__(cache, session)
+        self.url = url
+        self.path = path
+
+    def fetch_text(self, url):
+        if url.split('#')[0] == self.url:
+            with open(self.path, encoding='utf-8') as infile:
+                return infile.read()
+        return super(DownloadedDocumentFetcher, self).fetch_text(url)
+
+
+def parse_cwl_document(url, path=None):
+    """
+    Parse a CWL document with cwltool and extract the parts used by the importers as plain JSON data
+    :param url: The URL to a CWL document to be parsed
+    :param path: str: local copy of the document at url to parse instead of downloading it
+    :return: dict: input fields, root level label and doc, and the hints of every tool
+    """
+    context = LoadingContext({"construct_tool_object": default_make_tool,
+                              "resolver": tool_resolver,
+                              "disable_js_validation": True})
+    if path:
+        context.fetcher_constructor = functools.partial(DownloadedDocumentFetcher, url=url, path=path)
+    parsed = load_tool(url + '#main', context)
+    summary = {
+        'input_fields': parsed.inputs_record_schema.get('fields'),
+        'tool': {key: parsed.tool.get(key) for key in CWL_DOCUMENT_ROOT_KEYS},
+        'hints': find_hints(parsed),
+    }
+    # round trip through json to convert the ruamel.yaml types cwltool returns to plain data
+    return json.loads(json.dumps(summary))
+
+
+def find_hints(workflow_node):
+    """
+    Retrieve the hints of every tool in a cwltool workflow or tool object
+    :param workflow_node: cwltool Process
+    :return: [dict]: list of hints
+    """
+    hints = []
+    _find_hints_recursive(hints, workflow_node)
+    return hints
+
+
+def _find_hints_recursive(hints, workflow_node):
+    if hasattr(workflow_node, 'steps'):
+        for step in workflow_node.steps:
+            _find_hints_recursive(hints, step.embedded_tool)
+    else:
+        if workflow_node.hints:
+            hints.extend(workflow_node.hints)
+
+
+def main(parse=parse_cwl_document, argv=None, stdout=sys.stdout):
+    """
+    Worker entry point, parses the document named by the command line arguments and writes the results as JSON.
+    :param parse: func(url, path): returns the parse results
+    :param argv: [str]: url and optional path of a local copy, defaults to sys.argv[1:]
+    :param stdout: file to write the JSON results to
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    json.dump(parse(*argv), stdout)
+
+
+if __name__ == '__main__':
+    main()
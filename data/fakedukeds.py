@@ -0,0 +1,318 @@
+"""
+Local stand-in for the DukeDS REST API.
+Implements the subset of endpoints used by ddsc in data/util.py (projects, children, permissions, current user,
+file urls and api token exchange) with configurable latency and dataset size.
+Intended for benchmarking and development, not for storing real data.
+"""
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import threading
+import json
+import math
+import time
+import re
+
+FAKE_API_TOKEN = 'fake-dukeds-api-token'
+FAKE_USER_ID = 'fake-user-id'
+API_TOKEN_LIFETIME_SECONDS = 60 * 60
+DEFAULT_PAGE_SIZE = 100
+
+
+class FakeDukeDSData(object):
+    """
+    Generated projects, folders and files served by FakeDukeDSServer.
+    Each project contains folders_per_project folders at the root, each containing files_per_folder files.
+    """
+    def __init__(self, project_count=10, folders_per_project=5, files_per_folder=20):
+        self.project_count = project_count
+        self.folders_per_project = folders_per_project
+        self.files_per_folder = files_per_folder
+        self.permissions = {}
+
+    @staticmethod
+    def project_id(project_num):
+        return 'project-{}'.format(project_num)
+
+    @staticmethod
+    def folder_id(project_num, folder_num):
+        return 'folder-{}-{}'.format(project_num, folder_num)
+
+    @staticmethod
+    def file_id(project_num, folder_num, file_num):
+        return 'file-{}-{}-{}'.format(project_num, folder_num, file_num)
+
+    def projects(self):
+        return [self.project(self.project_id(num)) for num in range(self.project_count)]
+
+    def project(self, project_id):
+        project_num = self._parse_nums('project', project_id, 1)
+        if project_num is None:
+            return None
+        return {
+            'kind': 'dds-project',
+            'id': project_id,
+            'name': 'Project {}'.format(project_num[0]),
+            'description': 'Generated project {}'.format(project_num[0]),
+            'is_deleted': False,
+        }
+
+    def project_children(self, project_id):
+        project_num = self._parse_nums('project', project_id, 1)
+        if project_num is None:
+            return None
+        return [self._folder_dict(project_num[0], folder_num) for folder_num in range(self.folders_per_project)]
+
+    def folder_children(self, folder_id):
+        nums = self._parse_nums('folder', folder_id, 2)
+        if nums is None:
+            return None
+        project_num, folder_num = nums
+        return [self.file(self.file_id(project_num, folder_num, file_num)) for file_num in range(self.files_per_folder)]
+
+    def file(self, file_id):
+        nums = self._parse_nums('file', file_id, 3)
+        if nums is None:
+            return None
+        project_num, folder_num, file_num = nums
+        return {
+            'kind': 'dds-file',
+            'id': file_id,
+            'name': 'file{}.txt'.format(file_num),
+            'project': {'id': self.project_id(project_num)},
+            'parent': {'kind': 'dds-folder', 'id': self.folder_id(project_num, folder_num)},
+            'current_version': {
+                'id': 'version-{}'.format(file_id),
+                'version': 1,
+                'upload': {'id': 'upload-{}'.format(file_id), 'size': 1024 * (file_num + 1)},
+            },
+        }
+
+    def _folder_dict(self, project_num, folder_num):
+        return {
+            'kind': 'dds-folder',
+            'id': self.folder_id(project_num, folder_num),
+            'name': 'folder{}'.format(folder_num),
+            'project': {'id': self.project_id(project_num)},
+            'parent': {'kind': 'dds-project', 'id': self.project_id(project_num)},
+        }
+
+    def _parse_nums(self, prefix, item_id, count):
+        match = re.match('^{}{}$'.format(prefix, r'-(\d+)' * count), item_id)
+        if not match:
+            return None
+        nums = [int(num) for num in match.groups()]
+        if nums[0] >= self.project_count:
+            return None
+        if count > 1 and nums[1] >= self.folders_per_project:
+            return None
+        if count > 2 and nums[2] >= self.files_per_folder:
+            return None
+        return nums
+
+
+class FakeDukeDSRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes DukeDS API requests to FakeDukeDSData. The server is available as self.server.
+    """
+    ROUTES = [
+        ('POST', '^/software_agents/api_token$', 'software_agent_api_token'),
+        ('GET', '^/user/api_token$', 'user_api_token'),
+        ('GET', '^/current_user$', 'current_user'),
+        ('GET', '^/projects$', 'list_projects'),
+        ('GET', '^/projects/(?P<project_id>[^/]+)$', 'get_project'),
+        ('GET', '^/projects/(?P<project_id>[^/]+)/children$', 'list_project_children'),
+        ('GET', '^/folders/(?P<folder_id>[^/]+)/children$', 'list_folder_children'),
+        ('GET', '^/projects/(?P<project_id>[^/]+)/permissions/(?P<user_id>[^/]+)$', 'get_permission'),
+        ('PUT', '^/projects/(?P<project_id>[^/]+)/permissions/(?P<user_id>[^/]+)$', 'set_permission'),
+        ('GET', '^/files/(?P<file_id>[^/]+)$', 'get_file'),
+        ('GET', '^/files/(?P<file_id>[^/]+)/url$', 'get_file_url'),
+    ]
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(FakeDukeDSRequestHandler, self).log_message(format, *args)
+
+    def _dispatch(self, method):
+        self.server.simulate_latency()
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path
+        if path.startswith(self.server.url_prefix):
+            path = path[len(self.server.url_prefix):]
+        self.query_params = {key: values[0] for key, values in parse_qs(parsed_url.query).items()}
+        for route_method, pattern, handler_name in self.ROUTES:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                getattr(self, handler_name)(**match.groupdict())
+                return
+        self._send_json(404, {'error': 404, 'reason': 'Not Found', 'suggestion': path})
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8')
+
+    def _send_json(self, status_code, data, headers=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_page(self, items):
+        per_page = int(self.query_params.get('per_page', DEFAULT_PAGE_SIZE))
+        page = int(self.query_params.get('page', 1))
+        total_pages = max(1, int(math.ceil(len(items) / float(per_page))))
+        start = (page - 1) * per_page
+        headers = {
+            'x-total': str(len(items)),
+            'x-total-pages': str(total_pages),
+            'x-page': str(page),
+            'x-per-page': str(per_page),
+        }
+        self._send_json(200, {'results': items[start:start + per_page]}, headers)
+
+    def _send_not_found(self):
+        self._send_json(404, {'error': 404, 'reason': 'Not Found', 'suggestion': ''})
+
+    def software_agent_api_token(self):
+        self._read_body()
+        self._send_json(201, {
+            'api_token': FAKE_API_TOKEN,
+            'expires_on': time.time() + API_TOKEN_LIFETIME_SECONDS,
+            'time_to_live': API_TOKEN_LIFETIME_SECONDS,
+        })
+
+    def user_api_token(self):
+        self._send_json(200, {
+            'api_token': FAKE_API_TOKEN,
+            'expires_on': time.time() + API_TOKEN_LIFETIME_SECONDS,
+            'time_to_live': API_TOKEN_LIFETIME_SECONDS,
+        })
+
+    def current_user(self):
+        self._send_json(200, {
+            'id': FAKE_USER_ID,
+            'username': 'fakeuser',
+            'full_name': 'Fake User',
+            'email': 'fakeuser@example.com',
+            'first_name': 'Fake',
+            'last_name': 'User',
+        })
+
+    def list_projects(self):
+        self._send_page(self.server.data.projects())
+
+    def get_project(self, project_id):
+        project = self.server.data.project(project_id)
+        if project:
+            self._send_json(200, project)
+        else:
+            self._send_not_found()
+
+    def _send_children(self, children):
+        if children is None:
+            self._send_not_found()
+            return
+        name_contains = self.query_params.get('name_contains')
+        if name_contains:
+            children = [child for child in children if name_contains in child['name']]
+        self._send_page(children)
+
+    def list_project_children(self, project_id):
+        self._send_children(self.server.data.project_children(project_id))
+
+    def list_folder_children(self, folder_id):
+        self._send_children(self.server.data.folder_children(folder_id))
+
+    def get_permission(self, project_id, user_id):
+        auth_role = self.server.data.permissions.get((project_id, user_id))
+        if auth_role:
+            self._send_json(200, {
+                'project': {'id': project_id},
+                'user': {'id': user_id},
+                'auth_role': {'id': auth_role},
+            })
+        else:
+            self._send_not_found()
+
+    def set_permission(self, project_id, user_id):
+        params = parse_qs(self._read_body())
+        auth_role = params.get('auth_role[id]', ['file_downloader'])[0]
+        self.server.data.permissions[(project_id, user_id)] = auth_role
+        self._send_json(200, {
+            'project': {'id': project_id},
+            'user': {'id': user_id},
+            'auth_role': {'id': auth_role},
+        })
+
+    def get_file(self, file_id):
+        file_dict = self.server.data.file(file_id)
+        if file_dict:
+            self._send_json(200, file_dict)
+        else:
+            self._send_not_found()
+
+    def get_file_url(self, file_id):
+        if not self.server.data.file(file_id):
+            self._send_not_found()
+            return
+        expires = int(time.time() + API_TOKEN_LIFETIME_SECONDS)
+        self._send_json(200, {
+            'http_verb': 'GET',
+            'host': 'http://{}:{}'.format(*self.server.server_address),
+            'url': '/storage/{}?temp_url_sig=fake&temp_url_expires={}'.format(file_id, expires),
+            'http_headers': {},
+        })
+
+
+class FakeDukeDSServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server that answers like DukeDS after waiting latency seconds.
+    """
+    daemon_threads = True
+
+    def __init__(self, data, host='127.0.0.1', port=0, latency=0.0, url_prefix='/api/v1', verbose=False):
+        """
+        :param data: FakeDukeDSData: projects, folders and files to serve
+        :param host: str: host to listen on
+        :param port: int: port to listen on, 0 picks an unused port
+        :param latency: float: seconds to wait before responding to each request
+        :param url_prefix: str: path prefix of the API (the api_root of a DDSEndpoint)
+        :param verbose: boolean: log each request to stderr
+        """
+        HTTPServer.__init__(self, (host, port), FakeDukeDSRequestHandler)
+        self.data = data
+        self.latency = latency
+        self.url_prefix = url_prefix
+        self.verbose = verbose
+        self.thread = None
+
+    @property
+    def api_root(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}{}'.format(host, port, self.url_prefix)
+
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def start_in_thread(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
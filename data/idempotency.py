@@ -0,0 +1,91 @@
+"""
+Support for the Idempotency-Key request header.
+When a client retries a request with the same key the stored response is returned instead of running the view again,
+so a retried create-job or start can not create a second job or send a second lando message.
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from data.models import IdempotencyKey
+from data.exceptions import BespinAPIException
+from functools import wraps
+import datetime
+import hashlib
+import json
+
+IDEMPOTENCY_KEY_META_NAME = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENT_REPLAYED_HEADER = 'Idempotent-Replayed'
+KEY_TOO_LONG_MSG = "Idempotency-Key must be at most {} characters.".format(IDEMPOTENCY_KEY_MAX_LENGTH)
+KEY_REUSED_MSG = "Idempotency-Key has already been used for a different request."
+KEY_IN_PROGRESS_MSG = "A request with this Idempotency-Key is still being processed."
+
+
+def hash_request_data(request):
+    """
+    :param request: rest_framework Request
+    :return: str: SHA-256 hex digest of the request data
+    """
+    content = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def idempotent(view_method):
+    """
+    Decorator for viewset/view methods that replays the original response when a request is retried with the same
+    Idempotency-Key header. Requests without the header are handled normally.
+    Only successful (2XX) responses are stored, so a request that failed can be retried with the same key.
+    """
+    @wraps(view_method)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(IDEMPOTENCY_KEY_META_NAME)
+        if not key:
+            return view_method(view, request, *args, **kwargs)
+        if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise BespinAPIException(status.HTTP_400_BAD_REQUEST, KEY_TOO_LONG_MSG)
+        request_hash = hash_request_data(request)
+        now = timezone.now()
+        IdempotencyKey.objects.filter(expires__lte=now).delete()
+        try:
+            with transaction.atomic():
+                idempotency_key = IdempotencyKey.objects.create(
+                    user=request.user, key=key, method=request.method, path=request.path,
+                    request_hash=request_hash,
+                    expires=now + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS))
+        except IntegrityError:
+            existing_key = IdempotencyKey.objects.get(user=request.user, key=key)
+            return replay_response(existing_key, request, request_hash)
+        try:
+            response = view_method(view, request, *args, **kwargs)
+        except Exception:
+            idempotency_key.delete()
+            raise
+        if status.is_success(response.status_code):
+            idempotency_key.response_status_code = response.status_code
+            idempotency_key.response_data = json.loads(json.dumps(response.data, cls=DjangoJSONEncoder))
+            idempotency_key.save()
+        else:
+            idempotency_key.delete()
+        return response
+    return wrapper
+
+
+def replay_response(idempotency_key, request, request_hash):
+    """
+    Build the response for a request that reused an Idempotency-Key.
+    :param idempotency_key: IdempotencyKey: stored key
+    :param request: rest_framework Request: request that reused the key
+    :param request_hash: str: hash of the request data
+    :return: Response: stored response
+    """
+    if idempotency_key.method != request.method or idempotency_key.path != request.path or \
+            idempotency_key.request_hash != request_hash:
+        raise BespinAPIException(status.HTTP_422_UNPROCESSABLE_ENTITY, KEY_REUSED_MSG)
+    if idempotency_key.response_status_code is None:
+        raise BespinAPIException(status.HTTP_409_CONFLICT, KEY_IN_PROGRESS_MSG)
+    response = Response(idempotency_key.response_data, status=idempotency_key.response_status_code)
+    response[IDEMPOTENT_REPLAYED_HEADER] = 'true'
+    return response
@@ -1,17 +1,26 @@
 from data.models import Workflow, WorkflowVersion, JobQuestionnaire, JobFlavor, VMProject, \
-    JobSettings, ShareGroup, WorkflowMethodsDocument, JobQuestionnaireType
-from cwltool.context import LoadingContext
-from cwltool.workflow import default_make_tool
-from cwltool.resolver import tool_resolver
-from cwltool.load_tool import load_tool
+    JobSettings, ShareGroup, WorkflowMethodsDocument, JobQuestionnaireType, DOICitation
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 import sys
+import os
+import hashlib
+import tempfile
+import subprocess
 import requests
 import json
+import pkg_resources
 from habanero import cn
 from jinja2 import Template
 from django.template.defaultfilters import slugify
 SCHEMA_ORG_CITATION = 'https://schema.org/citation'
 HTTPS_DOI_URL = 'https://dx.doi.org/'
+# Module run by the CWL parser worker interpreter
+CWL_PARSER_MODULE = 'data.cwlparser'
+# Default for CWLDocument cache_dir, use settings.CWL_DOCUMENT_CACHE_DIR
+CWL_DOCUMENT_CACHE_DIR_SETTING = object()
+# Versions of the libraries that parse CWL documents, part of the key parsed documents are cached under
+CWL_PARSER_VERSION = ' '.join(pkg_resources.get_distribution(name).version for name in ('cwltool', 'schema-salad'))
 import logging
 logger = logging.getLogger(__name__)
 
@@ -40,47 +49,139 @@ class BaseCreator(object):
         self.stdout.write(message)
 
 
+def parse_cwl_document_in_subprocess(url, path=None):
+    """
+    Run parse_cwl_document in a separate CWL_PARSER_PYTHON interpreter that returns only the plain JSON results.
+    The memory cwltool and schema-salad allocate is released when the worker exits
+    instead of staying in the long-lived web server process. A new interpreter is started rather than forking
+    because under mod_wsgi the web server process is an Apache child.
+    :param url: The URL to a CWL document to be parsed
+    :param path: str: local copy of the document at url to parse instead of downloading it
+    :return: dict: results of parse_cwl_document
+    """
+    args = [settings.CWL_PARSER_PYTHON, '-m', CWL_PARSER_MODULE, url]
+    if path:
+        args.append(path)
+    try:
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+                                cwd=settings.BASE_DIR, timeout=settings.CWL_PARSER_TIMEOUT_SECONDS)
+    except (OSError, subprocess.SubprocessError) as e:
+        raise ImporterException('Unable to run the CWL parser for {}'.format(url), e)
+    if result.returncode != 0:
+        if result.returncode < 0:
+            error = 'parser was killed by signal {}'.format(-result.returncode)
+        else:
+            error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'parser failed'
+        raise ImporterException('Unable to parse CWL document {}: {}'.format(url, error), result.stderr)
+    try:
+        return json.loads(result.stdout)
+    except ValueError as e:
+        raise ImporterException('Unable to read CWL parser results for {}'.format(url), e)
+
+
 class CWLDocument(object):
     """
-    Simple CWL document parser
+    Simple CWL document parser.
+    Parsed results are cached on disk by the SHA-256 of the document contents and the parser versions
+    so unchanged documents are only parsed by cwltool once.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, cache_dir=CWL_DOCUMENT_CACHE_DIR_SETTING):
         """
         Creates a parser for the given URL
         :param url: The URL to a CWL document to be parsed
+        :param cache_dir: str: directory to cache parsed documents in, defaults to settings.CWL_DOCUMENT_CACHE_DIR,
+        None to not cache
         """
+        if cache_dir is CWL_DOCUMENT_CACHE_DIR_SETTING:
+            cache_dir = settings.CWL_DOCUMENT_CACHE_DIR
         self.url = url
+        self.cache_dir = cache_dir
         self._parsed = None
 
     @property
     def parsed(self):
         """
         Lazy property to parse CWL on-demand
-        :return: The CWL document, parsed into a dict
+        :return: dict: the input fields, root level label and doc, and tool hints from the CWL document
         """
         if self._parsed is None:
-            context = LoadingContext({"construct_tool_object": default_make_tool,
-                                      "resolver": tool_resolver,
-                                      "disable_js_validation": True})
-            self._parsed = load_tool(self.url + '#main', context)
+            self._parsed = self._load()
         return self._parsed
 
+    def _load(self):
+        response = requests.get(self.url)
+        response.raise_for_status()
+        cache_path = self._get_cache_path(response.content)
+        if cache_path:
+            try:
+                with open(cache_path) as infile:
+                    return json.load(infile)
+            except (IOError, ValueError):
+                pass
+        # parse the bytes that were hashed rather than downloading the document again
+        with tempfile.NamedTemporaryFile(suffix='.cwl') as document_file:
+            document_file.write(response.content)
+            document_file.flush()
+            parsed = parse_cwl_document_in_subprocess(self.url, document_file.name)
+        if cache_path:
+            self._write_cache(cache_path, parsed)
+        return parsed
+
+    def _get_cache_path(self, content):
+        """
+        :param content: bytes: contents of the CWL document
+        :return: str: path the parsed document is cached at, None when caching is disabled or the cache
+        directory is not private to this user
+        """
+        if not self.cache_dir:
+            return None
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            cache_dir_stat = os.stat(self.cache_dir)
+        except OSError:
+            logger.warning('Unable to create CWL document cache %s', self.cache_dir, exc_info=True)
+            return None
+        if cache_dir_stat.st_uid != os.getuid() or cache_dir_stat.st_mode & 0o077:
+            logger.warning('Not caching CWL documents in %s, it is not private to this user', self.cache_dir)
+            return None
+        key = hashlib.sha256(CWL_PARSER_VERSION.encode('utf-8'))
+        key.update(b'\n')
+        key.update(content)
+        return os.path.join(self.cache_dir, '{}.json'.format(key.hexdigest()))
+
+    def _write_cache(self, cache_path, parsed):
+        """
+        Atomically write parsed results to cache_path, removing the partial file if writing fails.
+        :param cache_path: str: path returned by _get_cache_path
+        :param parsed: dict: results of parse_cwl_document
+        """
+        outfile = None
+        try:
+            outfile = tempfile.NamedTemporaryFile('w', dir=self.cache_dir, suffix='.tmp', delete=False)
+            with outfile:
+                json.dump(parsed, outfile)
+            os.replace(outfile.name, cache_path)
+        except (OSError, TypeError, ValueError):
+            logger.warning('Unable to cache parsed CWL document %s in %s', self.url, self.cache_dir, exc_info=True)
+            if outfile is not None and os.path.exists(outfile.name):
+                os.remove(outfile.name)
+
     @property
     def input_fields(self):
         """
         The input fields from the CWL document
         :return: List of input fields from the CWL document
         """
-        return self.parsed.inputs_record_schema.get('fields')
+        return self.parsed['input_fields']
 
     def get(self, key):
         """
         Gets the value of a key in the root of the CWL document
-        :param key: The key to get
+        :param key: The key to get, one of CWL_DOCUMENT_ROOT_KEYS
         :return: value associated with the key in the parsed CWL
         """
-        return self.parsed.tool.get(key)
+        return self.parsed['tool'].get(key)
 
     def extract_tool_hints(self, hint_class_name):
         """
@@ -88,19 +189,34 @@ class CWLDocument(object):
         :param hint_class_name: str: name of the class to include
         :return: [dict]: list of hints
         """
-        hints = []
-        self._extract_tool_hints_recursive(hints, self.parsed, hint_class_name)
-        return hints
-
-    def _extract_tool_hints_recursive(self, hints, workflow_node, hint_class_name):
-        if hasattr(workflow_node, 'steps'):
-            for step in workflow_node.steps:
-                self._extract_tool_hints_recursive(hints, step.embedded_tool, hint_class_name=hint_class_name)
-        else:
-            if workflow_node.hints:
-                for hint in workflow_node.hints:
-                    if hint['class'] == hint_class_name:
-                        hints.append(hint)
+        return [hint for hint in self.parsed['hints'] if hint['class'] == hint_class_name]
+
+
+def resolve_doi_citation(doi_name):
+    """
+    Fetch the APA citation for a DOI over the network
+    :param doi_name: str: DOI name such as 10.1000/xyz123
+    :return: str: APA citation
+    """
+    return cn.content_negotiation(ids=doi_name, format="text", style="apa")
+
+
+def get_doi_citations(doi_names, pool_size=None):
+    """
+    Look up APA citations for DOIs. DOIs missing from the DOICitation table are resolved in parallel and saved.
+    :param doi_names: [str]: DOI names
+    :param pool_size: int: number of DOIs to resolve at the same time, defaults to settings.DOI_CITATION_POOL_SIZE
+    :return: dict: DOI name to APA citation
+    """
+    citations = dict(DOICitation.objects.filter(doi__in=doi_names).values_list('doi', 'apa_citation'))
+    missing_doi_names = sorted(set(doi_names) - set(citations))
+    if missing_doi_names:
+        with ThreadPoolExecutor(max_workers=pool_size or settings.DOI_CITATION_POOL_SIZE) as executor:
+            apa_citations = list(executor.map(resolve_doi_citation, missing_doi_names))
+        for doi_name, apa_citation in zip(missing_doi_names, apa_citations):
+            DOICitation.objects.get_or_create(doi=doi_name, defaults={'apa_citation': apa_citation})
+            citations[doi_name] = apa_citation
+    return citations
 
 
 class MethodsDocumentContents(object):
@@ -110,18 +226,20 @@ class MethodsDocumentContents(object):
         self.jinja_template_url = jinja_template_url
 
     def get_content(self):
+        packages = [package for hint in self.software_requirement_hints for package in hint['packages']]
+        doi_names = [package[SCHEMA_ORG_CITATION].replace(HTTPS_DOI_URL, '') for package in packages
+                     if package[SCHEMA_ORG_CITATION].startswith(HTTPS_DOI_URL)]
+        doi_citations = get_doi_citations(doi_names)
         template_args = {}
-        for hint in self.software_requirement_hints:
-            for package in hint['packages']:
-                package_name = package['package']
-                versions = package['version']
-                citation = package[SCHEMA_ORG_CITATION]
-                if citation.startswith(HTTPS_DOI_URL):
-                    doi_name = citation.replace(HTTPS_DOI_URL, '')
-                    apa_citation = cn.content_negotiation(ids=doi_name, format="text", style="apa")
-                else:
-                    apa_citation = citation
-                template_args[package_name] = {'version': versions[-1], 'citation': apa_citation}
+        for package in packages:
+            package_name = package['package']
+            versions = package['version']
+            citation = package[SCHEMA_ORG_CITATION]
+            if citation.startswith(HTTPS_DOI_URL):
+                apa_citation = doi_citations[citation.replace(HTTPS_DOI_URL, '')]
+            else:
+                apa_citation = citation
+            template_args[package_name] = {'version': versions[-1], 'citation': apa_citation}
         template_args['description'] = self.workflow_version_description
         response = requests.get(self.jinja_template_url)
         response.raise_for_status()
@@ -0,0 +1,122 @@
+"""
+Background processing for jobs queued by the start and restart endpoints.
+Giving DukeDS download permissions can take many seconds so the endpoints only move the job to a queued state.
+QueuedJobWorker (run by the runjobworker management command) gives the permissions and saves the lando message
+for each queued job using a pool of threads.
+Temporary failures (DukeDS unavailable, 5XX or 429 responses, database errors) leave the job queued to be retried with
+an exponential backoff, the job moves to ERROR after JOB_WORKER_MAX_ATTEMPTS of them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import APIException
+from data.models import Job, JobError
+from data.lando import LandoJob, QUEUED_JOB_STATES
+from data.exceptions import DataServiceUnavailable
+import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+TOO_MANY_REQUESTS_STATUS_CODE = 429
+SERVER_ERROR_STATUS_CODE = 500
+
+
+def is_temporary_error(exception):
+    """
+    :param exception: Exception: raised while processing a queued job
+    :return: boolean: True if the job should be retried later
+    """
+    if isinstance(exception, (DataServiceUnavailable, DatabaseError)):
+        return True
+    status_code = getattr(exception, 'status_code', None)
+    if isinstance(status_code, int):
+        return status_code == TOO_MANY_REQUESTS_STATUS_CODE or status_code >= SERVER_ERROR_STATUS_CODE
+    return False
+
+
+class QueuedJobWorker(object):
+    """
+    Processes jobs in START_QUEUED or RESTART_QUEUED states using a pool of threads.
+    """
+    def __init__(self, pool_size):
+        """
+        :param pool_size: int: number of jobs to process at the same time
+        """
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def process_queued_jobs(self):
+        """
+        Process all jobs that are currently queued, waiting for them to finish.
+        :return: int: number of jobs sent to lando
+        """
+        job_ids = list(Job.objects.filter(state__in=QUEUED_JOB_STATES)
+                       .filter(Q(queue_next_attempt__isnull=True) | Q(queue_next_attempt__lte=timezone.now()))
+                       .order_by('last_updated').values_list('id', flat=True))
+        return len([sent for sent in self.executor.map(self._process_job_in_thread, job_ids) if sent])
+
+    def _process_job_in_thread(self, job_id):
+        try:
+            return self.process_job(job_id)
+        finally:
+            # each pool thread has its own database connection
+            connection.close()
+
+    def process_job(self, job_id):
+        """
+        Give download permissions and send the lando message for a single queued job.
+        Jobs are left queued to be retried after temporary errors, other errors move the job to ERROR state.
+        :param job_id: int: id of the job to process
+        :return: boolean: True if a message was sent to lando
+        """
+        try:
+            job = Job.objects.get(pk=job_id)
+            return LandoJob(job_id, job.user).run_queued()
+        except Exception as e:
+            content = str(e.detail) if isinstance(e, APIException) else str(e)
+            if is_temporary_error(e):
+                logger.warning("Temporary failure processing queued job %s: %s", job_id, content)
+                self._record_temporary_failure(job_id, content)
+            else:
+                if not isinstance(e, APIException):
+                    logger.exception("Failed to process queued job %s.", job_id)
+                self._record_error(job_id, content)
+            return False
+
+    @staticmethod
+    def backoff_seconds(queue_attempts):
+        """
+        :param queue_attempts: int: number of failed attempts so far
+        :return: int: seconds to wait before the next attempt
+        """
+        return min(settings.JOB_WORKER_RETRY_BACKOFF_BASE_SECONDS * 2 ** (queue_attempts - 1),
+                   settings.JOB_WORKER_RETRY_BACKOFF_MAX_SECONDS)
+
+    def _record_temporary_failure(self, job_id, content):
+        try:
+            with transaction.atomic():
+                job = Job.objects.select_for_update().filter(pk=job_id).first()
+                if not job or job.state not in QUEUED_JOB_STATES:
+                    return
+                queue_attempts = job.queue_attempts + 1
+                if queue_attempts >= settings.JOB_WORKER_MAX_ATTEMPTS:
+                    self._record_error(job_id, content)
+                    return
+                next_attempt = timezone.now() + datetime.timedelta(seconds=self.backoff_seconds(queue_attempts))
+                Job.objects.filter(pk=job_id).update(queue_attempts=queue_attempts, queue_next_attempt=next_attempt)
+        except DatabaseError:
+            # the job stays queued and is retried on the next poll
+            logger.exception("Unable to record failure of queued job %s.", job_id)
+
+    @staticmethod
+    def _record_error(job_id, content):
+        with transaction.atomic():
+            job = Job.objects.select_for_update().filter(pk=job_id).first()
+            if job and job.state in QUEUED_JOB_STATES:
+                JobError.objects.create(job=job, job_step=job.step, content=content)
+                job.state = Job.JOB_STATE_ERROR
+                job.save()
+
+    def shutdown(self):
+        self.executor.shutdown()
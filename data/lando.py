@@ -2,21 +2,87 @@
 Handles communication with lando server that spawns VMs and runs jobs.
 Also updates job state before sending messages to lando.
 """
-from data.models import Job, LandoConnection
-from lando_messaging.clients import LandoClient
+from data.models import Job, JobActivity, LandoConnection, OutboxMessage
+from lando_messaging.clients import LandoClient, CancelJobPayload
+from lando_messaging.messaging import JobCommands
 from rest_framework.exceptions import ValidationError
 from data.util import has_download_permissions, give_download_permissions
+from data.outbox import OutboxWorkQueueClient, make_work_request_message
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.conf import settings
 
 CANNOT_RESTART_JOB_STEP_MSG = "Restart not allowed for jobs at step {}. Please contact {}."
+JOB_NOT_FOUND_MSG = "Job {} not found."
+JOB_STATE_CHANGED_MSG = "Job state changed to {} while processing."
+QUEUED_JOB_STATES = (Job.JOB_STATE_START_QUEUED, Job.JOB_STATE_RESTART_QUEUED)
 
 
-class LandoConfig(object):
+def get_start_job_error(job):
     """
-    Settings for the AMQP queue we send messages to lando server over.
+    :param job: Job: job to check
+    :return: str: reason job can not be started or None if it can be started
     """
-    def __init__(self, job_id):
-        self.work_queue_config = LandoConnection.get_for_job_id(job_id)
+    if job.state == Job.JOB_STATE_AUTHORIZED:
+        return None
+    if job.state == Job.JOB_STATE_NEW:
+        return "Job needs authorization token before it can start."
+    return "Job is not at AUTHORIZED state. Current state: {}.".format(job.get_state_display())
+
+
+def get_restart_job_error(job):
+    """
+    :param job: Job: job to check
+    :return: str: reason job can not be restarted or None if it can be restarted
+    """
+    if job.state == Job.JOB_STATE_ERROR and job.step == Job.JOB_STEP_RECORD_OUTPUT_PROJECT:
+        return CANNOT_RESTART_JOB_STEP_MSG.format(job.get_step_display(), settings.DEFAULT_FROM_EMAIL)
+    if job.state == Job.JOB_STATE_ERROR or job.state == Job.JOB_STATE_CANCEL:
+        return None
+    return "Job is not at ERROR or CANCEL state. Current state: {}.".format(job.get_state_display())
+
+
+def get_cancel_job_error(job):
+    """
+    Any job can be canceled.
+    :param job: Job: job to check
+    :return: None
+    """
+    return None
+
+
+def get_download_project_credentials(job):
+    """
+    :param job: Job: job containing files in one or more projects
+    :return: set of (project_id, DDSUserCredential): projects that need to be downloaded by the job
+    """
+    unique_project_user_cred = set()
+    for dds_file in job.stage_group.dds_files.all():
+        unique_project_user_cred.add((dds_file.project_id, dds_file.dds_user_credentials))
+    return unique_project_user_cred
+
+
+def give_bespin_download_permissions(user, project_user_creds):
+    """
+    Give download permissions to the bespin user for projects where it is missing them.
+    :param user: Django User: user who provides DukeDS permissions
+    :param project_user_creds: set of (project_id, DDSUserCredential): projects to check
+    """
+    for project_id, dds_user_credential in project_user_creds:
+        if not has_download_permissions(dds_user_credential, project_id):
+            give_download_permissions(user, project_id, dds_user_credential.dds_id)
+
+
+class OutboxLandoClient(LandoClient):
+    """
+    LandoClient that saves messages to the outbox to be sent by the dispatchoutbox management command.
+    """
+    def __init__(self, lando_connection):
+        """
+        :param lando_connection: LandoConnection: AMQP server and queue lando is listening on
+        """
+        self.work_queue_client = OutboxWorkQueueClient(lando_connection, lando_connection.queue_name)
 
 
 class LandoJob(object):
@@ -30,7 +96,6 @@ class LandoJob(object):
         """
         self.job_id = job_id
         self.user = user
-        self.config = LandoConfig(job_id)
 
     def start(self):
         """
@@ -39,19 +104,21 @@ class LandoJob(object):
         The job must be at the NEW state or this will raise ValidationError.
         """
         job = self.get_job()
-        if job.state == Job.JOB_STATE_AUTHORIZED:
+        error_msg = get_start_job_error(job)
+        if error_msg:
+            raise ValidationError(error_msg)
+        self._give_download_permissions(job)
+        with transaction.atomic():
             job.state = Job.JOB_STATE_STARTING
             job.save()
-            self._give_download_permissions(job)
-            self._make_client().start_job(self.job_id)
-        else:
-            error_msg = "Job is not at AUTHORIZED state. Current state: {}.".format(job.get_state_display())
-            if job.state == Job.JOB_STATE_NEW:
-                error_msg = "Job needs authorization token before it can start."
-            raise ValidationError(error_msg)
+            self._make_client(job).start_job(self.job_id)
 
-    def _make_client(self):
-        return LandoClient(self.config, self.config.work_queue_config.queue_name)
+    def _make_client(self, job):
+        """
+        :param job: Job: job we will send messages about
+        :return: OutboxLandoClient: client for the lando connection specified by the job's settings
+        """
+        return OutboxLandoClient(LandoConnection.get_for_job_settings_id(job.job_settings_id))
 
     def cancel(self):
         """
@@ -59,9 +126,10 @@ class LandoJob(object):
         Sets job state to CANCELING.
         """
         job = self.get_job()  # make sure the job exists
-        job.state = Job.JOB_STATE_CANCELING
-        job.save()
-        self._make_client().cancel_job(self.job_id)
+        with transaction.atomic():
+            job.state = Job.JOB_STATE_CANCELING
+            job.save()
+            self._make_client(job).cancel_job(self.job_id)
 
     def restart(self):
         """
@@ -70,16 +138,68 @@ class LandoJob(object):
         The job must be at the ERROR or CANCEL state or this will raise ValidationError.
         """
         job = self.get_job()
-        if job.state == Job.JOB_STATE_ERROR and job.step == Job.JOB_STEP_RECORD_OUTPUT_PROJECT:
-            msg = CANNOT_RESTART_JOB_STEP_MSG.format(job.get_step_display(), settings.DEFAULT_FROM_EMAIL)
-            raise ValidationError(msg)
-        if job.state == Job.JOB_STATE_ERROR or job.state == Job.JOB_STATE_CANCEL:
+        error_msg = get_restart_job_error(job)
+        if error_msg:
+            raise ValidationError(error_msg)
+        self._give_download_permissions(job)
+        with transaction.atomic():
             job.state = Job.JOB_STATE_RESTARTING
             job.save()
-            self._give_download_permissions(job)
-            self._make_client().restart_job(self.job_id)
-        else:
-            raise ValidationError("Job is not at ERROR or CANCEL state. Current state: {}.".format(job.get_state_display()))
+            self._make_client(job).restart_job(self.job_id)
+
+    def queue_start(self):
+        """
+        Set job state to START_QUEUED so a QueuedJobWorker will give download permissions and start the job.
+        The job must be at the AUTHORIZED state or this will raise ValidationError.
+        """
+        job = self.get_job()
+        error_msg = get_start_job_error(job)
+        if error_msg:
+            raise ValidationError(error_msg)
+        job.state = Job.JOB_STATE_START_QUEUED
+        job.queue_attempts = 0
+        job.queue_next_attempt = None
+        job.save()
+
+    def queue_restart(self):
+        """
+        Set job state to RESTART_QUEUED so a QueuedJobWorker will give download permissions and restart the job.
+        The job must be at the ERROR or CANCEL state or this will raise ValidationError.
+        """
+        job = self.get_job()
+        error_msg = get_restart_job_error(job)
+        if error_msg:
+            raise ValidationError(error_msg)
+        job.state = Job.JOB_STATE_RESTART_QUEUED
+        job.queue_attempts = 0
+        job.queue_next_attempt = None
+        job.save()
+
+    def run_queued(self):
+        """
+        Give download permissions and send the start/restart message for a job queued by queue_start/queue_restart.
+        Sets job state to STARTING or RESTARTING. Does nothing if the job is no longer queued.
+        :return: boolean: True if a message was sent to lando
+        """
+        job = self.get_job()
+        if job.state not in QUEUED_JOB_STATES:
+            return False
+        queued_state = job.state
+        self._give_download_permissions(job)
+        with transaction.atomic():
+            # lock the job so only one worker sends the message
+            job = Job.objects.select_for_update().get(pk=self.job_id)
+            if job.state != queued_state:
+                return False
+            if queued_state == Job.JOB_STATE_START_QUEUED:
+                job.state = Job.JOB_STATE_STARTING
+                job.save()
+                self._make_client(job).start_job(self.job_id)
+            else:
+                job.state = Job.JOB_STATE_RESTARTING
+                job.save()
+                self._make_client(job).restart_job(self.job_id)
+        return True
 
     def get_job(self):
         return Job.objects.get(pk=self.job_id)
@@ -89,9 +209,91 @@ class LandoJob(object):
         Give download permissions to the bespin user for the projects that contain input files.
         :param job: Job: job containing files in one or more projects
         """
-        unique_project_user_cred = set()
-        for dds_file in job.stage_group.dds_files.all():
-            unique_project_user_cred.add((dds_file.project_id, dds_file.dds_user_credentials))
-        for project_id, dds_user_credential in unique_project_user_cred:
-            if not has_download_permissions(dds_user_credential, project_id):
-                give_download_permissions(self.user, project_id, dds_user_credential.dds_id)
+        give_bespin_download_permissions(self.user, get_download_project_credentials(job))
+
+
+class LandoJobs(object):
+    """
+    Starts, cancels or restarts many jobs at once.
+    Job states are changed with a single conditional UPDATE. Cancel messages are saved to the outbox in the
+    same transaction so they are sent over one connection by the dispatchoutbox command.
+    Start and restart move jobs to START_QUEUED/RESTART_QUEUED so the runjobworker command gives download
+    permissions as each job's owner and sends the lando message.
+    """
+    START = 'start'
+    CANCEL = 'cancel'
+    RESTART = 'restart'
+    ACTIONS = (START, CANCEL, RESTART)
+    # action: (condition jobs must meet, function returning why a job doesn't meet the condition, new state,
+    #          lando command and lando payload class, None when the job worker sends the message)
+    ACTION_SETTINGS = {
+        START: (Q(state=Job.JOB_STATE_AUTHORIZED),
+                get_start_job_error, Job.JOB_STATE_START_QUEUED, None, None),
+        CANCEL: (Q(),
+                 get_cancel_job_error, Job.JOB_STATE_CANCELING, JobCommands.CANCEL_JOB, CancelJobPayload),
+        RESTART: (Q(state__in=[Job.JOB_STATE_ERROR, Job.JOB_STATE_CANCEL]) &
+                  ~Q(state=Job.JOB_STATE_ERROR, step=Job.JOB_STEP_RECORD_OUTPUT_PROJECT),
+                  get_restart_job_error, Job.JOB_STATE_RESTART_QUEUED, None, None),
+    }
+
+    def __init__(self, action):
+        """
+        :param action: str: one of ACTIONS
+        """
+        self.action = action
+
+    def run(self, job_ids):
+        """
+        Run the action for each job.
+        :param job_ids: [int]: ids of the jobs to run the action on
+        :return: [dict]: outcome for each job id with keys 'job', 'success', 'state' and 'error'
+        """
+        condition, get_error, new_state, command, payload_class = self.ACTION_SETTINGS[self.action]
+        outcomes = {job_id: self._outcome(job_id, error=JOB_NOT_FOUND_MSG.format(job_id)) for job_id in job_ids}
+        candidate_jobs = []
+        for job in Job.objects.filter(pk__in=job_ids):
+            error_msg = get_error(job)
+            if error_msg:
+                outcomes[job.id] = self._outcome(job.id, state=job.state, error=error_msg)
+            else:
+                candidate_jobs.append(job)
+        updates = {'state': new_state, 'last_updated': timezone.now()}
+        if new_state in QUEUED_JOB_STATES:
+            updates.update(queue_attempts=0, queue_next_attempt=None)
+        with transaction.atomic():
+            locked_jobs = list(Job.objects.select_for_update()
+                               .filter(condition, pk__in=[job.id for job in candidate_jobs])
+                               .only('id', 'step', 'job_settings_id'))
+            Job.objects.filter(pk__in=[job.id for job in locked_jobs]).update(**updates)
+            JobActivity.objects.bulk_create([
+                JobActivity(job_id=job.id, state=new_state, step=job.step) for job in locked_jobs
+            ])
+            if command:
+                OutboxMessage.objects.bulk_create([
+                    self._make_message(job, command, payload_class) for job in locked_jobs
+                ])
+        locked_job_ids = set(job.id for job in locked_jobs)
+        for job in candidate_jobs:
+            if job.id in locked_job_ids:
+                outcomes[job.id] = self._outcome(job.id, state=new_state, success=True)
+            else:
+                current_job = Job.objects.filter(pk=job.id).first()
+                if current_job:
+                    error_msg = JOB_STATE_CHANGED_MSG.format(current_job.get_state_display())
+                    outcomes[job.id] = self._outcome(job.id, state=current_job.state, error=error_msg)
+        return [outcomes[job_id] for job_id in job_ids]
+
+    @staticmethod
+    def _make_message(job, command, payload_class):
+        lando_connection = LandoConnection.get_for_job_settings_id(job.job_settings_id)
+        return make_work_request_message(lando_connection, lando_connection.queue_name, command,
+                                         payload_class(job.id))
+
+    @staticmethod
+    def _outcome(job_id, state=None, success=False, error=None):
+        return {
+            'job': job_id,
+            'success': success,
+            'state': state,
+            'error': error,
+        }
@@ -1,25 +1,34 @@
-from django.core.mail import EmailMessage as DjangoEmailMessage
-from django.template import Template, Context
+from django.core.mail import EmailMessage as DjangoEmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q, F, Min, Case, When, Value, TextField, DateTimeField
+from django.utils import timezone
+from django.template import Context
 from django.utils.safestring import mark_safe
 from django.conf import settings
-from data.models import Job, EmailMessage, EmailTemplate, LandoConnection
+from data.models import Job, EmailMessage, EmailTemplate, EmailNotification, JobStateNotification, LandoConnection, \
+    email_template_cache
 from data.exceptions import EmailServiceException, EmailAlreadySentException
 import pickle
-from lando_messaging.workqueue import WorkQueueConnection
+import datetime
+import time
+import logging
+from data.outbox import enqueue_message
 
 EMAIL_EXCHANGE = "EmailExchange"
 ROUTING_KEY = "SendEmail"
+DIGEST_TEMPLATE_NAME = 'job-digest'
+logger = logging.getLogger(__name__)
 
 class EmailMessageFactory(object):
 
     def __init__(self, email_template):
         self.email_template = email_template
 
-    @classmethod
-    def _render(cls, template, context):
+    def _render(self, template, context):
         for k in context:
-            context[k] = mark_safe(context[k])
-        django_template = Template(template)
+            if isinstance(context[k], str):
+                context[k] = mark_safe(context[k])
+        django_template = email_template_cache.get_compiled(self.email_template.id, template)
         return django_template.render(Context(context))
 
     def _render_subject(self, context):
@@ -28,7 +37,7 @@ class EmailMessageFactory(object):
     def _render_body(self, context):
         return self._render(self.email_template.body_template, context)
 
-    def make_message(self, context, sender_email, to_email, bcc_email=None):
+    def make_message(self, context, sender_email, to_email, bcc_email=None, queued_to_mailer=False):
         if bcc_email is None:
             bcc_email = settings.BESPIN_MAILER_ADMIN_BCC
         body = self._render_body(context)
@@ -38,32 +47,40 @@ class EmailMessageFactory(object):
             subject=subject,
             sender_email=sender_email,
             to_email=to_email,
-            bcc_email=' '.join(bcc_email)
+            bcc_email=' '.join(bcc_email),
+            queued_to_mailer=queued_to_mailer
         )
         return message
 
 
+def make_django_email_message(email_message):
+    """
+    :param email_message: EmailMessage: message to send
+    :return: django.core.mail.EmailMessage
+    """
+    if email_message.bcc_email is not None:
+        bcc = email_message.bcc_email.split()
+    else:
+        bcc = None
+    return DjangoEmailMessage(
+        email_message.subject,
+        email_message.body,
+        email_message.sender_email,
+        [email_message.to_email],
+        bcc=bcc
+    )
+
+
 class EmailMessageSender(object):
 
     def __init__(self, email_message):
         self.email_message = email_message
 
     def send(self):
-        if self.email_message.state == EmailMessage.MESSAGE_STATE_SENT:
+        if not self._claim():
             raise EmailAlreadySentException()
 
-        if self.email_message.bcc_email is not None:
-            bcc = self.email_message.bcc_email.split()
-        else:
-            bcc = None
-
-        django_message = DjangoEmailMessage(
-            self.email_message.subject,
-            self.email_message.body,
-            self.email_message.sender_email,
-            [self.email_message.to_email],
-            bcc=bcc
-        )
+        django_message = make_django_email_message(self.email_message)
         try:
             django_message.send()
             self.email_message.mark_sent()
@@ -71,18 +88,182 @@ class EmailMessageSender(object):
             self.email_message.mark_error(str(e))
             raise EmailServiceException(e)
 
+    def _claim(self):
+        """
+        Move the message to SENDING unless it was sent or another process is sending it.
+        :return: boolean: True if this sender may send the message
+        """
+        now = timezone.now()
+        claimed = EmailMessage.objects.filter(pk=self.email_message.pk).filter(
+            Q(state__in=[EmailMessage.MESSAGE_STATE_NEW, EmailMessage.MESSAGE_STATE_ERROR]) |
+            Q(state=EmailMessage.MESSAGE_STATE_SENDING, next_attempt__lte=now)
+        ).update(state=EmailMessage.MESSAGE_STATE_SENDING,
+                 next_attempt=now + datetime.timedelta(seconds=settings.EMAIL_SEND_CLAIM_SECONDS))
+        if claimed:
+            self.email_message.state = EmailMessage.MESSAGE_STATE_SENDING
+        return bool(claimed)
+
+
+class EmailMessageBatchSender(object):
+    """
+    Sends NEW and ERROR EmailMessages in batches over a single SMTP connection.
+    Messages are claimed (moved to SENDING) in a short transaction before the SMTP calls so concurrent
+    senders never send the same message. A claim that is not resolved within EMAIL_SEND_CLAIM_SECONDS,
+    because the sender died, expires and the message is sent again.
+    Failed messages are retried with exponential backoff until EMAIL_MAX_SEND_ATTEMPTS is reached.
+    Messages queued for bespin-mailer are left to the send endpoint it calls.
+    """
+    def __init__(self, batch_size=None, rate_limit=None, clock=time.time, sleep=time.sleep):
+        """
+        :param batch_size: int: maximum number of messages to send per connection, defaults to EMAIL_BATCH_SIZE
+        :param rate_limit: float: maximum messages per second, defaults to EMAIL_SEND_RATE_LIMIT (None for no limit)
+        :param clock: func(): returns the current time in seconds
+        :param sleep: func(seconds): waits to respect the rate limit
+        """
+        self.batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+        self.rate_limit = rate_limit or settings.EMAIL_SEND_RATE_LIMIT
+        self.clock = clock
+        self.sleep = sleep
+        self.last_send_time = None
+
+    def get_ready_messages(self):
+        """
+        :return: QuerySet: NEW messages, ERROR messages whose backoff has expired and SENDING messages whose
+        claim has expired, oldest first
+        """
+        now = timezone.now()
+        return EmailMessage.objects.filter(
+            state__in=[EmailMessage.MESSAGE_STATE_NEW, EmailMessage.MESSAGE_STATE_ERROR,
+                       EmailMessage.MESSAGE_STATE_SENDING],
+            send_attempts__lt=settings.EMAIL_MAX_SEND_ATTEMPTS,
+            queued_to_mailer=False,
+        ).filter(
+            Q(next_attempt__isnull=True) | Q(next_attempt__lte=now)
+        ).order_by('id')
+
+    def claim_messages(self, queryset):
+        """
+        Lock the messages in queryset and move them to SENDING, committing before any message is sent.
+        :param queryset: QuerySet: messages to claim, re-checked once the locks are held
+        :return: [EmailMessage]: claimed messages with the state and next_attempt they had before the claim
+        """
+        with transaction.atomic():
+            messages = list(queryset.select_for_update()[:self.batch_size])
+            if messages:
+                claimed_until = timezone.now() + datetime.timedelta(seconds=settings.EMAIL_SEND_CLAIM_SECONDS)
+                EmailMessage.objects.filter(id__in=[message.id for message in messages]).update(
+                    state=EmailMessage.MESSAGE_STATE_SENDING, next_attempt=claimed_until)
+        return messages
+
+    def release_messages(self, messages):
+        """
+        Return claimed messages that were not sent so the next batch retries them.
+        :param messages: [EmailMessage]: messages returned by claim_messages
+        """
+        error_ids = [message.id for message in messages if message.state == EmailMessage.MESSAGE_STATE_ERROR]
+        new_ids = [message.id for message in messages if message.state != EmailMessage.MESSAGE_STATE_ERROR]
+        if error_ids:
+            EmailMessage.objects.filter(id__in=error_ids).update(state=EmailMessage.MESSAGE_STATE_ERROR,
+                                                                 next_attempt=None)
+        if new_ids:
+            EmailMessage.objects.filter(id__in=new_ids).update(state=EmailMessage.MESSAGE_STATE_NEW,
+                                                               next_attempt=None)
+
+    def send_batch(self):
+        """
+        Claim and send up to batch_size ready messages over one connection and record the results with bulk updates.
+        :return: (int, int): number of messages sent, number of messages that failed
+        """
+        messages = self.claim_messages(self.get_ready_messages())
+        if not messages:
+            return 0, 0
+        sent_ids = []
+        errors = {}
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as e:
+            # the server is unreachable, release the messages so the next batch retries them
+            self.release_messages(messages)
+            raise EmailServiceException(e)
+        try:
+            for message in messages:
+                self._wait_for_rate_limit()
+                try:
+                    connection.send_messages([make_django_email_message(message)])
+                    sent_ids.append(message.id)
+                except Exception as e:
+                    errors[message.id] = (message.send_attempts + 1, str(e))
+        finally:
+            connection.close()
+        self._record_results(sent_ids, errors)
+        return len(sent_ids), len(errors)
+
+    def send_all(self):
+        """
+        Send batches until no messages are ready.
+        :return: (int, int): number of messages sent, number of messages that failed
+        """
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = self.send_batch()
+            total_sent += sent
+            total_failed += failed
+            if sent + failed < self.batch_size:
+                return total_sent, total_failed
+
+    def _wait_for_rate_limit(self):
+        if self.rate_limit:
+            now = self.clock()
+            if self.last_send_time is not None:
+                next_send_time = self.last_send_time + 1.0 / self.rate_limit
+                if next_send_time > now:
+                    self.sleep(next_send_time - now)
+                    now = next_send_time
+            self.last_send_time = now
+
+    @staticmethod
+    def backoff_seconds(send_attempts):
+        """
+        :param send_attempts: int: number of failed attempts so far
+        :return: int: seconds to wait before the next attempt
+        """
+        return min(settings.EMAIL_RETRY_BACKOFF_BASE_SECONDS * 2 ** (send_attempts - 1),
+                   settings.EMAIL_RETRY_BACKOFF_MAX_SECONDS)
+
+    def _record_results(self, sent_ids, errors):
+        if sent_ids:
+            EmailMessage.objects.filter(id__in=sent_ids).update(state=EmailMessage.MESSAGE_STATE_SENT,
+                                                                next_attempt=None)
+        if errors:
+            now = timezone.now()
+            EmailMessage.objects.filter(id__in=errors.keys()).update(
+                state=EmailMessage.MESSAGE_STATE_ERROR,
+                errors=Case(*[When(id=message_id, then=Value(error)) for message_id, (attempts, error) in errors.items()],
+                            output_field=TextField()),
+                send_attempts=F('send_attempts') + 1,
+                next_attempt=Case(*[
+                    When(id=message_id, then=Value(now + datetime.timedelta(seconds=self.backoff_seconds(attempts))))
+                    for message_id, (attempts, error) in errors.items()
+                ], output_field=DateTimeField()),
+            )
+
 
 class JobMailer(object):
 
-    def __init__(self, job, queue_messages=True, sender_email=None):
+    def __init__(self, job, queue_messages=True, sender_email=None, digest=None):
         if sender_email is None:
             sender_email = settings.DEFAULT_FROM_EMAIL
+        if digest is None:
+            digest = settings.EMAIL_DIGEST_ENABLED
         self.job = job
         self.sender_email = sender_email
         self.queue_messages = queue_messages
+        self.digest = digest
 
     def _deliver(self, message):
         if self.queue_messages:
+            # bespin-mailer sends the message through the send endpoint, the batch sender skips it
             client = MailerClient(self.job.id)
             client.send(message.id)
         else:
@@ -97,26 +278,233 @@ class JobMailer(object):
 
     def _make_message(self, template_name, to_email):
         context = self._make_context()
-        template = EmailTemplate.objects.get(name=template_name)
+        template = EmailTemplate.get_cached_by_name(template_name)
         factory = EmailMessageFactory(template)
-        return factory.make_message(context, self.sender_email, to_email)
+        return factory.make_message(context, self.sender_email, to_email, queued_to_mailer=self.queue_messages)
 
-    def mail_current_state(self):
-        messages = []
-        state = self.job.state
+    def _get_notifications(self, state):
+        """
+        :param state: str: job state to notify about
+        :return: [(str, str)]: template name and recipient email for each message about the state
+        """
         if state == Job.JOB_STATE_RUNNING:
-            messages.append(self._make_message('job-running-user', self.job.user.email))
+            return [('job-running-user', self.job.user.email)]
         elif state == Job.JOB_STATE_CANCEL:
-            messages.append(self._make_message('job-cancel-user', self.job.user.email))
+            return [('job-cancel-user', self.job.user.email)]
         elif state == Job.JOB_STATE_FINISHED:
-            messages.append(self._make_message('job-finished-user', self.job.user.email))
-            messages.append(self._make_message('job-finished-sharegroup', self.job.share_group.email))
+            return [('job-finished-user', self.job.user.email),
+                    ('job-finished-sharegroup', self.job.share_group.email)]
         elif state == Job.JOB_STATE_ERROR:
-            messages.append(self._make_message('job-error-user', self.job.user.email))
+            return [('job-error-user', self.job.user.email)]
+        return []
+
+    def mail_current_state(self):
+        self.mail_state(self.job.state)
+
+    def mail_state(self, state):
+        """
+        Send (or buffer in digest mode) the messages for a job changing to state.
+        :param state: str: job state to notify about
+        """
+        notifications = self._get_notifications(state)
+        if self.digest:
+            EmailNotification.objects.bulk_create([
+                EmailNotification(job=self.job, template_name=template_name, to_email=to_email)
+                for template_name, to_email in notifications
+            ])
+            return
+        messages = [self._make_message(template_name, to_email) for template_name, to_email in notifications]
         for message in messages:
             self._deliver(message)
 
 
+def purge_email_messages(older_than, states=(EmailMessage.MESSAGE_STATE_SENT,), batch_size=1000):
+    """
+    Delete email messages created before older_than in batches, along with the digest notifications they contain.
+    :param older_than: datetime: delete messages created before this time
+    :param states: [str]: states of the messages to delete
+    :param batch_size: int: number of messages to delete per transaction
+    :return: int: number of messages deleted
+    """
+    deleted = 0
+    while True:
+        message_ids = list(EmailMessage.objects.filter(state__in=states, created__lt=older_than)
+                           .order_by('id').values_list('id', flat=True)[:batch_size])
+        if not message_ids:
+            return deleted
+        # digest notifications are deleted along with their message
+        EmailMessage.objects.filter(id__in=message_ids).delete()
+        deleted += len(message_ids)
+
+
+def queue_job_state_notification(job):
+    """
+    Save a notification that job changed to its current state, to be mailed by JobStateNotificationSender.
+    Call in the same transaction as the state change so the notification is saved only if the change is.
+    :param job: Job: job whose state changed
+    :return: JobStateNotification
+    """
+    return JobStateNotification.objects.create(job=job, state=job.state)
+
+
+class JobStateNotificationSender(object):
+    """
+    Renders and delivers the messages for queued JobStateNotifications, deleting each one in the same
+    transaction as its messages are saved.
+    Failed notifications are retried with exponential backoff until JOB_NOTIFICATION_MAX_ATTEMPTS is reached,
+    after which they are kept with their last error for an admin to inspect.
+    """
+    def __init__(self, batch_size=None):
+        """
+        :param batch_size: int: maximum number of notifications to process per batch, defaults to JOB_NOTIFICATION_BATCH_SIZE
+        """
+        self.batch_size = batch_size or settings.JOB_NOTIFICATION_BATCH_SIZE
+
+    def get_ready_notifications(self):
+        """
+        :return: QuerySet: notifications not yet attempted and failed notifications whose backoff has expired,
+        oldest first
+        """
+        now = timezone.now()
+        return JobStateNotification.objects.filter(
+            attempts__lt=settings.JOB_NOTIFICATION_MAX_ATTEMPTS,
+        ).filter(
+            Q(next_attempt__isnull=True) | Q(next_attempt__lte=now)
+        ).order_by('id')
+
+    def send_batch(self):
+        """
+        Mail the oldest batch_size ready notifications. Notifications that fail are scheduled to be retried.
+        :return: (int, int): number of notifications sent, number that failed
+        """
+        notification_ids = list(self.get_ready_notifications().values_list('id', flat=True)[:self.batch_size])
+        sent = failed = 0
+        for notification_id in notification_ids:
+            try:
+                if self.send_notification(notification_id):
+                    sent += 1
+            except Exception as e:
+                logger.exception("Failed to mail job state notification %s.", notification_id)
+                self._record_failure(notification_id, str(e))
+                failed += 1
+        return sent, failed
+
+    @staticmethod
+    def backoff_seconds(attempts):
+        """
+        :param attempts: int: number of failed attempts so far
+        :return: int: seconds to wait before the next attempt
+        """
+        return min(settings.JOB_NOTIFICATION_RETRY_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1),
+                   settings.JOB_NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS)
+
+    def _record_failure(self, notification_id, error):
+        with transaction.atomic():
+            notification = JobStateNotification.objects.select_for_update().filter(pk=notification_id).first()
+            if notification is None:
+                return
+            notification.attempts += 1
+            notification.next_attempt = timezone.now() + datetime.timedelta(
+                seconds=self.backoff_seconds(notification.attempts))
+            notification.last_error = error
+            notification.save()
+
+    def send_notification(self, notification_id):
+        """
+        :param notification_id: int: id of the JobStateNotification to mail
+        :return: boolean: True if the notification was mailed, False if another process already mailed it
+        """
+        with transaction.atomic():
+            notification = JobStateNotification.objects.select_for_update() \
+                .select_related('job__user', 'job__share_group').filter(pk=notification_id).first()
+            if notification is None:
+                return False
+            JobMailer(notification.job).mail_state(notification.state)
+            notification.delete()
+        return True
+
+
+class EmailDigestBuilder(object):
+    """
+    Combines the pending EmailNotifications for each recipient into one digest EmailMessage.
+    A recipient's digest is built once their oldest pending notification is EMAIL_DIGEST_WINDOW_SECONDS old.
+    Digest messages are left in NEW state to be sent by EmailMessageBatchSender.
+    """
+    def __init__(self, window_seconds=None, sender_email=None):
+        """
+        :param window_seconds: int: seconds to buffer notifications, defaults to EMAIL_DIGEST_WINDOW_SECONDS
+        :param sender_email: str: address digests are sent from, defaults to DEFAULT_FROM_EMAIL
+        """
+        if window_seconds is None:
+            window_seconds = settings.EMAIL_DIGEST_WINDOW_SECONDS
+        if sender_email is None:
+            sender_email = settings.DEFAULT_FROM_EMAIL
+        self.window_seconds = window_seconds
+        self.sender_email = sender_email
+
+    def get_due_recipients(self):
+        """
+        :return: [str]: email addresses whose oldest pending notification is older than the window
+        """
+        window_start = timezone.now() - datetime.timedelta(seconds=self.window_seconds)
+        return list(EmailNotification.objects.filter(email_message__isnull=True)
+                    .values('to_email')
+                    .annotate(oldest=Min('created'))
+                    .filter(oldest__lte=window_start)
+                    .order_by('oldest')
+                    .values_list('to_email', flat=True))
+
+    def build_due_digests(self):
+        """
+        Build a digest message for each recipient whose window has closed.
+        :return: [EmailMessage]: digest messages created
+        """
+        messages = []
+        for to_email in self.get_due_recipients():
+            message = self.build_digest(to_email)
+            if message:
+                messages.append(message)
+        return messages
+
+    def build_digest(self, to_email):
+        """
+        Render the pending notifications for a recipient into one EmailMessage.
+        :param to_email: str: recipient email address
+        :return: EmailMessage: digest message or None if there were no pending notifications
+        """
+        with transaction.atomic():
+            notifications = list(EmailNotification.objects.select_for_update()
+                                 .filter(to_email=to_email, email_message__isnull=True)
+                                 .select_related('job'))
+            if not notifications:
+                return None
+            context = {
+                'count': len(notifications),
+                'notifications': [self._make_notification_context(notification) for notification in notifications],
+            }
+            factory = EmailMessageFactory(EmailTemplate.get_cached_by_name(DIGEST_TEMPLATE_NAME))
+            message = factory.make_message(context, self.sender_email, to_email)
+            EmailNotification.objects.filter(id__in=[notification.id for notification in notifications]) \
+                .update(email_message=message)
+        return message
+
+    @staticmethod
+    def _make_notification_context(notification):
+        """
+        :param notification: EmailNotification
+        :return: dict: values for one line of the digest, summary is the subject the single message would have had
+        """
+        job = notification.job
+        factory = EmailMessageFactory(EmailTemplate.get_cached_by_name(notification.template_name))
+        summary = factory._render_subject({'id': job.id, 'name': job.name})
+        return {
+            'id': job.id,
+            'name': mark_safe(job.name),
+            'created': notification.created,
+            'summary': mark_safe(summary),
+        }
+
+
 class MailerConfig(object):
     """
     Settings for the AMQP queue we send messages to bespin-mailer over.
@@ -130,11 +518,8 @@ class MailerClient(object):
         self.config = MailerConfig(job_id)
 
     def send(self, send_email_id):
-        work_queue_connection = WorkQueueConnection(self.config)
         body = pickle.dumps({"send_email": send_email_id})
-        work_queue_connection.connect()
-        channel = work_queue_connection.connection.channel()
-        channel.basic_publish(exchange=EMAIL_EXCHANGE,
-                              routing_key=ROUTING_KEY,
-                              body=body)
-        work_queue_connection.close()
+        enqueue_message(self.config.work_queue_config,
+                        exchange=EMAIL_EXCHANGE,
+                        routing_key=ROUTING_KEY,
+                        body=body)
@@ -0,0 +1,163 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.test.runner import DiscoverRunner
+from rest_framework.test import APIRequestFactory, force_authenticate
+from data.api import DDSProjectsViewSet, DDSResourcesViewSet
+from data.fakedukeds import FakeDukeDSServer, FakeDukeDSData, FAKE_USER_ID
+from data.lando import LandoJob
+from data.models import DDSEndpoint, DDSUserCredential, Workflow, WorkflowVersion, Job, JobFileStageGroup, \
+    DDSJobInputFile, ShareGroup, JobFlavor, VMProject, CloudSettingsOpenStack, LandoConnection, JobRuntimeOpenStack, \
+    JobSettings
+from data.util import dds_circuit_breaker
+import math
+import time
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile.
+    :param sorted_values: [float]: values sorted in ascending order
+    :param percent: int: percentile to return (0-100)
+    :return: float: value at the requested percentile
+    """
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class NullLandoClient(object):
+    """
+    Accepts lando messages without sending them so LandoJob timings only include DukeDS and database work.
+    """
+    def start_job(self, job_id):
+        pass
+
+
+class BenchmarkLandoJob(LandoJob):
+    def _make_client(self, job):
+        return NullLandoClient()
+
+
+class DukeDSBenchmark(object):
+    """
+    Creates models pointing at a FakeDukeDSServer and times API operations that talk to DukeDS.
+    """
+    def __init__(self, server, input_file_count):
+        self.server = server
+        self.input_file_count = input_file_count
+        self.factory = APIRequestFactory()
+        self.user = None
+        self.job = None
+
+    def setup(self):
+        self.user = User.objects.create_user('dukeds-benchmark')
+        endpoint = DDSEndpoint.objects.create(name='fake-dukeds', agent_key='agent-key',
+                                              api_root=self.server.api_root)
+        user_credential = DDSUserCredential.objects.create(user=self.user, token='user-key', endpoint=endpoint,
+                                                           dds_id=FAKE_USER_ID)
+        workflow = Workflow.objects.create(name='Benchmark', tag='benchmark')
+        workflow_version = WorkflowVersion.objects.create(workflow=workflow, version='1', url='', fields=[])
+        vm_project = VMProject.objects.create(name='benchmark')
+        cloud_settings = CloudSettingsOpenStack.objects.create(name='benchmark', vm_project=vm_project)
+        lando_connection = LandoConnection.objects.create(host='127.0.0.1', username='lando', password='secret',
+                                                          queue_name='lando')
+        job_runtime = JobRuntimeOpenStack.objects.create(cloud_settings=cloud_settings, image_name='benchmark',
+                                                         cwl_base_command='["cwltool"]')
+        job_settings = JobSettings.objects.create(name='benchmark', lando_connection=lando_connection,
+                                                  job_runtime_openstack=job_runtime)
+        stage_group = JobFileStageGroup.objects.create(user=self.user)
+        data = self.server.data
+        for sequence in range(self.input_file_count):
+            project_num = sequence % data.project_count
+            DDSJobInputFile.objects.create(stage_group=stage_group,
+                                           project_id=data.project_id(project_num),
+                                           file_id=data.file_id(project_num, 0, 0),
+                                           dds_user_credentials=user_credential,
+                                           destination_path='file{}.txt'.format(sequence),
+                                           sequence_group=1,
+                                           sequence=sequence)
+        self.job = Job.objects.create(workflow_version=workflow_version, user=self.user, job_order='{}',
+                                      stage_group=stage_group, share_group=ShareGroup.objects.create(name='benchmark'),
+                                      job_settings=job_settings, job_flavor=JobFlavor.objects.create(name='benchmark'),
+                                      state=Job.JOB_STATE_AUTHORIZED)
+
+    def _get(self, viewset, path, params=None):
+        view = viewset.as_view({'get': 'list'})
+        request = self.factory.get(path, params)
+        force_authenticate(request, user=self.user)
+        response = view(request)
+        response.render()
+        if response.status_code != 200:
+            raise ValueError("Unexpected response {} for {}".format(response.status_code, path))
+
+    def list_projects(self):
+        self._get(DDSProjectsViewSet, '/api/dds-projects/')
+
+    def list_project_resources(self):
+        project_id = self.server.data.project_id(0)
+        self._get(DDSResourcesViewSet, '/api/dds-resources/', {'project_id': project_id})
+
+    def list_folder_resources(self):
+        folder_id = self.server.data.folder_id(0, 0)
+        self._get(DDSResourcesViewSet, '/api/dds-resources/', {'folder_id': folder_id})
+
+    def start_job(self):
+        # reset so each start grants download permissions again
+        Job.objects.filter(pk=self.job.pk).update(state=Job.JOB_STATE_AUTHORIZED)
+        self.server.data.permissions.clear()
+        BenchmarkLandoJob(self.job.pk, self.user).start()
+
+    def scenarios(self):
+        return [
+            ('DDSProjectsViewSet.list', self.list_projects),
+            ('DDSResourcesViewSet.list project_id', self.list_project_resources),
+            ('DDSResourcesViewSet.list folder_id', self.list_folder_resources),
+            ('LandoJob.start', self.start_job),
+        ]
+
+    @staticmethod
+    def time_scenario(func, iterations):
+        """
+        :return: [float]: sorted elapsed seconds for each call to func
+        """
+        timings = []
+        for _ in range(iterations):
+            dds_circuit_breaker.reset()
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks DukeDS backed operations against a local DukeDS stand-in and reports p50/p99 latencies. ' \
+           'Uses a temporary test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Number of times to run each operation')
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Seconds the DukeDS stand-in waits before each response')
+        parser.add_argument('--projects', type=int, default=20, help='Number of projects to generate')
+        parser.add_argument('--folders', type=int, default=5, help='Number of folders in each project')
+        parser.add_argument('--files', type=int, default=20, help='Number of files in each folder')
+        parser.add_argument('--input-files', type=int, default=10,
+                            help='Number of job input files (spread across projects) used by LandoJob.start')
+
+    def handle(self, **options):
+        data = FakeDukeDSData(project_count=options['projects'],
+                              folders_per_project=options['folders'],
+                              files_per_folder=options['files'])
+        server = FakeDukeDSServer(data, latency=options['latency'])
+        server.start_in_thread()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            benchmark = DukeDSBenchmark(server, options['input_files'])
+            benchmark.setup()
+            self.stdout.write("{:<40} {:>10} {:>10} {:>10}".format('operation', 'p50 (ms)', 'p99 (ms)', 'max (ms)'))
+            for name, func in benchmark.scenarios():
+                timings = benchmark.time_scenario(func, options['iterations'])
+                self.stdout.write("{:<40} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                    name, percentile(timings, 50) * 1000, percentile(timings, 99) * 1000, timings[-1] * 1000))
+        finally:
+            runner.teardown_databases(old_config)
+            server.stop()
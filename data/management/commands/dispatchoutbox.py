@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from data.outbox import OutboxDispatcher
+import time
+
+
+class Command(BaseCommand):
+    help = 'Sends AMQP messages saved in the outbox to lando and bespin-mailer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_DISPATCH_BATCH_SIZE,
+                            help='Maximum number of messages to send per database transaction')
+        parser.add_argument('--poll-seconds', type=float, default=settings.OUTBOX_DISPATCH_POLL_SECONDS,
+                            help='Seconds to wait before checking an empty outbox again')
+        parser.add_argument('--once', action='store_true', help='Exit once the outbox is empty')
+
+    def handle(self, **options):
+        dispatcher = OutboxDispatcher()
+        try:
+            while True:
+                sent, failed = dispatcher.dispatch_all(options['batch_size'])
+                if sent or failed:
+                    self.stdout.write("Sent {} messages.".format(sent))
+                if options['once']:
+                    break
+                time.sleep(options['poll_seconds'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            dispatcher.close()
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.utils import timezone
+from data.mailer import purge_email_messages
+from data.models import EmailMessage
+import datetime
+
+
+class Command(BaseCommand):
+    help = 'Deletes sent email messages older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.EMAIL_MESSAGE_RETENTION_DAYS,
+                            help='Delete messages created more than this many days ago')
+        parser.add_argument('--include-errors', action='store_true',
+                            help='Also delete messages that failed to send')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of messages to delete per transaction')
+
+    def handle(self, **options):
+        states = [EmailMessage.MESSAGE_STATE_SENT]
+        if options['include_errors']:
+            states.append(EmailMessage.MESSAGE_STATE_ERROR)
+        older_than = timezone.now() - datetime.timedelta(days=options['days'])
+        deleted = purge_email_messages(older_than, states=states, batch_size=options['batch_size'])
+        self.stdout.write("Deleted {} email messages.".format(deleted))
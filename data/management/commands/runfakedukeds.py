@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from data.fakedukeds import FakeDukeDSServer, FakeDukeDSData
+
+
+class Command(BaseCommand):
+    help = 'Runs a local stand-in for the DukeDS API with generated projects and configurable latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Host to listen on')
+        parser.add_argument('--port', type=int, default=8090, help='Port to listen on')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before each response')
+        parser.add_argument('--projects', type=int, default=10, help='Number of projects to generate')
+        parser.add_argument('--folders', type=int, default=5, help='Number of folders in each project')
+        parser.add_argument('--files', type=int, default=20, help='Number of files in each folder')
+
+    def handle(self, **options):
+        data = FakeDukeDSData(project_count=options['projects'],
+                              folders_per_project=options['folders'],
+                              files_per_folder=options['files'])
+        server = FakeDukeDSServer(data, host=options['host'], port=options['port'], latency=options['latency'],
+                                  verbose=True)
+        self.stdout.write("Fake DukeDS running with api_root {}".format(server.api_root))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
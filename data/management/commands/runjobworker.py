@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from data.jobworker import QueuedJobWorker
+import time
+
+
+class Command(BaseCommand):
+    help = 'Gives DukeDS permissions and sends lando messages for jobs queued by the start and restart endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool-size', type=int, default=settings.JOB_WORKER_POOL_SIZE,
+                            help='Number of jobs to process at the same time')
+        parser.add_argument('--poll-seconds', type=float, default=settings.JOB_WORKER_POLL_SECONDS,
+                            help='Seconds to wait before checking for queued jobs again')
+        parser.add_argument('--once', action='store_true', help='Exit once all queued jobs are processed')
+
+    def handle(self, **options):
+        worker = QueuedJobWorker(pool_size=options['pool_size'])
+        try:
+            while True:
+                sent = worker.process_queued_jobs()
+                if sent:
+                    self.stdout.write("Processed {} queued jobs.".format(sent))
+                if options['once']:
+                    break
+                time.sleep(options['poll_seconds'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.shutdown()
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from data.mailer import EmailMessageBatchSender, EmailDigestBuilder
+from data.exceptions import EmailServiceException
+import time
+
+
+class Command(BaseCommand):
+    help = 'Builds due digest messages and sends NEW and ERROR email messages in batches over a single SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.EMAIL_BATCH_SIZE,
+                            help='Maximum number of messages to send per SMTP connection')
+        parser.add_argument('--rate-limit', type=float, default=settings.EMAIL_SEND_RATE_LIMIT,
+                            help='Maximum number of messages to send per second')
+        parser.add_argument('--poll-seconds', type=float, default=settings.EMAIL_SEND_POLL_SECONDS,
+                            help='Seconds to wait before checking for new messages again')
+        parser.add_argument('--once', action='store_true', help='Exit once no messages are ready to send')
+
+    def handle(self, **options):
+        sender = EmailMessageBatchSender(batch_size=options['batch_size'], rate_limit=options['rate_limit'])
+        digest_builder = EmailDigestBuilder()
+        try:
+            while True:
+                digests = digest_builder.build_due_digests()
+                if digests:
+                    self.stdout.write("Built {} digest messages.".format(len(digests)))
+                try:
+                    sent, failed = sender.send_all()
+                    if sent or failed:
+                        self.stdout.write("Sent {} messages, {} failed.".format(sent, failed))
+                except EmailServiceException as e:
+                    self.stderr.write("Unable to connect to email server: {}".format(e))
+                if options['once']:
+                    break
+                time.sleep(options['poll_seconds'])
+        except KeyboardInterrupt:
+            pass
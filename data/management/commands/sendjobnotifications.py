@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from data.mailer import JobStateNotificationSender
+import time
+
+
+class Command(BaseCommand):
+    help = 'Renders and delivers the email messages for job state changes made by lando'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.JOB_NOTIFICATION_BATCH_SIZE,
+                            help='Maximum number of job state changes to mail per batch')
+        parser.add_argument('--poll-seconds', type=float, default=settings.JOB_NOTIFICATION_POLL_SECONDS,
+                            help='Seconds to wait before checking for job state changes again')
+        parser.add_argument('--once', action='store_true', help='Exit once all job state changes are mailed')
+
+    def handle(self, **options):
+        sender = JobStateNotificationSender(batch_size=options['batch_size'])
+        try:
+            while True:
+                sent, failed = sender.send_batch()
+                if sent or failed:
+                    self.stdout.write("Mailed {} job state changes, {} failed.".format(sent, failed))
+                if sent == options['batch_size']:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_seconds'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0090_workflowversiontooldetails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exchange', models.CharField(blank=True, default='', help_text='Exchange to publish to, blank for the default exchange', max_length=255)),
+                ('routing_key', models.CharField(help_text='Routing key (queue name for the default exchange)', max_length=255)),
+                ('durable_queue', models.BooleanField(default=False, help_text='Declare routing_key as a durable queue and send a persistent message')),
+                ('body', models.BinaryField(help_text='Message body')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('lando_connection', models.ForeignKey(help_text='AMQP server to send this message to', on_delete=django.db.models.deletion.CASCADE, to='data.LandoConnection')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
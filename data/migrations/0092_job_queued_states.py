@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 15:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0091_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='state',
+            field=models.CharField(choices=[('N', 'New'), ('A', 'Authorized'), ('S', 'Starting'), ('R', 'Running'), ('F', 'Finished'), ('E', 'Error'), ('c', 'Canceling'), ('C', 'Canceled'), ('r', 'Restarting'), ('D', 'Deleted'), ('q', 'Start Queued'), ('Q', 'Restart Queued')], default='N', help_text='High level state of the project', max_length=1),
+        ),
+        migrations.AlterField(
+            model_name='jobactivity',
+            name='state',
+            field=models.CharField(choices=[('N', 'New'), ('A', 'Authorized'), ('S', 'Starting'), ('R', 'Running'), ('F', 'Finished'), ('E', 'Error'), ('c', 'Canceling'), ('C', 'Canceled'), ('r', 'Restarting'), ('D', 'Deleted'), ('q', 'Start Queued'), ('Q', 'Restart Queued')], default='N', help_text='High level state of the project', max_length=1),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 16:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('data', '0092_job_queued_states'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Value of the Idempotency-Key header', max_length=255)),
+                ('method', models.CharField(help_text='HTTP method of the original request', max_length=10)),
+                ('path', models.TextField(help_text='Path of the original request')),
+                ('request_hash', models.CharField(help_text='SHA-256 hash of the original request body', max_length=64)),
+                ('response_status_code', models.IntegerField(blank=True, help_text='Status code of the response, empty while in progress', null=True)),
+                ('response_data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, help_text='Data of the response', null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField(db_index=True, help_text='When this key may be reused')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together=set([('user', 'key')]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 16:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0093_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, help_text='Earliest time the batch sender will retry this message', null=True),
+        ),
+        migrations.AddField(
+            model_name='emailmessage',
+            name='send_attempts',
+            field=models.IntegerField(default=0, help_text='Number of times sending this message failed'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 17:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0094_emailmessage_send_attempts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template_name', models.CharField(help_text='Name of the EmailTemplate that would have been sent for this change', max_length=255)),
+                ('to_email', models.EmailField(db_index=True, help_text='Email address of the recipient', max_length=254)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('email_message', models.ForeignKey(blank=True, help_text='Digest message this notification was sent in, empty while pending', null=True, on_delete=django.db.models.deletion.SET_NULL, to='data.EmailMessage')),
+                ('job', models.ForeignKey(help_text='Job whose state changed', on_delete=django.db.models.deletion.CASCADE, to='data.Job')),
+            ],
+            options={
+                'ordering': ['created', 'id'],
+            },
+        ),
+    ]
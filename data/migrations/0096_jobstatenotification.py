@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 17:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0095_emailnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobStateNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('N', 'New'), ('A', 'Authorized'), ('S', 'Starting'), ('R', 'Running'), ('F', 'Finished'), ('E', 'Error'), ('c', 'Canceling'), ('C', 'Canceled'), ('r', 'Restarting'), ('D', 'Deleted'), ('q', 'Start Queued'), ('Q', 'Restart Queued')], help_text='State the job changed to', max_length=1)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('job', models.ForeignKey(help_text='Job whose state changed', on_delete=django.db.models.deletion.CASCADE, to='data.Job')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 19:05
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import re
+
+WORKFLOW_VERSION_PART_SORT_DIGITS = 10
+
+
+def populate_version_sort_key(apps, schema_editor):
+    WorkflowVersion = apps.get_model("data", "WorkflowVersion")
+    for workflow_version in WorkflowVersion.objects.all():
+        workflow_version.version_sort_key = [part.zfill(WORKFLOW_VERSION_PART_SORT_DIGITS)
+                                             for part in re.split("\.|\-", workflow_version.version)]
+        workflow_version.save(update_fields=['version_sort_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0097_emailmessage_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowversion',
+            name='version_sort_key',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, editable=False, help_text='Zero padded parts of version, set on save for sorting versions in SQL.', size=None),
+        ),
+        migrations.RunPython(populate_version_sort_key, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='workflowversion',
+            index_together=set([('workflow', 'version_sort_key')]),
+        ),
+    ]
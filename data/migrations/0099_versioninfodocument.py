@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 19:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0098_workflowversion_version_sort_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionInfoDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField(help_text='URL the document was fetched from', unique=True)),
+                ('content', models.TextField(help_text='Base64 encoded document contents')),
+                ('content_type', models.TextField(blank=True, help_text='Content-Type header of the response')),
+                ('etag', models.TextField(blank=True, help_text='ETag header of the response, used to revalidate the document')),
+                ('last_modified', models.TextField(blank=True, help_text='Last-Modified header of the response, used to revalidate the document')),
+                ('fetched', models.DateTimeField(help_text='When the document was last fetched or revalidated')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 20:30
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0099_versioninfodocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSnapshot',
+            fields=[
+                ('version', models.AutoField(primary_key=True, serialize=False)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, help_text='Catalog response, empty until built', null=True)),
+                ('etag', models.CharField(blank=True, help_text='Strong ETag for data', max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
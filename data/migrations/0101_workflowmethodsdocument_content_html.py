@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 21:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import markdown
+
+METHODS_DOCUMENT_MARKDOWN_EXTENSIONS = ['markdown.extensions.extra']
+
+
+def populate_content_html(apps, schema_editor):
+    WorkflowMethodsDocument = apps.get_model("data", "WorkflowMethodsDocument")
+    for methods_document in WorkflowMethodsDocument.objects.all():
+        methods_document.content_html = markdown.markdown(methods_document.content,
+                                                          extensions=METHODS_DOCUMENT_MARKDOWN_EXTENSIONS)
+        methods_document.save(update_fields=['content_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0100_catalogsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowmethodsdocument',
+            name='content_html',
+            field=models.TextField(blank=True, editable=False, help_text='Methods document contents rendered to HTML when saved.'),
+        ),
+        migrations.RunPython(populate_content_html, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 21:30
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+TOOL_DETAILS_NAME_KEYS = ('package', 'name')
+WORKFLOW_VERSION_PART_SORT_DIGITS = 10
+
+
+def find_tool_versions(details):
+    tool_versions = set()
+    if isinstance(details, list):
+        for item in details:
+            tool_versions.update(find_tool_versions(item))
+    elif isinstance(details, dict):
+        name = next((details[key] for key in TOOL_DETAILS_NAME_KEYS if key in details), None)
+        versions = details.get('version')
+        if name and versions:
+            if not isinstance(versions, list):
+                versions = [versions]
+            tool_versions.update((str(name), str(version)) for version in versions)
+        for value in details.values():
+            tool_versions.update(find_tool_versions(value))
+    return tool_versions
+
+
+def make_version_sort_key(version):
+    return [part.zfill(WORKFLOW_VERSION_PART_SORT_DIGITS) for part in re.split("\.|\-", version)]
+
+
+def populate_workflow_version_tools(apps, schema_editor):
+    WorkflowVersionToolDetails = apps.get_model("data", "WorkflowVersionToolDetails")
+    WorkflowVersionTool = apps.get_model("data", "WorkflowVersionTool")
+    for tool_details in WorkflowVersionToolDetails.objects.all():
+        WorkflowVersionTool.objects.bulk_create([
+            WorkflowVersionTool(tool_details=tool_details, name=name, version=version,
+                                version_sort_key=make_version_sort_key(version))
+            for name, version in find_tool_versions(tool_details.details)
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0101_workflowmethodsdocument_content_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowVersionTool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Name of the tool or package', max_length=255)),
+                ('version', models.CharField(help_text='Version of the tool or package', max_length=255)),
+                ('version_sort_key', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, help_text='Zero padded parts of version for comparing versions in SQL.', size=None)),
+                ('tool_details', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tools', to='data.WorkflowVersionToolDetails')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='workflowversiontool',
+            index_together=set([('name', 'version_sort_key')]),
+        ),
+        migrations.RunPython(populate_workflow_version_tools, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 22:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+import json
+
+
+def populate_job_order_data(apps, schema_editor):
+    Job = apps.get_model("data", "Job")
+    for job in Job.objects.only('id', 'job_order').iterator():
+        try:
+            job_order_data = json.loads(job.job_order)
+        except (TypeError, ValueError):
+            continue
+        Job.objects.filter(pk=job.pk).update(job_order_data=job_order_data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0102_workflowversiontool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='job_order_data',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, editable=False, help_text='job_order parsed on save, GIN indexed for containment queries.', null=True),
+        ),
+        migrations.RunPython(populate_job_order_data, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "CREATE INDEX data_job_job_order_data_gin ON data_job USING gin (job_order_data jsonb_path_ops);",
+            "DROP INDEX data_job_job_order_data_gin;"
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-19 22:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0103_job_job_order_data'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ddsjobinputfile',
+            name='file_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='ddsjobinputfile',
+            name='project_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-20 09:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0106_outboxmessage_claimed_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='queue_attempts',
+            field=models.IntegerField(default=0, help_text='Number of failed attempts by the job worker to start the queued job'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='queue_next_attempt',
+            field=models.DateTimeField(blank=True, help_text='When the job worker may next try to start the queued job', null=True),
+        ),
+    ]
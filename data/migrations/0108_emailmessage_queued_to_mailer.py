@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-20 10:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0107_job_queue_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailmessage',
+            name='queued_to_mailer',
+            field=models.BooleanField(default=False, help_text='Message was queued for bespin-mailer, so it is sent through the send endpoint instead of the batch sender'),
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, help_text='Earliest time the batch sender will retry this message, or when the claim of a message in Sending state expires', null=True),
+        ),
+        migrations.AlterField(
+            model_name='emailmessage',
+            name='state',
+            field=models.TextField(choices=[('N', 'New'), ('S', 'Sent'), ('E', 'Error'), ('P', 'Sending')], default='N'),
+        ),
+    ]
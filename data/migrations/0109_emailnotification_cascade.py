@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-20 10:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0108_emailmessage_queued_to_mailer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='emailnotification',
+            name='email_message',
+            field=models.ForeignKey(blank=True, help_text='Digest message this notification was sent in, empty while pending', null=True, on_delete=django.db.models.deletion.CASCADE, to='data.EmailMessage'),
+        ),
+    ]
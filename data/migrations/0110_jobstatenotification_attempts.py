@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-20 11:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0109_emailnotification_cascade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobstatenotification',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Number of times mailing this notification failed'),
+        ),
+        migrations.AddField(
+            model_name='jobstatenotification',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, help_text='Earliest time sendjobnotifications will retry this notification', null=True),
+        ),
+        migrations.AddField(
+            model_name='jobstatenotification',
+            name='last_error',
+            field=models.TextField(blank=True, help_text='Error from the last failed attempt'),
+        ),
+    ]
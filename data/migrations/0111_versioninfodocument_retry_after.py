@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-20 11:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0110_jobstatenotification_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versioninfodocument',
+            name='retry_after',
+            field=models.DateTimeField(blank=True, help_text='When revalidation last failed, the time before which it is not retried', null=True),
+        ),
+    ]
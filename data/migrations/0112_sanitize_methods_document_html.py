@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.1 on 2026-10-20 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+import markdown
+import bleach
+
+METHODS_DOCUMENT_MARKDOWN_EXTENSIONS = ['markdown.extensions.extra']
+METHODS_DOCUMENT_HTML_TAGS = [
+    'a', 'abbr', 'blockquote', 'br', 'code', 'dd', 'div', 'dl', 'dt', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+    'img', 'li', 'ol', 'p', 'pre', 'strong', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+]
+METHODS_DOCUMENT_HTML_ATTRIBUTES = {
+    'a': ['href', 'title', 'class', 'rev'],
+    'abbr': ['title'],
+    'div': ['class'],
+    'img': ['src', 'alt', 'title'],
+    'li': ['id'],
+    'sup': ['id'],
+    'td': ['align'],
+    'th': ['align'],
+}
+METHODS_DOCUMENT_HTML_PROTOCOLS = ['http', 'https', 'mailto']
+
+
+def sanitize_content_html(apps, schema_editor):
+    WorkflowMethodsDocument = apps.get_model("data", "WorkflowMethodsDocument")
+    for methods_document in WorkflowMethodsDocument.objects.all():
+        html = markdown.markdown(methods_document.content, extensions=METHODS_DOCUMENT_MARKDOWN_EXTENSIONS)
+        methods_document.content_html = bleach.clean(html, tags=METHODS_DOCUMENT_HTML_TAGS,
+                                                     attributes=METHODS_DOCUMENT_HTML_ATTRIBUTES,
+                                                     protocols=METHODS_DOCUMENT_HTML_PROTOCOLS)
+        methods_document.save(update_fields=['content_html'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0111_versioninfodocument_retry_after'),
+    ]
+
+    operations = [
+        migrations.RunPython(sanitize_content_html, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,38 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.fields import JSONField, ArrayField
+from django.template import Template
+from django.utils import timezone
 from gcb_web_auth.models import DDSUserCredential, DDSEndpoint
+import threading
+import hashlib
+import markdown
+import bleach
 import json
+import time
 import re
 
 WORKFLOW_VERSION_PART_SORT_DIGITS = 10
+METHODS_DOCUMENT_MARKDOWN_EXTENSIONS = ['markdown.extensions.extra']
+# HTML the markdown 'extra' extensions produce, anything else (including raw HTML in the markdown) is escaped
+METHODS_DOCUMENT_HTML_TAGS = [
+    'a', 'abbr', 'blockquote', 'br', 'code', 'dd', 'div', 'dl', 'dt', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+    'img', 'li', 'ol', 'p', 'pre', 'strong', 'sup', 'table', 'tbody', 'td', 'th', 'thead', 'tr', 'ul',
+]
+METHODS_DOCUMENT_HTML_ATTRIBUTES = {
+    'a': ['href', 'title', 'class', 'rev'],
+    'abbr': ['title'],
+    'div': ['class'],
+    'img': ['src', 'alt', 'title'],
+    'li': ['id'],
+    'sup': ['id'],
+    'td': ['align'],
+    'th': ['align'],
+}
+METHODS_DOCUMENT_HTML_PROTOCOLS = ['http', 'https', 'mailto']
+TOOL_DETAILS_NAME_KEYS = ('package', 'name')
 
 
 class DDSUser(models.Model):
@@ -22,7 +48,16 @@ class DDSUser(models.Model):
         return "DDSUser - pk: {} name: '{}', dds_id: '{}'".format(self.pk, self.name, self.dds_id,)
 
 
-class Workflow(models.Model):
+class CatalogModelMixin(object):
+    """
+    Marks a model included in the /api/v2/catalog response. Signal receivers at the end of this module bump the
+    catalog snapshot version whenever one is saved or deleted, when share group members change and when a DDSUser
+    is deleted. QuerySet.update() and bulk_create() send no signals, so callers using them must call
+    CatalogSnapshot.invalidate().
+    """
+
+
+class Workflow(CatalogModelMixin, models.Model):
     """
     Name of a workflow that will apply some processing to some data.
     """
@@ -42,7 +77,17 @@ class Workflow(models.Model):
         return "Workflow - pk: {} name: '{}', state: {}, tag: '{}'".format(self.pk, self.name, self.get_state_display(), self.tag,)
 
 
-class WorkflowVersion(models.Model):
+class WorkflowVersionQuerySet(models.QuerySet):
+    def with_related(self):
+        """
+        Join the workflow, methods document and tool details used when serializing versions so listing versions
+        takes a fixed number of queries. Only the ids of the methods document and tool details are loaded.
+        """
+        return self.select_related('workflow', 'methods_document', 'tool_details') \
+            .defer('methods_document__content', 'tool_details__details')
+
+
+class WorkflowVersion(CatalogModelMixin, models.Model):
     """
     Specific version of a Workflow.
     """
@@ -66,42 +111,178 @@ class WorkflowVersion(models.Model):
     fields = JSONField(help_text="Array of fields required by this workflow.")
     enable_ui = models.BooleanField(default=True,
                                     help_text="Should this workflow version be enabled in the web portal.")
+    version_sort_key = ArrayField(models.CharField(max_length=255), default=list, editable=False,
+                                  help_text="Zero padded parts of version, set on save for sorting versions in SQL.")
+
+    objects = WorkflowVersionQuerySet.as_manager()
 
     class Meta:
         unique_together = ('workflow', 'version',)
+        index_together = ('workflow', 'version_sort_key',)
 
     def __str__(self):
         return "WorkflowVersion - pk: {} workflow.pk: {} - {}/{}: {}".format(self.pk, self.workflow.pk,  self.workflow.tag, self.version, self.description)
 
+    def save(self, *args, **kwargs):
+        self.version_sort_key = WorkflowVersion.make_version_sort_key(self.version)
+        super(WorkflowVersion, self).save(*args, **kwargs)
+
+    @staticmethod
+    def make_version_sort_key(version):
+        """
+        :param version: str: version string such as '1.0.5-alpha'
+        :return: [str]: parts of version split on '.' and '-' and left padded with zeros
+        """
+        return [part.zfill(WORKFLOW_VERSION_PART_SORT_DIGITS) for part in re.split("\.|\-", version)]
+
     @staticmethod
     def sort_workflow_then_version_key(workflow_version):
-        parts = [workflow_version.workflow.id]
-        for part in re.split("\.|\-", workflow_version.version):
-            left_padded_part = part.zfill(WORKFLOW_VERSION_PART_SORT_DIGITS)
-            parts.append(left_padded_part)
-        return parts
+        return [workflow_version.workflow_id] + WorkflowVersion.make_version_sort_key(workflow_version.version)
 
+    @staticmethod
+    def sorted_queryset(queryset):
+        """
+        :param queryset: QuerySet: WorkflowVersions
+        :return: QuerySet: versions ordered by workflow and then version as sort_workflow_then_version_key does
+        """
+        return queryset.order_by('workflow_id', 'version_sort_key', 'id')
 
-class WorkflowVersionToolDetails(models.Model):
+
+class WorkflowVersionToolDetails(CatalogModelMixin, models.Model):
     workflow_version = models.OneToOneField(WorkflowVersion, related_name='tool_details', null=False)
     details = JSONField(help_text='JSON array of tool details and versions')
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(WorkflowVersionToolDetails, self).save(*args, **kwargs)
+            self.update_tools()
+
+    def update_tools(self):
+        """
+        Replace the WorkflowVersionTool rows for this record with the tools found in details.
+        """
+        self.tools.all().delete()
+        WorkflowVersionTool.objects.bulk_create([
+            WorkflowVersionTool(tool_details=self, name=name, version=version,
+                                version_sort_key=WorkflowVersion.make_version_sort_key(version))
+            for name, version in WorkflowVersionToolDetails.find_tool_versions(self.details)
+        ])
+
+    @staticmethod
+    def find_tool_versions(details):
+        """
+        Find tool names and versions in tool details JSON.
+        Any object with a 'package' or 'name' key and a 'version' key is a tool, version may be a string or a list.
+        :param details: JSON array of tool details
+        :return: set of (name, version) tuples
+        """
+        tool_versions = set()
+        if isinstance(details, list):
+            for item in details:
+                tool_versions.update(WorkflowVersionToolDetails.find_tool_versions(item))
+        elif isinstance(details, dict):
+            name = next((details[key] for key in TOOL_DETAILS_NAME_KEYS if key in details), None)
+            versions = details.get('version')
+            if name and versions:
+                if not isinstance(versions, list):
+                    versions = [versions]
+                tool_versions.update((str(name), str(version)) for version in versions)
+            for value in details.values():
+                tool_versions.update(WorkflowVersionToolDetails.find_tool_versions(value))
+        return tool_versions
+
     def __str__(self):
         return "WorkflowVersionToolDetails - pk: {}, workflow_version: {}".format(self.pk, self.workflow_version)
 
 
-class WorkflowMethodsDocument(models.Model):
+class WorkflowVersionTool(models.Model):
+    """
+    Tool name and version found in WorkflowVersionToolDetails.details, indexed to search versions by the tools they use.
+    """
+    tool_details = models.ForeignKey(WorkflowVersionToolDetails, on_delete=models.CASCADE, related_name='tools')
+    name = models.CharField(max_length=255, help_text="Name of the tool or package")
+    version = models.CharField(max_length=255, help_text="Version of the tool or package")
+    version_sort_key = ArrayField(models.CharField(max_length=255), default=list,
+                                  help_text="Zero padded parts of version for comparing versions in SQL.")
+
+    class Meta:
+        index_together = ('name', 'version_sort_key',)
+
+    def __str__(self):
+        return "WorkflowVersionTool - pk: {} tool_details.pk: {} - {} {}".format(self.pk, self.tool_details_id,
+                                                                                  self.name, self.version)
+
+
+class WorkflowMethodsDocument(CatalogModelMixin, models.Model):
     """
     Methods document for a particular workflow version.
     """
     workflow_version = models.OneToOneField(WorkflowVersion, on_delete=models.CASCADE,
                                             related_name='methods_document')
     content = models.TextField(help_text="Methods document contents in markdown.")
+    content_html = models.TextField(blank=True, editable=False,
+                                    help_text="Methods document contents rendered to HTML when saved.")
+
+    def save(self, *args, **kwargs):
+        self.content_html = WorkflowMethodsDocument.render_html(self.content)
+        super(WorkflowMethodsDocument, self).save(*args, **kwargs)
+
+    @staticmethod
+    def render_html(content):
+        """
+        :param content: str: markdown text
+        :return: str: HTML rendered with the markdown 'extra' extensions (tables, footnotes, etc), sanitized so raw
+        HTML such as <script> tags and javascript: links in the markdown is escaped or removed
+        """
+        html = markdown.markdown(content, extensions=METHODS_DOCUMENT_MARKDOWN_EXTENSIONS)
+        return bleach.clean(html, tags=METHODS_DOCUMENT_HTML_TAGS, attributes=METHODS_DOCUMENT_HTML_ATTRIBUTES,
+                            protocols=METHODS_DOCUMENT_HTML_PROTOCOLS)
 
     def __str__(self):
         return "WorkflowMethodsDocument - pk: {} workflow_version.pk".format(self.pk, self.workflow_version.pk,)
 
 
+class VersionInfoDocument(models.Model):
+    """
+    Cached copy of a workflow version-info document fetched from its url.
+    """
+    url = models.TextField(unique=True, help_text="URL the document was fetched from")
+    content = models.TextField(help_text="Base64 encoded document contents")
+    content_type = models.TextField(blank=True, help_text="Content-Type header of the response")
+    etag = models.TextField(blank=True, help_text="ETag header of the response, used to revalidate the document")
+    last_modified = models.TextField(blank=True,
+                                     help_text="Last-Modified header of the response, used to revalidate the document")
+    fetched = models.DateTimeField(help_text="When the document was last fetched or revalidated")
+    retry_after = models.DateTimeField(null=True, blank=True,
+                                       help_text="When revalidation last failed, the time before which it is not retried")
+
+    def needs_revalidation(self):
+        """
+        :return: boolean: True when the document is older than VERSION_INFO_CACHE_SECONDS
+        and no failed revalidation is waiting to be retried
+        """
+        now = timezone.now()
+        if self.retry_after and now < self.retry_after:
+            return False
+        age = now - self.fetched
+        return age.total_seconds() > settings.VERSION_INFO_CACHE_SECONDS
+
+    def __str__(self):
+        return "VersionInfoDocument - pk: {} url: '{}' fetched: {}".format(self.pk, self.url, self.fetched)
+
+
+class DOICitation(models.Model):
+    """
+    APA citation resolved for a DOI, cached so importing workflow versions does not resolve the same DOI again.
+    """
+    doi = models.CharField(max_length=255, unique=True, help_text="DOI name such as 10.1000/xyz123")
+    apa_citation = models.TextField(help_text="APA style citation text for the DOI")
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "DOICitation - pk: {} doi: '{}'".format(self.pk, self.doi)
+
+
 class JobFileStageGroup(models.Model):
     """
     Group of files to stage for a job
@@ -122,7 +303,7 @@ class JobToken(models.Model):
         return "JobToken - pk: {} token: '{}'".format(self.pk, self.token,)
 
 
-class ShareGroup(models.Model):
+class ShareGroup(CatalogModelMixin, models.Model):
     """A
     Group of users who will have data shared with them when a job finishes
     """
@@ -135,7 +316,7 @@ class ShareGroup(models.Model):
         return "ShareGroup - pk: {} name: '{}' email: '{}'".format(self.pk, self.name, self.email,)
 
 
-class JobFlavor(models.Model):
+class JobFlavor(CatalogModelMixin, models.Model):
     """
     Specifies CPU/RAM requested of a cloud resource.
     For a VM we use the name field. For K8s container we use cpus and memory.
@@ -180,6 +361,39 @@ class CloudSettingsOpenStack(models.Model):
         verbose_name_plural = "Cloud Settings Collections"
 
 
+class LandoConnectionCache(object):
+    """
+    In-process cache of JobSettings id to LandoConnection.
+    Cleared when a LandoConnection or JobSettings is saved in this process. Entries expire after
+    LANDO_CONNECTION_CACHE_SECONDS so changes saved by other processes are picked up.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, job_settings_id):
+        """
+        :param job_settings_id: int: id of the JobSettings to look up the lando connection for
+        :return: LandoConnection
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(job_settings_id)
+        if entry and entry[1] > now:
+            return entry[0]
+        lando_connection = JobSettings.objects.select_related('lando_connection').get(pk=job_settings_id).lando_connection
+        with self.lock:
+            self.entries[job_settings_id] = (lando_connection, now + settings.LANDO_CONNECTION_CACHE_SECONDS)
+        return lando_connection
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+lando_connection_cache = LandoConnectionCache()
+
+
 class LandoConnection(models.Model):
     """
     Settings used to connect with lando to start, restart or cancel a job.
@@ -198,8 +412,20 @@ class LandoConnection(models.Model):
 
     @staticmethod
     def get_for_job_id(job_id):
-        job = Job.objects.get(pk=job_id)
-        return job.job_settings.lando_connection
+        job_settings_id = Job.objects.filter(pk=job_id).values_list('job_settings_id', flat=True).get()
+        return LandoConnection.get_for_job_settings_id(job_settings_id)
+
+    @staticmethod
+    def get_for_job_settings_id(job_settings_id):
+        return lando_connection_cache.get(job_settings_id)
+
+    def save(self, *args, **kwargs):
+        super(LandoConnection, self).save(*args, **kwargs)
+        lando_connection_cache.clear()
+
+    def delete(self, *args, **kwargs):
+        super(LandoConnection, self).delete(*args, **kwargs)
+        lando_connection_cache.clear()
 
     def __str__(self):
         return "LandoConnection - pk: {} host: '{}' cluster_type: {}".format(self.pk, self.host, self.cluster_type)
@@ -273,6 +499,14 @@ class JobSettings(models.Model):
             if self.job_runtime_openstack:
                 raise ValidationError("job_runtime_openstack must be null when using a lando_connection with k8s cluster type")
 
+    def save(self, *args, **kwargs):
+        super(JobSettings, self).save(*args, **kwargs)
+        lando_connection_cache.clear()
+
+    def delete(self, *args, **kwargs):
+        super(JobSettings, self).delete(*args, **kwargs)
+        lando_connection_cache.clear()
+
     def __str__(self):
         return "JobSettings - pk: {} name: '{}' cluster_type: '{}'".format(self.pk, self.name,
                                                                            self.lando_connection.cluster_type)
@@ -295,6 +529,8 @@ class Job(models.Model):
     JOB_STATE_CANCEL = 'C'
     JOB_STATE_RESTARTING = 'r'
     JOB_STATE_DELETED = 'D'
+    JOB_STATE_START_QUEUED = 'q'
+    JOB_STATE_RESTART_QUEUED = 'Q'
     JOB_STATES = (
         (JOB_STATE_NEW, 'New'),
         (JOB_STATE_AUTHORIZED, 'Authorized'),
@@ -306,6 +542,8 @@ class Job(models.Model):
         (JOB_STATE_CANCEL, 'Canceled'),
         (JOB_STATE_RESTARTING, 'Restarting'),
         (JOB_STATE_DELETED, 'Deleted'),
+        (JOB_STATE_START_QUEUED, 'Start Queued'),
+        (JOB_STATE_RESTART_QUEUED, 'Restart Queued'),
     )
 
     JOB_STEP_CREATE_VM = 'V'
@@ -347,6 +585,8 @@ class Job(models.Model):
                                       help_text="Name of the volume attached to store data for this job.")
     job_order = models.TextField(blank=True,
                                  help_text="CWL input json for use with the workflow.")
+    job_order_data = JSONField(null=True, blank=True, editable=False,
+                               help_text="job_order parsed on save, GIN indexed for containment queries.")
     stage_group = models.OneToOneField(JobFileStageGroup, null=True,
                                        help_text='Group of files to stage when running this job')
     run_token = models.OneToOneField(JobToken, blank=True, null=True,
@@ -359,14 +599,33 @@ class Job(models.Model):
                                      help_text='Should the VM and Volume be deleted upon job completion')
     vm_volume_mounts = models.TextField(default=json.dumps({'/dev/vdb1': '/work'}),
                                         help_text='JSON-encoded dictionary of volume mounts, e.g. {"/dev/vdb1": "/work"}')
+    queue_attempts = models.IntegerField(default=0,
+                                         help_text='Number of failed attempts by the job worker to start the queued job')
+    queue_next_attempt = models.DateTimeField(null=True, blank=True,
+                                              help_text='When the job worker may next try to start the queued job')
 
     def save(self, *args, **kwargs):
         if self.stage_group is not None and self.stage_group.user != self.user:
             raise ValidationError('stage group user does not match job user')
+        self.job_order_data = Job.parse_job_order(self.job_order)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'job_order' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['job_order_data']
         super(Job, self).save(*args, **kwargs)
         if self.should_create_activity():
             JobActivity.objects.create(job=self, state=self.state, step=self.step)
 
+    @staticmethod
+    def parse_job_order(job_order):
+        """
+        :param job_order: str: CWL input json
+        :return: parsed job order or None when job_order is not valid JSON
+        """
+        try:
+            return json.loads(job_order)
+        except (TypeError, ValueError):
+            return None
+
     def should_create_activity(self):
         job_activities = JobActivity.objects.filter(job=self).order_by('-created')
         if not job_activities:
@@ -522,8 +781,8 @@ class DDSJobInputFile(models.Model):
     stage_group = models.ForeignKey(JobFileStageGroup,
                                     help_text='Stage group to which this file belongs',
                                     related_name='dds_files')
-    project_id = models.CharField(max_length=255)
-    file_id = models.CharField(max_length=255)
+    project_id = models.CharField(max_length=255, db_index=True)
+    file_id = models.CharField(max_length=255, db_index=True)
     dds_user_credentials = models.ForeignKey(DDSUserCredential, on_delete=models.CASCADE)
     destination_path = models.CharField(max_length=255)
     size = models.BigIntegerField(default=0, help_text='Size of file in bytes')
@@ -563,6 +822,57 @@ class URLJobInputFile(models.Model):
             format(self.pk, self.stage_group.pk, self.url, self.destination_path, self.size, )
 
 
+class EmailTemplateCache(object):
+    """
+    In-process cache of EmailTemplates by name and their compiled django templates.
+    Compiled templates are keyed by template id and a hash of the template text so edited text is never rendered
+    from a stale compiled template. Cleared when an EmailTemplate is saved in this process. Templates looked up by
+    name expire after EMAIL_TEMPLATE_CACHE_SECONDS so changes saved by other processes are picked up.
+    """
+    def __init__(self):
+        self.templates_by_name = {}
+        self.compiled_templates = {}
+        self.lock = threading.Lock()
+
+    def get_by_name(self, name):
+        """
+        :param name: str: name of the EmailTemplate
+        :return: EmailTemplate
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.templates_by_name.get(name)
+        if entry and entry[1] > now:
+            return entry[0]
+        email_template = EmailTemplate.objects.get(name=name)
+        with self.lock:
+            self.templates_by_name[name] = (email_template, now + settings.EMAIL_TEMPLATE_CACHE_SECONDS)
+        return email_template
+
+    def get_compiled(self, template_id, template_text):
+        """
+        :param template_id: int: id of the EmailTemplate the text belongs to
+        :param template_text: str: django template text
+        :return: django.template.Template: compiled template
+        """
+        key = (template_id, hashlib.sha256(template_text.encode('utf-8')).hexdigest())
+        with self.lock:
+            compiled_template = self.compiled_templates.get(key)
+        if compiled_template is None:
+            compiled_template = Template(template_text)
+            with self.lock:
+                self.compiled_templates[key] = compiled_template
+        return compiled_template
+
+    def clear(self):
+        with self.lock:
+            self.templates_by_name = {}
+            self.compiled_templates = {}
+
+
+email_template_cache = EmailTemplateCache()
+
+
 class EmailTemplate(models.Model):
     """
     Represents a base email message that can be sent
@@ -572,6 +882,18 @@ class EmailTemplate(models.Model):
     body_template = models.TextField(help_text='Template text for the message body')
     subject_template = models.TextField(help_text='Template text for the message subject')
 
+    @staticmethod
+    def get_cached_by_name(name):
+        return email_template_cache.get_by_name(name)
+
+    def save(self, *args, **kwargs):
+        super(EmailTemplate, self).save(*args, **kwargs)
+        email_template_cache.clear()
+
+    def delete(self, *args, **kwargs):
+        super(EmailTemplate, self).delete(*args, **kwargs)
+        email_template_cache.clear()
+
     def __str__(self):
         return "EmailTemplate - pk: {} name: '{}'".format(self.pk, self.name)
 
@@ -583,10 +905,12 @@ class EmailMessage(models.Model):
     MESSAGE_STATE_NEW = 'N'
     MESSAGE_STATE_SENT = 'S'
     MESSAGE_STATE_ERROR = 'E'
+    MESSAGE_STATE_SENDING = 'P'
     MESSAGE_STATES = (
         (MESSAGE_STATE_NEW, 'New'),
         (MESSAGE_STATE_SENT, 'Sent'),
         (MESSAGE_STATE_ERROR, 'Error'),
+        (MESSAGE_STATE_SENDING, 'Sending'),
     )
 
     body = models.TextField(help_text='Text of the message body')
@@ -596,6 +920,17 @@ class EmailMessage(models.Model):
     bcc_email = models.TextField(blank=True, help_text='space-separated Email addresses to bcc')
     state = models.TextField(choices=MESSAGE_STATES, default=MESSAGE_STATE_NEW)
     errors = models.TextField(blank=True)
+    send_attempts = models.IntegerField(default=0, help_text='Number of times sending this message failed')
+    next_attempt = models.DateTimeField(null=True, blank=True,
+                                        help_text='Earliest time the batch sender will retry this message, '
+                                                  'or when the claim of a message in Sending state expires')
+    queued_to_mailer = models.BooleanField(default=False,
+                                           help_text='Message was queued for bespin-mailer, '
+                                                     'so it is sent through the send endpoint instead of the batch sender')
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        index_together = ('state', 'created', )
 
     def __str__(self):
         return "EmailMessage - pk: {}: state: '{}' subject: '{}'".format(self.pk, self.get_state_display(), self.subject,)
@@ -610,7 +945,48 @@ class EmailMessage(models.Model):
         self.save()
 
 
-class JobStrategy(models.Model):
+class JobStateNotification(models.Model):
+    """
+    Job state change saved in the same transaction as the change.
+    Mailed and then deleted by the sendjobnotifications management command.
+    """
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, help_text='Job whose state changed')
+    state = models.CharField(max_length=1, choices=Job.JOB_STATES, help_text='State the job changed to')
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0, help_text='Number of times mailing this notification failed')
+    next_attempt = models.DateTimeField(null=True, blank=True,
+                                        help_text='Earliest time sendjobnotifications will retry this notification')
+    last_error = models.TextField(blank=True, help_text='Error from the last failed attempt')
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return "JobStateNotification - pk: {} job: {} state: '{}'".format(self.pk, self.job_id, self.state)
+
+
+class EmailNotification(models.Model):
+    """
+    Job state change notification buffered in digest mode.
+    Pending notifications for a recipient are combined into a single digest EmailMessage.
+    """
+    job = models.ForeignKey(Job, on_delete=models.CASCADE, help_text='Job whose state changed')
+    template_name = models.CharField(max_length=255,
+                                     help_text='Name of the EmailTemplate that would have been sent for this change')
+    to_email = models.EmailField(db_index=True, help_text='Email address of the recipient')
+    created = models.DateTimeField(auto_now_add=True)
+    email_message = models.ForeignKey(EmailMessage, null=True, blank=True, on_delete=models.CASCADE,
+                                      help_text='Digest message this notification was sent in, empty while pending')
+
+    class Meta:
+        ordering = ['created', 'id']
+
+    def __str__(self):
+        return "EmailNotification - pk: {} job: {} to_email: '{}' template_name: '{}'".format(
+            self.pk, self.job_id, self.to_email, self.template_name)
+
+
+class JobStrategy(CatalogModelMixin, models.Model):
     """
     Specifies a VM strategy used to create a job.
     """
@@ -635,7 +1011,7 @@ class JobStrategy(models.Model):
             self.pk, self.name, self.job_flavor.name, self.volume_size_base, self.volume_size_factor)
 
 
-class WorkflowConfiguration(models.Model):
+class WorkflowConfiguration(CatalogModelMixin, models.Model):
     """
     Specifies a set of system-provided answers in JSON format
     """
@@ -652,3 +1028,92 @@ class WorkflowConfiguration(models.Model):
 
     def __str__(self):
         return "WorkflowConfiguration - pk: {}".format(self.pk)
+
+
+class CatalogSnapshot(models.Model):
+    """
+    Serialized catalog of workflows, versions, configurations, job strategies and share groups.
+    A new empty snapshot is saved whenever one of those models changes, so the latest version is always current.
+    Its data is built by the first request that needs it.
+    """
+    version = models.AutoField(primary_key=True)
+    data = JSONField(null=True, blank=True, help_text='Catalog response, empty until built')
+    etag = models.CharField(max_length=255, blank=True, help_text='Strong ETag for data')
+    created = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def invalidate():
+        return CatalogSnapshot.objects.create()
+
+    def __str__(self):
+        return "CatalogSnapshot - version: {} etag: '{}' created: {}".format(self.version, self.etag, self.created)
+
+
+class OutboxMessage(models.Model):
+    """
+    AMQP message saved in the same transaction as the change that caused it.
+    Sent to the AMQP server and then deleted by the dispatchoutbox management command.
+    """
+    lando_connection = models.ForeignKey(LandoConnection, help_text='AMQP server to send this message to')
+    exchange = models.CharField(max_length=255, blank=True, default='',
+                                help_text='Exchange to publish to, blank for the default exchange')
+    routing_key = models.CharField(max_length=255, help_text='Routing key (queue name for the default exchange)')
+    durable_queue = models.BooleanField(default=False,
+                                        help_text='Declare routing_key as a durable queue and send a persistent message')
+    body = models.BinaryField(help_text='Message body')
+    created = models.DateTimeField(auto_now_add=True)
+    claimed_until = models.DateTimeField(null=True, blank=True,
+                                         help_text='A dispatcher is sending this message until this time')
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return "OutboxMessage - pk: {} exchange: '{}' routing_key: '{}' created: {}".format(
+            self.pk, self.exchange, self.routing_key, self.created)
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response to a request made with an Idempotency-Key header, replayed when the request is retried with the same key.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255, help_text='Value of the Idempotency-Key header')
+    method = models.CharField(max_length=10, help_text='HTTP method of the original request')
+    path = models.TextField(help_text='Path of the original request')
+    request_hash = models.CharField(max_length=64, help_text='SHA-256 hash of the original request body')
+    response_status_code = models.IntegerField(null=True, blank=True,
+                                               help_text='Status code of the response, empty while in progress')
+    response_data = JSONField(null=True, blank=True, help_text='Data of the response')
+    created = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField(db_index=True, help_text='When this key may be reused')
+
+    class Meta:
+        unique_together = ('user', 'key', )
+
+    def __str__(self):
+        return "IdempotencyKey - pk: {} user: '{}' key: '{}' path: '{}'".format(self.pk, self.user, self.key, self.path)
+
+
+def invalidate_catalog_snapshot(sender, **kwargs):
+    """
+    post_save/post_delete receiver for catalog models, and post_delete receiver for DDSUser because deleting a user
+    removes its share group memberships without sending signals for the membership table.
+    """
+    CatalogSnapshot.invalidate()
+
+
+def invalidate_catalog_snapshot_on_m2m_change(sender, action, **kwargs):
+    """
+    m2m_changed receiver for share group memberships, e.g. ShareGroup.users.add().
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        CatalogSnapshot.invalidate()
+
+
+# connected per model so deletes of unrelated models can still be fast deletes
+for catalog_model in CatalogModelMixin.__subclasses__():
+    post_save.connect(invalidate_catalog_snapshot, sender=catalog_model)
+    post_delete.connect(invalidate_catalog_snapshot, sender=catalog_model)
+post_delete.connect(invalidate_catalog_snapshot, sender=DDSUser)
+m2m_changed.connect(invalidate_catalog_snapshot_on_m2m_change, sender=ShareGroup.users.through)
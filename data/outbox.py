@@ -0,0 +1,160 @@
+"""
+Transactional outbox for AMQP messages sent to lando and bespin-mailer.
+Messages are saved as OutboxMessage records in the same database transaction as the job/email change that caused
+them so API requests do not wait on the AMQP server. OutboxDispatcher (run by the dispatchoutbox management command)
+claims a batch, publishes it with publisher confirms and deletes each message once the AMQP server has accepted it.
+
+Delivery is at-least-once: a dispatcher that dies or stalls after the server confirms a message but before the message
+is deleted leaves it to be sent again once its claim expires. Every message is published with the AMQP message_id
+property set to its OutboxMessage id, consumers that must not act twice should ignore message ids they have seen.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from data.models import OutboxMessage
+from data.publisher import PublisherPool
+from lando_messaging.workqueue import WorkRequest
+from django.db.models import Q
+import pika
+import pika.exceptions
+import datetime
+import pickle
+import logging
+logger = logging.getLogger(__name__)
+
+# setting protocol to version 2 to be compatible with python2 (matches lando_messaging.workqueue.WorkQueueClient)
+WORK_REQUEST_PICKLE_PROTOCOL = 2
+
+
+def enqueue_message(lando_connection, exchange, routing_key, body, durable_queue=False):
+    """
+    Save a message to be sent by the outbox dispatcher.
+    Call inside the transaction that makes the change this message is about.
+    :param lando_connection: LandoConnection: AMQP server to send the message to
+    :param exchange: str: exchange to publish to ('' for the default exchange)
+    :param routing_key: str: routing key (queue name for the default exchange)
+    :param body: bytes: message body
+    :param durable_queue: boolean: declare routing_key as a durable queue and send a persistent message
+    :return: OutboxMessage
+    """
+    return OutboxMessage.objects.create(lando_connection=lando_connection, exchange=exchange,
+                                        routing_key=routing_key, body=body, durable_queue=durable_queue)
+
+
+def make_work_request_message(lando_connection, queue_name, command, payload):
+    """
+    Build an unsaved message containing a WorkRequest for lando, suitable for OutboxMessage.objects.bulk_create.
+    :param lando_connection: LandoConnection: AMQP server to send the message to
+    :param queue_name: str: name of the durable queue to send the message to
+    :param command: str: name of the command we want run by WorkQueueProcessor
+    :param payload: object: pickable data to be used when running the command
+    :return: OutboxMessage
+    """
+    body = pickle.dumps(WorkRequest(command, payload), protocol=WORK_REQUEST_PICKLE_PROTOCOL)
+    return OutboxMessage(lando_connection=lando_connection, exchange='', routing_key=queue_name, body=body,
+                         durable_queue=True)
+
+
+class OutboxWorkQueueClient(object):
+    """
+    Replacement for lando_messaging WorkQueueClient that saves messages to the outbox instead of sending them.
+    """
+    def __init__(self, lando_connection, queue_name):
+        """
+        :param lando_connection: LandoConnection: AMQP server the message will be sent to
+        :param queue_name: str: name of the queue the message will be sent to
+        """
+        self.lando_connection = lando_connection
+        self.queue_name = queue_name
+
+    def send(self, command, payload):
+        """
+        Save a WorkRequest containing command and payload to be sent to our queue.
+        :param command: str: name of the command we want run by WorkQueueProcessor
+        :param payload: object: pickable data to be used when running the command
+        """
+        make_work_request_message(self.lando_connection, self.queue_name, command, payload).save()
+
+
+class OutboxDispatcher(object):
+    """
+    Sends OutboxMessages in the order they were created, deleting them once the AMQP server confirms them.
+    Concurrent dispatchers claim different batches, so run a single dispatcher when strict ordering matters.
+    """
+    def __init__(self, publisher_pool=None, claim_seconds=None):
+        """
+        :param publisher_pool: PublisherPool: pool of publishers to send with, must use publisher confirms
+        :param claim_seconds: int: seconds to hold the claim on a batch, defaults to settings.OUTBOX_CLAIM_SECONDS
+        """
+        self.publisher_pool = publisher_pool or PublisherPool(confirm_delivery=True)
+        self.claim_seconds = claim_seconds or settings.OUTBOX_CLAIM_SECONDS
+
+    def claim_batch(self, batch_size):
+        """
+        Claim up to batch_size unclaimed messages in a short transaction so other dispatchers skip them.
+        :param batch_size: int: maximum number of messages to claim
+        :return: [OutboxMessage]: claimed messages in the order they were created
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(OutboxMessage.objects.select_for_update().select_related('lando_connection')
+                            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lte=now))
+                            .order_by('id')[:batch_size])
+            OutboxMessage.objects.filter(id__in=[message.id for message in messages]).update(
+                claimed_until=now + datetime.timedelta(seconds=self.claim_seconds))
+        return messages
+
+    def dispatch_batch(self, batch_size):
+        """
+        Claim and send up to batch_size messages. Messages are published outside of any database transaction.
+        Stops at the first message that fails so the order of messages is kept, the claim on that message and the
+        ones after it is released so the next batch retries them.
+        :param batch_size: int: maximum number of messages to send
+        :return: (int, boolean): number of messages sent, True if a message failed to send
+        """
+        messages = self.claim_batch(batch_size)
+        sent_ids = []
+        failed = False
+        for message in messages:
+            if not self._send(message):
+                failed = True
+                break
+            sent_ids.append(message.id)
+            OutboxMessage.objects.filter(id=message.id).delete()
+        unsent_ids = [message.id for message in messages if message.id not in sent_ids]
+        if unsent_ids:
+            OutboxMessage.objects.filter(id__in=unsent_ids).update(claimed_until=None)
+        return len(sent_ids), failed
+
+    def _send(self, message):
+        publisher = self.publisher_pool.get(message.lando_connection)
+        body = bytes(message.body)
+        message_id = str(message.id)
+        try:
+            if message.durable_queue:
+                confirmed = publisher.publish_to_durable_queue(message.routing_key, body, message_id=message_id)
+            else:
+                confirmed = publisher.publish(exchange=message.exchange, routing_key=message.routing_key, body=body,
+                                              properties=pika.BasicProperties(message_id=message_id))
+        except (pika.exceptions.AMQPError, OSError):
+            logger.exception("Failed to send %s.", message)
+            return False
+        if not confirmed:
+            logger.error("AMQP server did not confirm %s.", message)
+        return confirmed
+
+    def dispatch_all(self, batch_size):
+        """
+        Send batches until the outbox is empty or a message fails to send.
+        :param batch_size: int: maximum number of messages to claim per batch
+        :return: (int, boolean): number of messages sent, True if a message failed to send
+        """
+        total_sent = 0
+        while True:
+            sent, failed = self.dispatch_batch(batch_size)
+            total_sent += sent
+            if failed or sent < batch_size:
+                return total_sent, failed
+
+    def close(self):
+        self.publisher_pool.close_all()
@@ -0,0 +1,158 @@
+"""
+AMQP publishers that keep a connection and channel open for each LandoConnection.
+Used to send lando (start/cancel/restart) and bespin-mailer messages without opening a new
+TCP+AMQP connection for each message.
+"""
+import pika
+import pika.exceptions
+import threading
+import time
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+PUBLISH_ATTEMPTS = 2
+# Seconds between AMQP heartbeats requested for publisher connections
+HEARTBEAT_SECONDS = 60
+
+
+class AMQPPublisher(object):
+    """
+    Publishes messages over a single long-lived connection/channel, reconnecting when the connection fails.
+    """
+    def __init__(self, host, username, password, confirm_delivery=True, heartbeat_seconds=HEARTBEAT_SECONDS,
+                 clock=time.monotonic):
+        """
+        :param host: str: AMQP server host
+        :param username: str: AMQP username
+        :param password: str: AMQP password
+        :param confirm_delivery: boolean: wait for the server to confirm each published message
+        :param heartbeat_seconds: int: heartbeat interval, connections idle longer than this are replaced
+        :param clock: func(): returns the current time in seconds
+        """
+        self.host = host
+        self.username = username
+        self.password = password
+        self.confirm_delivery = confirm_delivery
+        self.heartbeat_seconds = heartbeat_seconds
+        self.clock = clock
+        self.last_used = None
+        self.connection = None
+        self.channel = None
+        self.declared_queues = set()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        logger.info("Connecting to %s with user %s.", self.host, self.username)
+        credentials = pika.PlainCredentials(self.username, self.password)
+        # BlockingConnection only services heartbeats while publishing, so a connection left idle longer than
+        # the heartbeat interval may have been dropped by the server or a firewall and is replaced before use.
+        connection_params = pika.ConnectionParameters(host=self.host,
+                                                      credentials=credentials,
+                                                      heartbeat_interval=self.heartbeat_seconds)
+        self.connection = pika.BlockingConnection(connection_params)
+        self.channel = self.connection.channel()
+        if self.confirm_delivery:
+            self.channel.confirm_delivery()
+        self.declared_queues = set()
+
+    def _ensure_channel(self):
+        if self.last_used is not None and self.clock() - self.last_used > self.heartbeat_seconds:
+            logger.info("Replacing idle connection to %s.", self.host)
+            self._close()
+        if self.connection is None or self.connection.is_closed or self.channel is None or self.channel.is_closed:
+            self._close()
+            self._connect()
+
+    def _close(self):
+        if self.connection is not None:
+            try:
+                if not self.connection.is_closed:
+                    self.connection.close()
+            except (pika.exceptions.AMQPError, OSError):
+                logger.exception("Error closing connection to %s.", self.host)
+        self.connection = None
+        self.channel = None
+        self.declared_queues = set()
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        """
+        Publish a message, reconnecting and retrying once if the connection has gone away.
+        :param exchange: str: exchange to publish to ('' for the default exchange)
+        :param routing_key: str: routing key (queue name when using the default exchange)
+        :param body: bytes: message body
+        :param properties: pika.BasicProperties: optional message properties
+        :return: boolean: False if confirm_delivery is on and the server did not accept the message
+        """
+        return self._publish(exchange, routing_key, body, properties, durable_queue=None)
+
+    def publish_to_durable_queue(self, queue_name, body, message_id=None):
+        """
+        Publish a persistent message to a durable queue (same as WorkQueueConnection.send_durable_message).
+        :param queue_name: str: name of the queue to send the message to
+        :param body: bytes: message body
+        :param message_id: str: optional AMQP message_id property
+        :return: boolean: False if confirm_delivery is on and the server did not accept the message
+        """
+        properties = pika.BasicProperties(delivery_mode=2, message_id=message_id)  # make message persistent
+        return self._publish('', queue_name, body, properties, durable_queue=queue_name)
+
+    def _publish(self, exchange, routing_key, body, properties, durable_queue):
+        with self.lock:
+            for attempt in range(1, PUBLISH_ATTEMPTS + 1):
+                try:
+                    self._ensure_channel()
+                    if durable_queue and durable_queue not in self.declared_queues:
+                        self.channel.queue_declare(queue=durable_queue, durable=True)
+                        self.declared_queues.add(durable_queue)
+                    result = self.channel.basic_publish(exchange=exchange, routing_key=routing_key, body=body,
+                                                        properties=properties)
+                    self.last_used = self.clock()
+                    return result
+                except (pika.exceptions.AMQPError, OSError):
+                    self._close()
+                    if attempt == PUBLISH_ATTEMPTS:
+                        raise
+                    logger.warning("Publishing to %s failed, reconnecting.", self.host)
+
+
+class PublisherPool(object):
+    """
+    Holds one AMQPPublisher for each LandoConnection in this process.
+    """
+    def __init__(self, confirm_delivery=True):
+        """
+        :param confirm_delivery: boolean: passed to each AMQPPublisher created by this pool
+        """
+        self.confirm_delivery = confirm_delivery
+        self.publishers = {}
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def get(self, lando_connection):
+        """
+        :param lando_connection: LandoConnection: host and credentials of the AMQP server
+        :return: AMQPPublisher
+        """
+        key = (lando_connection.pk, lando_connection.host, lando_connection.username, lando_connection.password)
+        with self.lock:
+            if self.pid != os.getpid():
+                # connections can not be shared with a forked child process
+                self.publishers = {}
+                self.pid = os.getpid()
+            publisher = self.publishers.get(key)
+            if publisher is None:
+                publisher = AMQPPublisher(lando_connection.host, lando_connection.username,
+                                          lando_connection.password, confirm_delivery=self.confirm_delivery)
+                self.publishers[key] = publisher
+            return publisher
+
+    def close_all(self):
+        with self.lock:
+            for publisher in self.publishers.values():
+                publisher.close()
+            self.publishers = {}
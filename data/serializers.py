@@ -57,7 +57,7 @@ class WorkflowMethodsDocumentSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkflowMethodsDocument
         resource_name = 'workflow-methods-documents'
-        fields = ('id', 'workflow_version', 'content')
+        fields = ('id', 'workflow_version', 'content', 'content_html')
 
 
 class JobDDSOutputProjectSerializer(serializers.ModelSerializer):
@@ -312,6 +312,23 @@ class DDSFileUrlSerializer(serializers.Serializer):
         resource_name = 'dds-file-url'
 
 
+class CircuitBreakerSerializer(serializers.Serializer):
+    """
+    Serializer for data.circuitbreaker.CircuitBreaker state and counters
+    """
+    id = serializers.CharField(source='name')
+    state = serializers.CharField(source='current_state')
+    failure_rate = serializers.FloatField()
+    total_calls = serializers.IntegerField()
+    total_successes = serializers.IntegerField()
+    total_failures = serializers.IntegerField()
+    total_rejected = serializers.IntegerField()
+    times_opened = serializers.IntegerField()
+
+    class Meta:
+        resource_name = 'circuit-breakers'
+
+
 class JobAnswerSetSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True, default=serializers.CurrentUserDefault())
 
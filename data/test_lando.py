@@ -1,11 +1,14 @@
 from django.test import TestCase
-from data.lando import LandoJob, LandoConfig
+from data.lando import LandoJob, OutboxLandoClient
 from data.models import LandoConnection, Workflow, WorkflowVersion, Job, JobFileStageGroup, \
-    DDSJobInputFile, DDSEndpoint, DDSUserCredential, ShareGroup, JobFlavor, VMProject, JobSettings, CloudSettingsOpenStack
+    DDSJobInputFile, DDSEndpoint, DDSUserCredential, ShareGroup, JobFlavor, VMProject, JobSettings, CloudSettingsOpenStack, \
+    OutboxMessage
 from data.tests_models import create_vm_job_settings
 from django.contrib.auth.models import User
 from rest_framework.exceptions import ValidationError
 from unittest.mock import patch, call
+from lando_messaging.messaging import JobCommands
+import pickle
 
 
 class LandoJobTests(TestCase):
@@ -43,9 +46,11 @@ class LandoJobTests(TestCase):
                                        dds_user_credentials=user_credentials,
                                        destination_path='sample2.fasta')
 
-    def test_constructor(self):
+    def test_make_client(self):
         job = LandoJob(self.job.id, self.user)
-        self.assertEqual(job.config.work_queue_config, self.job_settings.lando_connection)
+        client = job._make_client(self.job)
+        self.assertEqual(client.work_queue_client.lando_connection, self.job_settings.lando_connection)
+        self.assertEqual(client.work_queue_client.queue_name, self.job_settings.lando_connection.queue_name)
 
     @patch('data.lando.LandoJob._make_client')
     @patch('data.lando.give_download_permissions')
@@ -109,11 +114,69 @@ class LandoJobTests(TestCase):
         with self.assertRaises(ValidationError) as raised_error:
             job.restart()
 
+    @patch('data.lando.LandoJob._make_client')
+    def test_queue_start(self, mock_make_client):
+        self.job.state = Job.JOB_STATE_AUTHORIZED
+        self.job.save()
+        LandoJob(self.job.id, self.user).queue_start()
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_START_QUEUED)
+        mock_make_client().start_job.assert_not_called()
+
+    def test_queue_start_new_state(self):
+        with self.assertRaises(ValidationError):
+            LandoJob(self.job.id, self.user).queue_start()
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_NEW)
+
+    def test_queue_restart(self):
+        self.job.state = Job.JOB_STATE_CANCEL
+        self.job.save()
+        LandoJob(self.job.id, self.user).queue_restart()
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_RESTART_QUEUED)
+
+    @patch('data.lando.LandoJob._make_client')
+    @patch('data.lando.has_download_permissions')
+    @patch('data.lando.give_download_permissions')
+    def test_run_queued_start(self, mock_give_download_permissions, mock_has_download_permissions,
+                              mock_make_client):
+        self.job.state = Job.JOB_STATE_START_QUEUED
+        self.job.save()
+        mock_has_download_permissions.return_value = False
+        self.assertEqual(LandoJob(self.job.id, self.user).run_queued(), True)
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_STARTING)
+        mock_make_client().start_job.assert_called_with(self.job.id)
+        self.assertEqual(mock_give_download_permissions.call_count, 2)
+
+    @patch('data.lando.LandoJob._make_client')
+    @patch('data.lando.has_download_permissions')
+    def test_run_queued_restart(self, mock_has_download_permissions, mock_make_client):
+        self.job.state = Job.JOB_STATE_RESTART_QUEUED
+        self.job.save()
+        mock_has_download_permissions.return_value = True
+        self.assertEqual(LandoJob(self.job.id, self.user).run_queued(), True)
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_RESTARTING)
+        mock_make_client().restart_job.assert_called_with(self.job.id)
+
+    @patch('data.lando.LandoJob._make_client')
+    def test_run_queued_ignores_jobs_not_queued(self, mock_make_client):
+        self.job.state = Job.JOB_STATE_CANCELING
+        self.job.save()
+        self.assertEqual(LandoJob(self.job.id, self.user).run_queued(), False)
+        mock_make_client().start_job.assert_not_called()
+        mock_make_client().restart_job.assert_not_called()
+
 
-class LandoConfigTestCase(TestCase):
-    @patch('data.lando.LandoConnection', autospec=True)
-    def test_constructor(self, mock_lando_connection):
-        mailer_config = LandoConfig(job_id=23)
+class OutboxLandoClientTestCase(TestCase):
+    def test_start_job_saves_outbox_message(self):
+        lando_connection = LandoConnection.objects.create(host='somehost', username='user1', password='secret',
+                                                          queue_name='lando')
+        client = OutboxLandoClient(lando_connection)
+        client.start_job(job_id=12)
 
-        self.assertEqual(mailer_config.work_queue_config, mock_lando_connection.get_for_job_id.return_value)
-        mock_lando_connection.get_for_job_id.assert_called_with(23)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.lando_connection, lando_connection)
+        self.assertEqual(message.exchange, '')
+        self.assertEqual(message.routing_key, 'lando')
+        self.assertEqual(message.durable_queue, True)
+        request = pickle.loads(bytes(message.body))
+        self.assertEqual(request.command, JobCommands.START_JOB)
+        self.assertEqual(request.payload.job_id, 12)
@@ -1,7 +1,13 @@
 from django.test import TestCase
+from django.core.cache import cache
+from django.test.utils import override_settings
 from data.util import has_download_permissions, DataServiceError, WrappedDataServiceException, \
-    get_workflow_version_info, base64_encode
+    get_workflow_version_info, base64_encode, get_readme_file_url, get_file_url_cache_timeout, dds_circuit_breaker
+from django.utils import timezone
+from data.models import VersionInfoDocument
 from unittest.mock import patch, Mock, call
+import datetime
+import requests
 
 class HasDownloadPermissionsTestCase(TestCase):
     @patch('data.util.get_dds_config_for_credentials')
@@ -84,36 +90,141 @@ class Base64EncodeTestCase(TestCase):
         self.assertTrue(output.decode.called)
 
 
+@override_settings(VERSION_INFO_CACHE_SECONDS=60, VERSION_INFO_REQUEST_TIMEOUT_SECONDS=5)
 @patch('data.util.requests')
 class GetWorkflowVersionInfoTestCase(TestCase):
+    def setUp(self):
+        self.version_info_url = 'https://example.org/info'
+        self.workflow_version = Mock(version_info_url=self.version_info_url)
 
-    @patch('data.util.base64_encode')
-    def test_get_url(self, mock_base64_encode, mock_requests):
-        mock_b64_content = Mock()
-        mock_base64_encode.return_value = mock_b64_content
-        mock_get = mock_requests.get
-        mock_response = mock_get.return_value
-        mock_decode = mock_response.content.decode
-        mock_decoded = mock_decode.return_value
-        mock_encoding = Mock()
-        mock_response.encoding = mock_encoding
-        mock_response.headers = {'Content-Type': 'text/plain'}
-        version_info_url = 'https://example.org/info'
-        mock_workflow_version = Mock(version_info_url=version_info_url)
-        version_info = get_workflow_version_info(mock_workflow_version)
-        self.assertEqual(mock_get.call_args, call(version_info_url), 'calls requests.get with the version_info_url')
-        self.assertEqual(mock_decode.call_args, call(mock_encoding), 'calls decode with response.encoding')
-        self.assertEqual(mock_base64_encode.call_args, call(mock_decoded, mock_encoding), 'calls base64_encode with '
-                                                                                          'decoded data and encoding')
+    @staticmethod
+    def setup_response(mock_requests, content=b'# Info', status_code=200, headers=None):
+        mock_response = mock_requests.get.return_value
+        mock_response.status_code = status_code
+        mock_response.content = content
+        mock_response.encoding = 'utf-8'
+        mock_response.headers = headers or {'Content-Type': 'text/plain', 'ETag': '"abc"'}
+        return mock_response
+
+    def make_stale_document(self):
+        return VersionInfoDocument.objects.create(
+            url=self.version_info_url, content=base64_encode('# Old'), content_type='text/plain', etag='"abc"',
+            last_modified='Wed, 21 Oct 2015 07:28:00 GMT', fetched=timezone.now() - datetime.timedelta(minutes=5))
+
+    def test_get_url(self, mock_requests):
+        self.setup_response(mock_requests)
+        version_info = get_workflow_version_info(self.workflow_version)
+        mock_requests.get.assert_called_with(self.version_info_url, headers={}, timeout=5)
         self.assertEqual(version_info, {
-            'workflow_version': mock_workflow_version,
-            'content': mock_b64_content,
+            'workflow_version': self.workflow_version,
+            'content': base64_encode('# Info'),
             'content_type': 'text/plain',
-            'url': version_info_url
+            'url': self.version_info_url
         })
+        document = VersionInfoDocument.objects.get(url=self.version_info_url)
+        self.assertEqual(document.etag, '"abc"')
+
+    def test_serves_fresh_document_from_cache(self, mock_requests):
+        self.setup_response(mock_requests)
+        get_workflow_version_info(self.workflow_version)
+        version_info = get_workflow_version_info(self.workflow_version)
+        self.assertEqual(mock_requests.get.call_count, 1)
+        self.assertEqual(version_info['content'], base64_encode('# Info'))
+
+    def test_revalidates_stale_document(self, mock_requests):
+        self.make_stale_document()
+        self.setup_response(mock_requests, content=b'', status_code=304)
+        version_info = get_workflow_version_info(self.workflow_version)
+        mock_requests.get.assert_called_with(self.version_info_url, headers={
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT',
+        }, timeout=5)
+        self.assertEqual(version_info['content'], base64_encode('# Old'))
+        self.assertFalse(VersionInfoDocument.objects.get(url=self.version_info_url).needs_revalidation())
+
+    def test_replaces_changed_document(self, mock_requests):
+        self.make_stale_document()
+        self.setup_response(mock_requests, content=b'# New')
+        version_info = get_workflow_version_info(self.workflow_version)
+        self.assertEqual(version_info['content'], base64_encode('# New'))
+        self.assertEqual(VersionInfoDocument.objects.count(), 1)
+
+    def test_serves_stale_document_when_upstream_fails(self, mock_requests):
+        self.make_stale_document()
+        mock_requests.get.side_effect = requests.exceptions.ConnectTimeout()
+        version_info = get_workflow_version_info(self.workflow_version)
+        self.assertEqual(version_info['content'], base64_encode('# Old'))
+
+    @override_settings(VERSION_INFO_RETRY_SECONDS=60)
+    def test_waits_before_retrying_failed_revalidation(self, mock_requests):
+        self.make_stale_document()
+        mock_requests.get.side_effect = requests.exceptions.ConnectTimeout()
+        get_workflow_version_info(self.workflow_version)
+        version_info = get_workflow_version_info(self.workflow_version)
+        self.assertEqual(version_info['content'], base64_encode('# Old'))
+        self.assertEqual(mock_requests.get.call_count, 1)
+
+        VersionInfoDocument.objects.update(retry_after=timezone.now() - datetime.timedelta(seconds=1))
+        get_workflow_version_info(self.workflow_version)
+        self.assertEqual(mock_requests.get.call_count, 2)
 
     def test_raises_on_response_status(self, mock_requests):
-        mock_response = mock_requests.get.return_value
-        mock_response .raise_for_status.side_effect = Exception('raise_for_status')
-        with self.assertRaises(Exception):
-            get_workflow_version_info(Mock())
+        mock_response = self.setup_response(mock_requests, status_code=500)
+        mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError('raise_for_status')
+        with self.assertRaises(requests.exceptions.HTTPError):
+            get_workflow_version_info(self.workflow_version)
+
+
+@override_settings(DDS_FILE_URL_CACHE_EXPIRATION_MARGIN_SECONDS=60, DDS_FILE_URL_CACHE_DEFAULT_SECONDS=30)
+class GetReadmeFileUrlTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        dds_circuit_breaker.reset()
+
+    @patch('data.util.get_dds_config_for_credentials')
+    @patch('data.util.RemoteStore')
+    def test_get_readme_file_url_is_cached(self, mock_remote_store, mock_get_dds_config):
+        mock_get_file_url = mock_remote_store.return_value.data_service.get_file_url
+        mock_get_file_url.return_value.json.return_value = {
+            'http_verb': 'GET',
+            'host': 'somehost',
+            'url': '/file/123',
+            'http_headers': '',
+        }
+        job_output_project = Mock(readme_file_id='123')
+        dds_file_url = get_readme_file_url(job_output_project)
+        self.assertEqual(dds_file_url.id, '123')
+        self.assertEqual(dds_file_url.url, '/file/123')
+        other_job_output_project = Mock(readme_file_id='123')
+        dds_file_url = get_readme_file_url(other_job_output_project)
+        self.assertEqual(dds_file_url.url, '/file/123')
+        self.assertEqual(mock_get_file_url.call_count, 1, 'second lookup should be served from the cache')
+
+    @patch('data.util.get_dds_config_for_credentials')
+    @patch('data.util.RemoteStore')
+    def test_get_readme_file_url_expired_not_cached(self, mock_remote_store, mock_get_dds_config):
+        mock_get_file_url = mock_remote_store.return_value.data_service.get_file_url
+        mock_get_file_url.return_value.json.return_value = {
+            'http_verb': 'GET',
+            'host': 'somehost',
+            'url': '/file/456?temp_url_sig=abc&temp_url_expires=100',
+            'http_headers': '',
+        }
+        get_readme_file_url(Mock(readme_file_id='456'))
+        get_readme_file_url(Mock(readme_file_id='456'))
+        self.assertEqual(mock_get_file_url.call_count, 2)
+
+    @patch('data.util.get_dds_config_for_credentials')
+    @patch('data.util.RemoteStore')
+    def test_get_readme_file_url_error(self, mock_remote_store, mock_get_dds_config):
+        data_service_error = DataServiceError(response=Mock(status_code=500), url_suffix=Mock(), request_data=Mock())
+        mock_remote_store.return_value.data_service.get_file_url.side_effect = data_service_error
+        with self.assertRaises(WrappedDataServiceException):
+            get_readme_file_url(Mock(readme_file_id='789'))
+
+    def test_get_file_url_cache_timeout(self):
+        url_dict = {'url': '/file/123?temp_url_sig=abc&temp_url_expires=1000'}
+        self.assertEqual(get_file_url_cache_timeout(url_dict, current_time=500), 440)
+        self.assertEqual(get_file_url_cache_timeout(url_dict, current_time=950), -10)
+        self.assertEqual(get_file_url_cache_timeout({'url': '/file/123'}, current_time=500), 30)
+        self.assertEqual(get_file_url_cache_timeout({'url': '/file/123?temp_url_expires=bad'}, current_time=500), 0)
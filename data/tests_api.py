@@ -1,6 +1,9 @@
 from django.contrib.auth.models import User as django_user
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.test import override_settings
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import MagicMock, patch, Mock
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -12,7 +15,7 @@ from data.models import Workflow, WorkflowVersion, Job, JobFileStageGroup, JobEr
     DDSUserCredential, DDSEndpoint, DDSJobInputFile, URLJobInputFile, JobDDSOutputProject, \
     JobQuestionnaire, JobAnswerSet, JobFlavor, VMProject, JobToken, ShareGroup, DDSUser, \
     WorkflowMethodsDocument, WorkflowVersionToolDetails, EmailMessage, EmailTemplate, JobSettings, \
-    JobQuestionnaireType
+    JobQuestionnaireType, JobStateNotification
 from data.tests_models import create_vm_job_settings
 from rest_framework.authtoken.models import Token
 from data.exceptions import WrappedDataServiceException
@@ -200,6 +203,27 @@ class DDSResourcesTestCase(APITestCase):
         self.assertEqual(response.data[0]['size'], 0)
 
 
+class AdminDDSCircuitBreakerTestCase(APITestCase):
+    def setUp(self):
+        self.user_login = UserLogin(self.client)
+
+    def test_normal_user_denied(self):
+        self.user_login.become_normal_user()
+        url = reverse('admin_ddscircuitbreaker-list')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_admin_sees_breaker_state(self):
+        self.user_login.become_admin_user()
+        url = reverse('admin_ddscircuitbreaker-list')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['id'], 'DukeDS')
+        self.assertIn(response.data[0]['state'], ['closed', 'open', 'half-open'])
+        self.assertIn('total_rejected', response.data[0])
+
+
 class DDSEndpointTestCase(APITestCase):
     def setUp(self):
         self.user_login = UserLogin(self.client)
@@ -302,6 +326,22 @@ class WorkflowTestCase(APITestCase):
         self.assertEqual(response.data[0]['versions'],
                          [wfv_1.id, wfv_1_0_0.id, wfv_1_3_1.id, wfv_2_2_2_dev.id, wfv_2_4_5.id])
 
+    def test_list_query_count_independent_of_versions(self):
+        self.user_login.become_normal_user()
+        url = reverse('workflow-list')
+        wf = Workflow.objects.create(name='workflow1', tag='one')
+        WorkflowVersion.objects.create(workflow=wf, version="1", url='', fields=[])
+        with CaptureQueriesContext(connection) as one_workflow_queries:
+            self.client.get(url, format='json')
+        for i in range(3):
+            wf = Workflow.objects.create(name='workflow{}'.format(i), tag='tag{}'.format(i))
+            WorkflowVersion.objects.create(workflow=wf, version="1", url='', fields=[])
+            WorkflowVersion.objects.create(workflow=wf, version="2", url='', fields=[])
+        with CaptureQueriesContext(connection) as many_workflow_queries:
+            response = self.client.get(url, format='json')
+        self.assertEqual(len(response.data), 4)
+        self.assertLessEqual(len(many_workflow_queries), len(one_workflow_queries))
+
 
 class WorkflowStateTestCase(APITestCase):
 
@@ -451,6 +491,42 @@ class WorkflowVersionTestCase(APITestCase):
             (wf2.id, '5'),
         ])
 
+    def test_list_query_count_independent_of_versions(self):
+        self.user_login.become_normal_user()
+        url = reverse('workflowversion-list')
+        wf = Workflow.objects.create(name='workflow1', tag='one')
+        wfv = WorkflowVersion.objects.create(workflow=wf, version="1", url='', fields=[])
+        WorkflowMethodsDocument.objects.create(workflow_version=wfv, content='#Markdown')
+        with CaptureQueriesContext(connection) as one_version_queries:
+            self.client.get(url, format='json')
+        for i in range(3):
+            wf = Workflow.objects.create(name='workflow{}'.format(i), tag='tag{}'.format(i))
+            wfv = WorkflowVersion.objects.create(workflow=wf, version="1", url='', fields=[])
+            WorkflowMethodsDocument.objects.create(workflow_version=wfv, content='#Markdown')
+            WorkflowVersionToolDetails.objects.create(workflow_version=wfv, details=[])
+        with CaptureQueriesContext(connection) as many_version_queries:
+            response = self.client.get(url, format='json')
+        self.assertEqual(len(response.data), 4)
+        self.assertIsNotNone(response.data[-1]['methods_document'])
+        self.assertIsNotNone(response.data[-1]['tool_details'])
+        self.assertLessEqual(len(many_version_queries), len(one_version_queries))
+
+    def test_sorted_list_paginated(self):
+        wf1 = Workflow.objects.create(name='workflow1', tag='one')
+        WorkflowVersion.objects.create(workflow=wf1, version="10", url='', fields=[])
+        WorkflowVersion.objects.create(workflow=wf1, version="2", url='', fields=[])
+        WorkflowVersion.objects.create(workflow=wf1, version="1.3.1", url='', fields=[])
+
+        self.user_login.become_normal_user()
+        url = reverse('workflowversion-list')
+        response = self.client.get(url, {'page_size': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['version'] for item in response.data], ['1.3.1', '2'])
+        self.assertEqual(response['X-Total-Count'], '3')
+
+        response = self.client.get(url, {'page_size': 2, 'page': 2}, format='json')
+        self.assertEqual([item['version'] for item in response.data], ['10'])
+
     @patch('data.api.get_workflow_version_info')
     def test_version_info_detail(self, mock_get_workflow_version_info):
         workflow = Workflow.objects.create(name='Workflow', tag='wf')
@@ -613,6 +689,43 @@ class JobsTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(0, len(response.data))
 
+    def test_filter_by_job_order(self):
+        url = reverse('job-list')
+        normal_user = self.user_login.become_normal_user()
+        job1 = Job.objects.create(name='my job',
+                                  workflow_version=self.workflow_version,
+                                  job_order=json.dumps({'threads': 16, 'genome': {'class': 'File', 'path': 'hg38.fa'}}),
+                                  user=normal_user,
+                                  share_group=self.share_group,
+                                  job_settings=self.job_settings,
+                                  job_flavor=self.job_flavor,
+                                  )
+        Job.objects.create(name='my job2',
+                           workflow_version=self.workflow_version,
+                           job_order=json.dumps({'threads': 8, 'genome': {'class': 'File', 'path': 'hg19.fa'}}),
+                           user=normal_user,
+                           share_group=self.share_group,
+                           job_settings=self.job_settings,
+                           job_flavor=self.job_flavor,
+                           )
+        self.assertEqual(job1.job_order_data['threads'], 16)
+
+        response = self.client.get(url, {'job_order': '{"threads": 16}'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([job1.id], [job['id'] for job in response.data])
+
+        response = self.client.get(url, {'job_order': '{"genome": {"path": "hg38.fa"}}',
+                                         'workflow_version': self.workflow_version.id}, format='json')
+        self.assertEqual([job1.id], [job['id'] for job in response.data])
+
+        response = self.client.get(url, {'job_order': '16'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.user_login.become_admin_user()
+        response = self.client.get(reverse('admin_job-list'), {'job_order': '{"threads": 8}'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(['my job2'], [job['name'] for job in response.data])
+
     def testAdminSeeAllData(self):
         normal_user = self.user_login.become_normal_user()
         job = Job.objects.create(name='my job',
@@ -768,8 +881,7 @@ class JobsTestCase(APITestCase):
                                    })
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
-    @patch('data.api.JobMailer')
-    def testAdminUserUpdatesStateAndStep(self, MockJobMailer):
+    def testAdminUserUpdatesStateAndStep(self):
         """
         Admin should be able to change job state and job step.
         """
@@ -793,12 +905,9 @@ class JobsTestCase(APITestCase):
         self.assertEqual(Job.JOB_STATE_RUNNING, job.state)
         self.assertEqual(Job.JOB_STEP_CREATE_VM, job.step)
 
-    @patch('data.api.JobMailer')
-    def test_mails_when_job_state_changes(self, MockJobMailer):
-        mock_mail_current_state = Mock()
-        MockJobMailer.return_value.mail_current_state = mock_mail_current_state
+    def test_queues_notification_when_job_state_changes(self):
         """
-        Admin should be able to change job state and job step.
+        Changing the job state should queue a notification to be mailed by the sendjobnotifications command.
         """
         admin_user = self.user_login.become_admin_user()
         job = Job.objects.create(name='somejob',
@@ -817,14 +926,13 @@ class JobsTestCase(APITestCase):
                                         'step': Job.JOB_STEP_CREATE_VM,
                                     })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertTrue(mock_mail_current_state.called)
+        notification = JobStateNotification.objects.get()
+        self.assertEqual(notification.job, job)
+        self.assertEqual(notification.state, Job.JOB_STATE_RUNNING)
 
-    @patch('data.api.JobMailer')
-    def test_does_not_mail_when_job_state_stays(self, MockJobMailer):
-        mock_mail_current_state = Mock()
-        MockJobMailer.return_value.mail_current_state = mock_mail_current_state
+    def test_does_not_queue_notification_when_job_state_stays(self):
         """
-        Admin should be able to change job state and job step.
+        Changing only the job step should not queue a notification.
         """
         admin_user = self.user_login.become_admin_user()
         job = Job.objects.create(name='somejob',
@@ -844,7 +952,7 @@ class JobsTestCase(APITestCase):
                                         'step': Job.JOB_STEP_RUNNING,
                                     })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertFalse(mock_mail_current_state.called)
+        self.assertFalse(JobStateNotification.objects.exists())
 
     @patch('data.lando.LandoJob._make_client')
     def test_job_start(self, mock_make_client):
@@ -863,10 +971,11 @@ class JobsTestCase(APITestCase):
         job.save()
         url = reverse('job-list') + str(job.id) + '/start/'
 
-        # Post to /start/ for job in NEW state should work
+        # Post to /start/ for job in AUTHORIZED state should queue the job
         response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['state'], Job.JOB_STATE_STARTING)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['state'], Job.JOB_STATE_START_QUEUED)
+        mock_make_client().start_job.assert_not_called()
 
         # Post to /start/ for job in RUNNING state should fail
         job.state = Job.JOB_STATE_RUNNING
@@ -874,6 +983,30 @@ class JobsTestCase(APITestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_job_start_with_idempotency_key(self):
+        normal_user = self.user_login.become_normal_user()
+        stage_group = JobFileStageGroup.objects.create(user=normal_user)
+        job = Job.objects.create(workflow_version=self.workflow_version,
+                                 job_order={},
+                                 user=normal_user,
+                                 stage_group=stage_group,
+                                 share_group=self.share_group,
+                                 job_settings=self.job_settings,
+                                 job_flavor=self.job_flavor,
+                                 state=Job.JOB_STATE_AUTHORIZED,
+                                 )
+        url = reverse('job-list') + str(job.id) + '/start/'
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY='start-1')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        # the retry gets the original response even though the job is no longer AUTHORIZED
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY='start-1')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['state'], Job.JOB_STATE_START_QUEUED)
+
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY='start-2')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     @patch('data.lando.LandoJob._make_client')
     def test_job_cancel(self, mock_make_client):
         normal_user = self.user_login.become_normal_user()
@@ -911,19 +1044,19 @@ class JobsTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         mock_make_client().restart_job.assert_not_called()
 
-        # Post to /restart/ for job in ERROR state should work
+        # Post to /restart/ for job in ERROR state should queue the job
         job.state = Job.JOB_STATE_ERROR
         job.save()
         response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data['state'], Job.JOB_STATE_RESTARTING)
-        mock_make_client().restart_job.assert_called_with(str(job.id))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['state'], Job.JOB_STATE_RESTART_QUEUED)
+        mock_make_client().restart_job.assert_not_called()
 
         # Post to /restart/ for job in CANCEL state should work
         job.state = Job.JOB_STATE_CANCEL
         job.save()
         response = self.client.post(url)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
 
     def test_normal_user_trying_create_job_directly(self):
         url = reverse('job-list')
@@ -1393,6 +1526,7 @@ class URLJobInputFileTestCase(APITestCase):
 class JobDDSOutputProjectTestCase(APITestCase):
 
     def setUp(self):
+        cache.clear()
         self.user_login = UserLogin(self.client)
         workflow = Workflow.objects.create(name='RnaSeq')
         cwl_url = "https://raw.githubusercontent.com/johnbradley/iMADS-worker/master/predict_service/predict-workflow-packed.cwl"
@@ -1999,6 +2133,25 @@ class WorkflowMethodsDocumentTestCase(APITestCase):
         self.assertEqual(1, len(response.data))
         self.assertEqual('#One', response.data[0]['content'])
 
+    @override_settings(METHODS_DOCUMENT_CACHE_SECONDS=600)
+    def test_detail_includes_html_and_cache_headers(self):
+        url = reverse('workflowmethodsdocument-detail', args=[self.methods_document.id])
+        self.user_login.become_normal_user()
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual('<h1>One</h1>', response.data['content_html'])
+        self.assertIn('max-age=600', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_html(self):
+        url = reverse('workflowmethodsdocument-html', args=[self.methods_document.id])
+        self.user_login.become_normal_user()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b'<h1>One</h1>', response.content)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertIn('max-age', response['Cache-Control'])
+
 
 class WorkflowVersionToolDetailsViewSetTestCase(APITestCase):
 
@@ -2026,6 +2179,31 @@ class WorkflowVersionToolDetailsViewSetTestCase(APITestCase):
         self.assertEqual(1, len(response.data))
         self.assertEqual(self.tool_details.id, response.data[0]['id'])
 
+    def test_filter_by_tool(self):
+        workflow2 = Workflow.objects.create(name='Exome', tag='exome')
+        workflow_version2 = WorkflowVersion.objects.create(workflow=workflow2, version="1", url='', fields=[])
+        samtools_1_8 = WorkflowVersionToolDetails.objects.create(
+            workflow_version=workflow_version2,
+            details=[{'packages': [{'package': 'samtools', 'version': ['1.8.2']}]}]
+        )
+        self.tool_details.details = [{'packages': [{'package': 'samtools', 'version': ['1.10']}]}]
+        self.tool_details.save()
+        self.user_login.become_normal_user()
+        url = reverse('workflowversiontooldetails-list')
+
+        response = self.client.get(url, {'tool_name': 'samtools', 'tool_version_max': '1.9'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([samtools_1_8.id], [item['id'] for item in response.data])
+
+        response = self.client.get(url, {'tool_name': 'samtools', 'tool_version_min': '1.9'}, format='json')
+        self.assertEqual([self.tool_details.id], [item['id'] for item in response.data])
+
+        response = self.client.get(url, {'tool_name': 'samtools', 'tool_version': '1.8.2'}, format='json')
+        self.assertEqual([samtools_1_8.id], [item['id'] for item in response.data])
+
+        response = self.client.get(url, {'tool_name': 'gatk'}, format='json')
+        self.assertEqual([], response.data)
+
 
 class EmailMessageTestCase(APITestCase):
 
@@ -0,0 +1,101 @@
+from django.test import TestCase
+from data.circuitbreaker import CircuitBreaker
+from data.exceptions import DataServiceUnavailable, WrappedDataServiceException
+from unittest.mock import Mock
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTestCase(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker('DukeDS', failure_rate_threshold=0.5, minimum_calls=4, window_size=4,
+                                      reset_seconds=30, clock=self.clock)
+
+    def fail_calls(self, count, exception=IOError('timeout')):
+        func = Mock(side_effect=exception)
+        for _ in range(count):
+            with self.assertRaises(type(exception)):
+                self.breaker.call(func)
+
+    def test_successful_calls_stay_closed(self):
+        func = Mock(return_value='result')
+        for _ in range(5):
+            self.assertEqual(self.breaker.call(func, 'arg'), 'result')
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_CLOSED)
+        self.assertEqual(self.breaker.total_calls, 5)
+        self.assertEqual(self.breaker.total_successes, 5)
+
+    def test_opens_after_failure_rate_reached(self):
+        self.fail_calls(3)
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_CLOSED, 'minimum calls not reached yet')
+        self.fail_calls(1)
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_OPEN)
+        self.assertEqual(self.breaker.times_opened, 1)
+
+        func = Mock()
+        with self.assertRaises(DataServiceUnavailable):
+            self.breaker.call(func)
+        self.assertFalse(func.called, 'open breaker should not call the function')
+        self.assertEqual(self.breaker.total_rejected, 1)
+        self.assertEqual(self.breaker.total_calls, 4, 'rejected calls are not counted as calls')
+
+    def test_client_errors_do_not_count_as_failures(self):
+        not_found_error = WrappedDataServiceException(Mock(status_code=404))
+        self.fail_calls(4, exception=not_found_error)
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_CLOSED)
+        self.assertEqual(self.breaker.total_failures, 0)
+
+    def test_server_errors_count_as_failures(self):
+        server_error = WrappedDataServiceException(Mock(status_code=500))
+        self.fail_calls(4, exception=server_error)
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_OPEN)
+
+    def test_half_open_probe_success_closes(self):
+        self.fail_calls(4)
+        self.clock.now += 30
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_HALF_OPEN)
+        self.assertEqual(self.breaker.call(Mock(return_value='ok')), 'ok')
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_CLOSED)
+
+    def test_half_open_probe_failure_reopens(self):
+        self.fail_calls(4)
+        self.clock.now += 30
+        self.fail_calls(1)
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_OPEN)
+        self.assertEqual(self.breaker.times_opened, 2)
+
+    def test_half_open_allows_single_probe(self):
+        self.fail_calls(4)
+        self.clock.now += 30
+
+        def probe():
+            # a second caller arrives while the probe is still running
+            with self.assertRaises(DataServiceUnavailable):
+                self.breaker.call(Mock())
+            return 'ok'
+
+        self.assertEqual(self.breaker.call(probe), 'ok')
+        self.assertEqual(self.breaker.total_rejected, 1)
+
+    def test_half_open_probe_interrupted_allows_new_probe(self):
+        self.fail_calls(4)
+        self.clock.now += 30
+        with self.assertRaises(KeyboardInterrupt):
+            self.breaker.call(Mock(side_effect=KeyboardInterrupt()))
+        self.assertFalse(self.breaker.probe_in_progress)
+        self.assertEqual(self.breaker.call(Mock(return_value='ok')), 'ok')
+        self.assertEqual(self.breaker.current_state, CircuitBreaker.STATE_CLOSED)
+
+    def test_protect_decorator(self):
+        @self.breaker.protect
+        def add(a, b):
+            return a + b
+        self.assertEqual(add(1, 2), 3)
+        self.assertEqual(self.breaker.total_calls, 1)
@@ -0,0 +1,74 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from data.fakedukeds import FakeDukeDSServer, FakeDukeDSData, FAKE_USER_ID
+from data.models import DDSEndpoint, DDSUserCredential
+from data.util import get_user_projects, get_user_project_content, get_user_folder_content, \
+    has_download_permissions, give_download_permissions, dds_circuit_breaker
+from data.exceptions import WrappedDataServiceException
+from data.management.commands.benchmarkdukeds import percentile
+
+
+class FakeDukeDSDataTestCase(TestCase):
+    def setUp(self):
+        self.data = FakeDukeDSData(project_count=2, folders_per_project=3, files_per_folder=4)
+
+    def test_projects(self):
+        self.assertEqual([project['id'] for project in self.data.projects()], ['project-0', 'project-1'])
+        self.assertIsNone(self.data.project('project-2'))
+
+    def test_children(self):
+        self.assertEqual(len(self.data.project_children('project-1')), 3)
+        self.assertEqual(len(self.data.folder_children('folder-1-2')), 4)
+        self.assertIsNone(self.data.folder_children('folder-1-3'))
+
+    def test_file(self):
+        file_dict = self.data.file('file-1-2-3')
+        self.assertEqual(file_dict['project']['id'], 'project-1')
+        self.assertEqual(file_dict['parent']['id'], 'folder-1-2')
+        self.assertEqual(file_dict['current_version']['upload']['size'], 4096)
+        self.assertIsNone(self.data.file('file-1-2-4'))
+
+
+class FakeDukeDSServerTestCase(TestCase):
+    """
+    Runs data.util functions against the stand-in server to ensure it speaks the protocol ddsc expects.
+    """
+    def setUp(self):
+        dds_circuit_breaker.reset()
+        self.server = FakeDukeDSServer(FakeDukeDSData(project_count=120, folders_per_project=2, files_per_folder=3))
+        self.server.start_in_thread()
+        self.user = User.objects.create_user('user')
+        endpoint = DDSEndpoint.objects.create(name='fake', agent_key='agent', api_root=self.server.api_root)
+        self.user_credential = DDSUserCredential.objects.create(user=self.user, token='secret', endpoint=endpoint,
+                                                                dds_id=FAKE_USER_ID)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get_user_projects_pages(self):
+        projects = get_user_projects(self.user)
+        self.assertEqual(len(projects), 120)
+
+    def test_get_content(self):
+        self.assertEqual(len(get_user_project_content(self.user, 'project-5')), 2)
+        resources = get_user_folder_content(self.user, 'folder-5-1', search_str='file2')
+        self.assertEqual([resource.id for resource in resources], ['file-5-1-2'])
+        self.assertEqual(resources[0].folder, 'folder-5-1')
+
+    def test_not_found(self):
+        with self.assertRaises(WrappedDataServiceException) as raised_exception:
+            get_user_project_content(self.user, 'project-500')
+        self.assertEqual(raised_exception.exception.status_code, 404)
+
+    def test_permissions(self):
+        self.assertFalse(has_download_permissions(self.user_credential, 'project-1'))
+        give_download_permissions(self.user, 'project-1', FAKE_USER_ID)
+        self.assertTrue(has_download_permissions(self.user_credential, 'project-1'))
+
+
+class PercentileTestCase(TestCase):
+    def test_percentile(self):
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([3.0], 99), 3.0)
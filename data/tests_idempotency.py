@@ -0,0 +1,99 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework.views import APIView
+from data.idempotency import idempotent, IDEMPOTENT_REPLAYED_HEADER
+from data.models import IdempotencyKey
+from django.utils import timezone
+from datetime import timedelta
+import hashlib
+import json
+
+
+class CountingView(APIView):
+    call_count = 0
+    response_status = status.HTTP_201_CREATED
+
+    @idempotent
+    def post(self, request):
+        CountingView.call_count += 1
+        return Response({'count': CountingView.call_count}, status=CountingView.response_status)
+
+
+class IdempotentTestCase(TestCase):
+    def setUp(self):
+        CountingView.call_count = 0
+        CountingView.response_status = status.HTTP_201_CREATED
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_user('user1')
+        self.view = CountingView.as_view()
+
+    def post(self, data, key=None, path='/jobs/', user=None):
+        headers = {}
+        if key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        request = self.factory.post(path, data, format='json', **headers)
+        force_authenticate(request, user=user or self.user)
+        return self.view(request)
+
+    def test_without_key_runs_every_time(self):
+        self.assertEqual(self.post({'a': 1}).data, {'count': 1})
+        self.assertEqual(self.post({'a': 1}).data, {'count': 2})
+        self.assertEqual(IdempotencyKey.objects.count(), 0)
+
+    def test_retry_replays_response(self):
+        response = self.post({'a': 1}, key='abc')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'count': 1})
+        response = self.post({'a': 1}, key='abc')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'count': 1})
+        self.assertEqual(response[IDEMPOTENT_REPLAYED_HEADER], 'true')
+        self.assertEqual(CountingView.call_count, 1)
+
+    def test_keys_are_per_user(self):
+        self.post({'a': 1}, key='abc')
+        response = self.post({'a': 1}, key='abc', user=User.objects.create_user('user2'))
+        self.assertEqual(response.data, {'count': 2})
+
+    def test_key_reused_for_different_request(self):
+        self.post({'a': 1}, key='abc')
+        response = self.post({'a': 2}, key='abc')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        response = self.post({'a': 1}, key='abc', path='/other/')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_key_in_progress(self):
+        IdempotencyKey.objects.create(user=self.user, key='abc', method='POST', path='/jobs/',
+                                      request_hash=self._hash({'a': 1}), expires=self._future())
+        response = self.post({'a': 1}, key='abc')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(CountingView.call_count, 0)
+
+    def test_expired_key_runs_again(self):
+        self.post({'a': 1}, key='abc')
+        IdempotencyKey.objects.update(expires=self._future() - timedelta(days=7))
+        response = self.post({'a': 1}, key='abc')
+        self.assertEqual(response.data, {'count': 2})
+
+    def test_failed_response_is_not_stored(self):
+        CountingView.response_status = status.HTTP_400_BAD_REQUEST
+        self.post({'a': 1}, key='abc')
+        self.assertEqual(IdempotencyKey.objects.count(), 0)
+        CountingView.response_status = status.HTTP_201_CREATED
+        response = self.post({'a': 1}, key='abc')
+        self.assertEqual(response.data, {'count': 2})
+
+    def test_key_too_long(self):
+        response = self.post({'a': 1}, key='a' * 256)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @staticmethod
+    def _hash(data):
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _future():
+        return timezone.now() + timedelta(days=1)
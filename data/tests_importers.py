@@ -1,9 +1,15 @@
 from django.test import TestCase
+from django.test.utils import override_settings
 from data.importers import CWLDocument, MethodsDocumentContents, SCHEMA_ORG_CITATION, \
-    HTTPS_DOI_URL, WorkflowQuestionnaireImporter, ImporterException
-from data.models import ShareGroup
+    HTTPS_DOI_URL, WorkflowQuestionnaireImporter, ImporterException, get_doi_citations, \
+    parse_cwl_document_in_subprocess
+from data.cwlparser import DownloadedDocumentFetcher, find_hints
+from data.models import ShareGroup, DOICitation
 from data.tests_api import add_job_settings
-from unittest.mock import patch, Mock
+from unittest.mock import patch, Mock, ANY
+import tempfile
+import os
+import sys
 
 
 class CWLNodeWithSteps(object):
@@ -21,9 +27,90 @@ class CWLNodeWithHints(object):
         self.hints = hints
 
 
+@override_settings(CWL_DOCUMENT_CACHE_DIR=None)
 class CWLDocumentTestCase(TestCase):
     def test_extract_tool_hints(self):
         cwl_document = CWLDocument('someurl')
+        cwl_document._parsed = {'hints': [
+            {'class': 'specialHint', 'value': 1},
+            {'class': 'otherHint'},
+            {'class': 'specialHint', 'value': 2},
+        ]}
+        hints = cwl_document.extract_tool_hints('specialHint')
+        self.assertEqual([1, 2], [hint['value'] for hint in hints])
+
+    @patch('data.importers.parse_cwl_document_in_subprocess')
+    @patch('data.importers.requests')
+    def test_parsed_cached_by_content(self, mock_requests, mock_parse_cwl_document):
+        mock_parse_cwl_document.return_value = {
+            'input_fields': [{'name': 'threads', 'type': 'int'}],
+            'tool': {'label': 'Exome Seq', 'doc': 'Aligns reads'},
+            'hints': [],
+        }
+        mock_requests.get.return_value = Mock(content=b'cwlVersion: v1.0')
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cwl_document = CWLDocument('someurl', cache_dir=cache_dir)
+            self.assertEqual(cwl_document.get('label'), 'Exome Seq')
+            self.assertEqual(cwl_document.input_fields, [{'name': 'threads', 'type': 'int'}])
+
+            cwl_document = CWLDocument('otherurl', cache_dir=cache_dir)
+            self.assertEqual(cwl_document.get('doc'), 'Aligns reads')
+            mock_parse_cwl_document.assert_called_once_with('someurl', ANY)
+            mock_requests.get.assert_called_with('otherurl')
+            self.assertEqual(mock_requests.get.call_count, 2)
+
+            mock_requests.get.return_value = Mock(content=b'cwlVersion: v1.1')
+            CWLDocument('someurl', cache_dir=cache_dir).get('label')
+            self.assertEqual(mock_parse_cwl_document.call_count, 2)
+
+    @patch('data.importers.parse_cwl_document_in_subprocess')
+    @patch('data.importers.requests')
+    def test_parses_downloaded_content(self, mock_requests, mock_parse_cwl_document):
+        def read_document(url, path):
+            with open(path, 'rb') as infile:
+                self.assertEqual(infile.read(), b'cwlVersion: v1.0')
+            return {'input_fields': [], 'tool': {'label': 'Exome Seq'}, 'hints': []}
+        mock_parse_cwl_document.side_effect = read_document
+        mock_requests.get.return_value = Mock(content=b'cwlVersion: v1.0')
+        with tempfile.TemporaryDirectory() as settings_cache_dir:
+            with override_settings(CWL_DOCUMENT_CACHE_DIR=settings_cache_dir):
+                self.assertEqual(CWLDocument('someurl', cache_dir=None).get('label'), 'Exome Seq')
+                # cache_dir=None disables the cache instead of falling back to the setting
+                self.assertEqual(os.listdir(settings_cache_dir), [])
+        mock_requests.get.assert_called_once_with('someurl')
+        self.assertEqual(mock_parse_cwl_document.call_count, 1)
+
+    def test_cache_dir_defaults_to_setting(self):
+        with override_settings(CWL_DOCUMENT_CACHE_DIR='/tmp/cwl-cache'):
+            self.assertEqual(CWLDocument('someurl').cache_dir, '/tmp/cwl-cache')
+
+    @patch('data.importers.CWL_PARSER_VERSION', '1.0 4.5')
+    def test_cache_path_includes_parser_version(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = CWLDocument('someurl', cache_dir=cache_dir)._get_cache_path(b'cwlVersion: v1.0')
+            with patch('data.importers.CWL_PARSER_VERSION', '2.0 4.5'):
+                other_cache_path = CWLDocument('someurl', cache_dir=cache_dir)._get_cache_path(b'cwlVersion: v1.0')
+            self.assertNotEqual(cache_path, other_cache_path)
+            self.assertEqual(os.path.dirname(cache_path), cache_dir)
+
+    def test_cache_dir_created_private(self):
+        with tempfile.TemporaryDirectory() as parent_dir:
+            cache_dir = os.path.join(parent_dir, 'cwl-cache')
+            self.assertIsNotNone(CWLDocument('someurl', cache_dir=cache_dir)._get_cache_path(b''))
+            self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+
+            os.chmod(cache_dir, 0o777)
+            self.assertIsNone(CWLDocument('someurl', cache_dir=cache_dir)._get_cache_path(b''))
+
+    def test_write_cache_removes_partial_file(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cwl_document = CWLDocument('someurl', cache_dir=cache_dir)
+            cwl_document._write_cache(os.path.join(cache_dir, 'parsed.json'), {'input_fields': [object()]})
+            self.assertEqual(os.listdir(cache_dir), [])
+
+
+class FindHintsTestCase(TestCase):
+    def test_find_hints(self):
         step_node1 = CWLStepNode(embedded_tool=CWLNodeWithHints(hints=[
             {
                 'class': 'specialHint', 'value': 1
@@ -34,7 +121,7 @@ class CWLDocumentTestCase(TestCase):
                 'class': 'specialHint', 'value': 2
             }
         ]))
-        cwl_document._parsed = CWLNodeWithSteps(
+        workflow_node = CWLNodeWithSteps(
             steps=[
                 step_node1,
                 CWLStepNode(
@@ -46,8 +133,63 @@ class CWLDocumentTestCase(TestCase):
                 )
             ]
         )
-        hints = cwl_document.extract_tool_hints('specialHint')
-        self.assertEqual(set([1, 2]), set([hint['value'] for hint in hints]))
+        self.assertEqual(set([1, 2]), set([hint['value'] for hint in find_hints(workflow_node)]))
+
+
+class DownloadedDocumentFetcherTestCase(TestCase):
+    def test_fetch_text_reads_local_copy(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.cwl') as document_file:
+            document_file.write('cwlVersion: v1.0')
+            document_file.flush()
+            fetcher = DownloadedDocumentFetcher({}, None, url='https://example.org/workflow.cwl',
+                                                path=document_file.name)
+            self.assertEqual(fetcher.fetch_text('https://example.org/workflow.cwl#main'), 'cwlVersion: v1.0')
+
+
+@override_settings(CWL_PARSER_PYTHON=sys.executable, CWL_PARSER_TIMEOUT_SECONDS=60)
+class ParseCWLDocumentInSubprocessTestCase(TestCase):
+    """
+    Runs a real worker interpreter with a stub parser module in place of data.cwlparser.
+    """
+    def setUp(self):
+        self.stub_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.stub_dir.cleanup)
+        environ_patcher = patch.dict(os.environ, {'PYTHONPATH': self.stub_dir.name})
+        environ_patcher.start()
+        self.addCleanup(environ_patcher.stop)
+
+    def run_stub_parser(self, source, url='someurl', path=None):
+        with open(os.path.join(self.stub_dir.name, 'stub_cwlparser.py'), 'w') as outfile:
+            outfile.write(source)
+        with patch('data.importers.CWL_PARSER_MODULE', 'stub_cwlparser'):
+            return parse_cwl_document_in_subprocess(url, path)
+
+    def test_returns_worker_results(self):
+        parsed = self.run_stub_parser(
+            "from data.cwlparser import main\n"
+            "main(lambda url, path: {'input_fields': [], 'tool': {'label': url, 'doc': path}, 'hints': []})\n",
+            url='https://example.org/workflow.cwl', path='/tmp/workflow.cwl')
+        self.assertEqual(parsed, {'input_fields': [], 'tool': {'label': 'https://example.org/workflow.cwl',
+                                                                'doc': '/tmp/workflow.cwl'}, 'hints': []})
+
+    def test_worker_error_raises_importer_exception(self):
+        with self.assertRaises(ImporterException) as raised:
+            self.run_stub_parser("raise ValueError('Not a CWL document')\n")
+        self.assertIn('ValueError: Not a CWL document', raised.exception.message)
+
+    def test_killed_worker_raises_importer_exception(self):
+        with self.assertRaises(ImporterException) as raised:
+            self.run_stub_parser("import os, signal\nos.kill(os.getpid(), signal.SIGKILL)\n")
+        self.assertIn('killed by signal 9', raised.exception.message)
+
+    def test_invalid_output_raises_importer_exception(self):
+        with self.assertRaises(ImporterException):
+            self.run_stub_parser("print('not json')\n")
+
+    @override_settings(CWL_PARSER_PYTHON='/nonexistent/python3')
+    def test_missing_interpreter_raises_importer_exception(self):
+        with self.assertRaises(ImporterException):
+            parse_cwl_document_in_subprocess('someurl')
 
 
 class MethodsDocumentContentsTestCase(TestCase):
@@ -82,6 +224,26 @@ othertool version: 3 citation: Dr Man 2017"""
             software_requirement_hints=software_requirement_hints,
             jinja_template_url='fakeurl')
         self.assertEqual(expected_content, method_document_contents.get_content())
+        self.assertEqual(DOICitation.objects.get(doi='mydoi123').apa_citation, 'Dr Man 2017')
+
+        mock_cn.content_negotiation.reset_mock()
+        self.assertEqual(expected_content, method_document_contents.get_content())
+        mock_cn.content_negotiation.assert_not_called()
+
+
+class GetDOICitationsTestCase(TestCase):
+    @patch('data.importers.cn')
+    def test_resolves_only_uncached_dois(self, mock_cn):
+        DOICitation.objects.create(doi='doi1', apa_citation='Cached 2017')
+        mock_cn.content_negotiation.side_effect = lambda ids, format, style: 'Resolved ' + ids
+        citations = get_doi_citations(['doi1', 'doi2', 'doi3', 'doi2'], pool_size=2)
+        self.assertEqual(citations, {
+            'doi1': 'Cached 2017',
+            'doi2': 'Resolved doi2',
+            'doi3': 'Resolved doi3',
+        })
+        self.assertEqual(mock_cn.content_negotiation.call_count, 2)
+        self.assertEqual(DOICitation.objects.count(), 3)
 
 
 class JobQuestionnaireImporterTestCase(TestCase):
@@ -0,0 +1,91 @@
+from django.test import TestCase, override_settings
+from django.db import OperationalError
+from django.utils import timezone
+from django.contrib.auth.models import User
+from data.models import Workflow, WorkflowVersion, Job, JobError, JobFlavor, ShareGroup
+from data.tests_models import create_vm_job_settings
+from data.jobworker import QueuedJobWorker
+from data.exceptions import DataServiceUnavailable, WrappedDataServiceException
+from unittest.mock import patch, Mock
+import datetime
+
+
+class QueuedJobWorkerTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('test_user')
+        workflow = Workflow.objects.create(name='RnaSeq')
+        workflow_version = WorkflowVersion.objects.create(workflow=workflow, version='1', url='', fields=[])
+        self.job = Job.objects.create(workflow_version=workflow_version,
+                                      job_order={},
+                                      user=self.user,
+                                      share_group=ShareGroup.objects.create(name='Results Checkers'),
+                                      job_settings=create_vm_job_settings(),
+                                      job_flavor=JobFlavor.objects.create(name='flavor1'),
+                                      state=Job.JOB_STATE_START_QUEUED)
+        self.worker = QueuedJobWorker(pool_size=1)
+
+    def tearDown(self):
+        self.worker.shutdown()
+
+    @patch('data.jobworker.LandoJob')
+    def test_process_job(self, mock_lando_job):
+        mock_lando_job.return_value.run_queued.return_value = True
+        self.assertEqual(self.worker.process_job(self.job.id), True)
+        mock_lando_job.assert_called_with(self.job.id, self.user)
+
+    @patch('data.jobworker.LandoJob')
+    def test_process_job_leaves_job_queued_when_dukeds_unavailable(self, mock_lando_job):
+        mock_lando_job.return_value.run_queued.side_effect = DataServiceUnavailable()
+        self.assertEqual(self.worker.process_job(self.job.id), False)
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_START_QUEUED)
+        self.assertEqual(JobError.objects.count(), 0)
+
+    @patch('data.jobworker.LandoJob')
+    def test_process_job_records_error(self, mock_lando_job):
+        mock_lando_job.return_value.run_queued.side_effect = WrappedDataServiceException(
+            Mock(status_code=403, message='Not allowed'))
+        self.assertEqual(self.worker.process_job(self.job.id), False)
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_ERROR)
+        self.assertEqual(JobError.objects.get().job, self.job)
+
+    @patch('data.jobworker.LandoJob')
+    def test_process_job_retries_server_errors_with_backoff(self, mock_lando_job):
+        for status_code in (500, 503, 429):
+            Job.objects.filter(pk=self.job.id).update(queue_attempts=0, queue_next_attempt=None)
+            mock_lando_job.return_value.run_queued.side_effect = WrappedDataServiceException(
+                Mock(status_code=status_code, message='Try later'))
+            self.assertEqual(self.worker.process_job(self.job.id), False)
+            job = Job.objects.get(pk=self.job.id)
+            self.assertEqual(job.state, Job.JOB_STATE_START_QUEUED)
+            self.assertEqual(job.queue_attempts, 1)
+            self.assertGreater(job.queue_next_attempt, timezone.now())
+        self.assertEqual(JobError.objects.count(), 0)
+
+    @patch('data.jobworker.LandoJob')
+    def test_process_job_retries_database_errors(self, mock_lando_job):
+        mock_lando_job.return_value.run_queued.side_effect = OperationalError('connection lost')
+        self.assertEqual(self.worker.process_job(self.job.id), False)
+        self.assertEqual(Job.objects.get(pk=self.job.id).queue_attempts, 1)
+
+    @override_settings(JOB_WORKER_MAX_ATTEMPTS=2)
+    @patch('data.jobworker.LandoJob')
+    def test_process_job_records_error_after_max_attempts(self, mock_lando_job):
+        mock_lando_job.return_value.run_queued.side_effect = DataServiceUnavailable()
+        Job.objects.filter(pk=self.job.id).update(queue_attempts=1)
+        self.worker.process_job(self.job.id)
+        self.assertEqual(Job.objects.get(pk=self.job.id).state, Job.JOB_STATE_ERROR)
+        self.assertEqual(JobError.objects.get().job, self.job)
+
+    @patch('data.jobworker.QueuedJobWorker.process_job')
+    def test_process_queued_jobs_skips_jobs_waiting_to_retry(self, mock_process_job):
+        mock_process_job.return_value = True
+        Job.objects.filter(pk=self.job.id).update(queue_attempts=1,
+                                                  queue_next_attempt=timezone.now() + datetime.timedelta(minutes=1))
+        self.assertEqual(self.worker.process_queued_jobs(), 0)
+        Job.objects.filter(pk=self.job.id).update(queue_next_attempt=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(self.worker.process_queued_jobs(), 1)
+
+    def test_backoff_seconds(self):
+        with self.settings(JOB_WORKER_RETRY_BACKOFF_BASE_SECONDS=30, JOB_WORKER_RETRY_BACKOFF_MAX_SECONDS=100):
+            self.assertEqual([QueuedJobWorker.backoff_seconds(attempts) for attempts in (1, 2, 3, 4)],
+                             [30, 60, 100, 100])
@@ -1,10 +1,16 @@
 from django.test import TestCase
 from data.mailer import EmailMessageFactory, EmailMessageSender, JobMailer, MailerConfig, MailerClient, EMAIL_EXCHANGE, \
-    ROUTING_KEY
-from data.models import EmailMessage, EmailTemplate, Job
+    ROUTING_KEY, EmailMessageBatchSender, EmailDigestBuilder, JobStateNotificationSender, queue_job_state_notification, \
+    purge_email_messages
+from data.models import EmailMessage, EmailTemplate, EmailNotification, Job, Workflow, WorkflowVersion, \
+    JobFileStageGroup, ShareGroup, JobFlavor, JobStateNotification
+from data.tests_models import create_vm_job_settings
+from django.contrib.auth.models import User
 from unittest.mock import MagicMock, patch, call, ANY
 from data.exceptions import EmailServiceException, EmailAlreadySentException
 from django.test.utils import override_settings
+from django.utils import timezone
+import datetime
 
 
 class EmailMessageFactoryTestCase(TestCase):
@@ -36,6 +42,47 @@ class EmailMessageFactoryTestCase(TestCase):
         self.assertEqual(message.sender_email, self.sender_email)
         self.assertEqual(message.to_email, self.to_email)
 
+    @patch('data.models.Template')
+    def test_compiles_templates_once(self, mock_template):
+        mock_template.return_value.render.return_value = 'rendered'
+        factory = EmailMessageFactory(self.email_template)
+        factory.make_message(dict(self.context), self.sender_email, self.to_email)
+        factory.make_message(dict(self.context), self.sender_email, self.to_email)
+        mock_template.assert_has_calls([call('Body {{ field1 }}'), call('Subject {{ field2}}')], any_order=True)
+        self.assertEqual(mock_template.call_count, 2)
+
+    def test_renders_updated_template_after_save(self):
+        factory = EmailMessageFactory(self.email_template)
+        factory.make_message(dict(self.context), self.sender_email, self.to_email)
+        self.email_template.body_template = 'New body {{ field1 }}'
+        self.email_template.save()
+        message = factory.make_message(dict(self.context), self.sender_email, self.to_email)
+        self.assertEqual(message.body, 'New body abc')
+
+
+class EmailTemplateCacheTestCase(TestCase):
+    def setUp(self):
+        self.email_template = EmailTemplate.objects.create(
+            name='template1',
+            body_template='Body',
+            subject_template='Subject',
+        )
+
+    def test_get_cached_by_name(self):
+        self.assertEqual(EmailTemplate.get_cached_by_name('template1'), self.email_template)
+        with self.assertNumQueries(0):
+            self.assertEqual(EmailTemplate.get_cached_by_name('template1'), self.email_template)
+
+    def test_get_cached_by_name_cleared_on_save(self):
+        EmailTemplate.get_cached_by_name('template1')
+        self.email_template.subject_template = 'New Subject'
+        self.email_template.save()
+        self.assertEqual(EmailTemplate.get_cached_by_name('template1').subject_template, 'New Subject')
+
+    def test_get_cached_by_name_missing(self):
+        with self.assertRaises(EmailTemplate.DoesNotExist):
+            EmailTemplate.get_cached_by_name('missing')
+
 
 class EmailMessageSenderTestCase(TestCase):
 
@@ -81,6 +128,22 @@ class EmailMessageSenderTestCase(TestCase):
         with self.assertRaises(EmailAlreadySentException):
             sender.send()
 
+    @patch('data.mailer.DjangoEmailMessage')
+    def test_raises_if_claimed_by_another_sender(self, MockDjangoEmailMessage):
+        EmailMessage.objects.filter(pk=self.email_message.pk).update(
+            state=EmailMessage.MESSAGE_STATE_SENDING, next_attempt=timezone.now() + datetime.timedelta(minutes=1))
+        sender = EmailMessageSender(self.email_message)
+        with self.assertRaises(EmailAlreadySentException):
+            sender.send()
+        self.assertFalse(MockDjangoEmailMessage.return_value.send.called)
+
+    @patch('data.mailer.DjangoEmailMessage')
+    def test_sends_if_claim_expired(self, MockDjangoEmailMessage):
+        EmailMessage.objects.filter(pk=self.email_message.pk).update(
+            state=EmailMessage.MESSAGE_STATE_SENDING, next_attempt=timezone.now() - datetime.timedelta(minutes=1))
+        EmailMessageSender(self.email_message).send()
+        self.assertEqual(EmailMessage.objects.get(pk=self.email_message.pk).state, EmailMessage.MESSAGE_STATE_SENT)
+
     @patch('data.mailer.DjangoEmailMessage')
     def test_splits_admin_bcc(self, MockDjangoEmailMessage):
         bcc_emails = ['bcc1@domain.com','bcc2@domain.com']
@@ -94,6 +157,116 @@ class EmailMessageSenderTestCase(TestCase):
         self.assertTrue(mock_send.call_args(self.subject, self.body, self.sender_email, [self.to_email], bcc=[bcc_emails]))
 
 
+@override_settings(EMAIL_RETRY_BACKOFF_BASE_SECONDS=60, EMAIL_RETRY_BACKOFF_MAX_SECONDS=300,
+                   EMAIL_MAX_SEND_ATTEMPTS=3)
+class EmailMessageBatchSenderTestCase(TestCase):
+    def setUp(self):
+        self.messages = [
+            EmailMessage.objects.create(body='Body {}'.format(i), subject='Subject {}'.format(i),
+                                        sender_email='sender@example.com', to_email='user{}@example.com'.format(i))
+            for i in range(3)
+        ]
+
+    @patch('data.mailer.get_connection')
+    def test_send_batch_uses_one_connection(self, mock_get_connection):
+        sent, failed = EmailMessageBatchSender(batch_size=10).send_batch()
+        self.assertEqual((sent, failed), (3, 0))
+        mock_get_connection.assert_called_once_with(fail_silently=False)
+        mock_connection = mock_get_connection.return_value
+        mock_connection.open.assert_called_once_with()
+        mock_connection.close.assert_called_once_with()
+        self.assertEqual(mock_connection.send_messages.call_count, 3)
+        django_message = mock_connection.send_messages.call_args[0][0][0]
+        self.assertEqual(django_message.subject, 'Subject 2')
+        self.assertEqual(django_message.to, ['user2@example.com'])
+        self.assertEqual(EmailMessage.objects.filter(state=EmailMessage.MESSAGE_STATE_SENT).count(), 3)
+
+    @patch('data.mailer.get_connection')
+    def test_send_batch_respects_batch_size(self, mock_get_connection):
+        sent, failed = EmailMessageBatchSender(batch_size=2).send_batch()
+        self.assertEqual((sent, failed), (2, 0))
+        self.assertEqual(EmailMessage.objects.get(pk=self.messages[2].pk).state, EmailMessage.MESSAGE_STATE_NEW)
+
+    @patch('data.mailer.get_connection')
+    def test_send_batch_records_errors_with_backoff(self, mock_get_connection):
+        mock_get_connection.return_value.send_messages.side_effect = [1, Exception('Mailbox full'), 1]
+        sent, failed = EmailMessageBatchSender(batch_size=10).send_batch()
+        self.assertEqual((sent, failed), (2, 1))
+        failed_message = EmailMessage.objects.get(pk=self.messages[1].pk)
+        self.assertEqual(failed_message.state, EmailMessage.MESSAGE_STATE_ERROR)
+        self.assertEqual(failed_message.errors, 'Mailbox full')
+        self.assertEqual(failed_message.send_attempts, 1)
+        self.assertGreater(failed_message.next_attempt, timezone.now() + datetime.timedelta(seconds=50))
+        self.assertEqual(EmailMessage.objects.get(pk=self.messages[0].pk).state, EmailMessage.MESSAGE_STATE_SENT)
+
+    def test_get_ready_messages_skips_backoff_and_exhausted_messages(self):
+        EmailMessage.objects.filter(pk=self.messages[0].pk).update(
+            state=EmailMessage.MESSAGE_STATE_ERROR, send_attempts=1,
+            next_attempt=timezone.now() + datetime.timedelta(minutes=1))
+        EmailMessage.objects.filter(pk=self.messages[1].pk).update(
+            state=EmailMessage.MESSAGE_STATE_ERROR, send_attempts=3)
+        ready = list(EmailMessageBatchSender().get_ready_messages())
+        self.assertEqual(ready, [self.messages[2]])
+
+    def test_get_ready_messages_skips_claimed_and_mailer_messages(self):
+        EmailMessage.objects.filter(pk=self.messages[0].pk).update(
+            state=EmailMessage.MESSAGE_STATE_SENDING, next_attempt=timezone.now() + datetime.timedelta(minutes=1))
+        EmailMessage.objects.filter(pk=self.messages[1].pk).update(queued_to_mailer=True)
+        ready = list(EmailMessageBatchSender().get_ready_messages())
+        self.assertEqual(ready, [self.messages[2]])
+
+    def test_get_ready_messages_includes_expired_claims(self):
+        EmailMessage.objects.filter(pk=self.messages[0].pk).update(
+            state=EmailMessage.MESSAGE_STATE_SENDING, next_attempt=timezone.now() - datetime.timedelta(minutes=1))
+        ready = list(EmailMessageBatchSender().get_ready_messages())
+        self.assertEqual(ready, self.messages)
+
+    @override_settings(EMAIL_SEND_CLAIM_SECONDS=300)
+    def test_claim_messages_moves_messages_to_sending(self):
+        sender = EmailMessageBatchSender(batch_size=2)
+        claimed = sender.claim_messages(sender.get_ready_messages())
+        self.assertEqual(claimed, self.messages[:2])
+        for message in EmailMessage.objects.filter(pk__in=[message.pk for message in claimed]):
+            self.assertEqual(message.state, EmailMessage.MESSAGE_STATE_SENDING)
+            self.assertGreater(message.next_attempt, timezone.now() + datetime.timedelta(seconds=290))
+        self.assertEqual(list(sender.get_ready_messages()), [self.messages[2]])
+
+    def test_backoff_seconds(self):
+        self.assertEqual(EmailMessageBatchSender.backoff_seconds(1), 60)
+        self.assertEqual(EmailMessageBatchSender.backoff_seconds(2), 120)
+        self.assertEqual(EmailMessageBatchSender.backoff_seconds(4), 300)
+
+    @patch('data.mailer.get_connection')
+    def test_send_batch_leaves_messages_when_connection_fails(self, mock_get_connection):
+        mock_get_connection.return_value.open.side_effect = Exception('Connection refused')
+        with self.assertRaises(EmailServiceException):
+            EmailMessageBatchSender(batch_size=10).send_batch()
+        self.assertEqual(EmailMessage.objects.filter(state=EmailMessage.MESSAGE_STATE_NEW,
+                                                     next_attempt__isnull=True).count(), 3)
+
+    @patch('data.mailer.get_connection')
+    def test_send_batch_releases_error_messages_when_connection_fails(self, mock_get_connection):
+        EmailMessage.objects.filter(pk=self.messages[0].pk).update(state=EmailMessage.MESSAGE_STATE_ERROR,
+                                                                   send_attempts=1)
+        mock_get_connection.return_value.open.side_effect = Exception('Connection refused')
+        with self.assertRaises(EmailServiceException):
+            EmailMessageBatchSender(batch_size=10).send_batch()
+        self.assertEqual(list(EmailMessage.objects.order_by('id').values_list('state', 'next_attempt')), [
+            (EmailMessage.MESSAGE_STATE_ERROR, None),
+            (EmailMessage.MESSAGE_STATE_NEW, None),
+            (EmailMessage.MESSAGE_STATE_NEW, None),
+        ])
+
+    @patch('data.mailer.get_connection')
+    def test_rate_limit(self, mock_get_connection):
+        mock_sleep = MagicMock()
+        sender = EmailMessageBatchSender(batch_size=10, rate_limit=2, clock=MagicMock(side_effect=[100.0, 100.0, 100.5]),
+                                         sleep=mock_sleep)
+        sender.send_batch()
+        mock_sleep.assert_has_calls([call(0.5), call(0.5)])
+        self.assertEqual(mock_sleep.call_count, 2)
+
+
 FROM_EMAIL = 'sender@otherdomain.com'
 ADMIN_BCC = ['admin-bcc@domain.com']
 
@@ -221,6 +394,197 @@ class JobMailerTestCase(TestCase):
         ]
         self.assertEqual(MockSender.mock_calls, expected_calls)
 
+    @patch('data.mailer.MailerClient')
+    def test_queued_messages_are_left_to_mailer(self, MockMailerClient):
+        user = MagicMock(email='user@domain.com')
+        job = MagicMock(state=Job.JOB_STATE_RUNNING, id=56, user=user)
+        job.name = 'TEST'
+        JobMailer(job, queue_messages=True, digest=False).mail_current_state()
+        message = EmailMessage.objects.get()
+        self.assertTrue(message.queued_to_mailer)
+        MockMailerClient.return_value.send.assert_called_once_with(message.id)
+        self.assertEqual(list(EmailMessageBatchSender().get_ready_messages()), [])
+
+
+@override_settings(DEFAULT_FROM_EMAIL=FROM_EMAIL)
+@override_settings(BESPIN_MAILER_ADMIN_BCC=ADMIN_BCC)
+class EmailDigestTestCase(TestCase):
+    def setUp(self):
+        EmailTemplate.objects.create(
+            name='job-finished-user',
+            body_template='Finished {{ name }}',
+            subject_template='Job {{ id }} has completed'
+        )
+        EmailTemplate.objects.create(
+            name='job-finished-sharegroup',
+            body_template='Share Group: Finished {{ name }}',
+            subject_template='Share Group: Job {{ id }} has completed'
+        )
+        EmailTemplate.objects.create(
+            name='job-digest',
+            body_template='{% for notification in notifications %}{{ notification.summary }}\n{% endfor %}',
+            subject_template='{{ count }} job updates'
+        )
+        user = User.objects.create_user('test_user', email='user@domain.com')
+        workflow = Workflow.objects.create(name='RnaSeq')
+        workflow_version = WorkflowVersion.objects.create(workflow=workflow, version='1', url='', fields=[])
+        share_group = ShareGroup.objects.create(name='Results Checkers', email='sharegroup@domain.com')
+        job_settings = create_vm_job_settings()
+        job_flavor = JobFlavor.objects.create(name='flavor1')
+        self.jobs = [
+            Job.objects.create(name='Job {}'.format(i), workflow_version=workflow_version, job_order={}, user=user,
+                               stage_group=JobFileStageGroup.objects.create(user=user), share_group=share_group,
+                               job_settings=job_settings, job_flavor=job_flavor, state=Job.JOB_STATE_FINISHED)
+            for i in range(2)
+        ]
+
+    @patch('data.mailer.MailerClient')
+    def test_digest_mode_buffers_notifications(self, mock_mailer_client):
+        JobMailer(self.jobs[0], digest=True).mail_current_state()
+        self.assertEqual(EmailMessage.objects.count(), 0)
+        mock_mailer_client.assert_not_called()
+        self.assertEqual(
+            sorted(EmailNotification.objects.values_list('template_name', 'to_email')),
+            [('job-finished-sharegroup', 'sharegroup@domain.com'), ('job-finished-user', 'user@domain.com')])
+
+    @override_settings(EMAIL_DIGEST_ENABLED=True)
+    def test_digest_mode_enabled_by_setting(self):
+        JobMailer(self.jobs[0]).mail_current_state()
+        self.assertEqual(EmailNotification.objects.count(), 2)
+
+    def test_build_due_digests_one_message_per_recipient(self):
+        for job in self.jobs:
+            JobMailer(job, digest=True).mail_current_state()
+        messages = EmailDigestBuilder(window_seconds=0).build_due_digests()
+
+        self.assertEqual(len(messages), 2)
+        user_message = EmailMessage.objects.get(to_email='user@domain.com')
+        self.assertEqual(user_message.subject, '2 job updates')
+        self.assertEqual(user_message.body, 'Job {} has completed\nJob {} has completed\n'.format(
+            self.jobs[0].id, self.jobs[1].id))
+        self.assertEqual(user_message.sender_email, FROM_EMAIL)
+        self.assertEqual(user_message.state, EmailMessage.MESSAGE_STATE_NEW)
+        self.assertEqual(EmailNotification.objects.filter(email_message=user_message).count(), 2)
+        self.assertFalse(EmailNotification.objects.filter(email_message__isnull=True).exists())
+
+    def test_build_due_digests_waits_for_window(self):
+        JobMailer(self.jobs[0], digest=True).mail_current_state()
+        self.assertEqual(EmailDigestBuilder(window_seconds=60).build_due_digests(), [])
+        self.assertEqual(EmailMessage.objects.count(), 0)
+
+    def test_deleting_digest_message_deletes_its_notifications(self):
+        JobMailer(self.jobs[0], digest=True).mail_current_state()
+        EmailDigestBuilder(window_seconds=0).build_due_digests()
+        EmailMessage.objects.get(to_email='user@domain.com').delete()
+        self.assertEqual(list(EmailNotification.objects.values_list('to_email', flat=True)), ['sharegroup@domain.com'])
+        self.assertEqual(EmailDigestBuilder(window_seconds=0).get_due_recipients(), [])
+
+    def test_build_digest_no_pending_notifications(self):
+        self.assertIsNone(EmailDigestBuilder().build_digest('user@domain.com'))
+
+
+@override_settings(DEFAULT_FROM_EMAIL=FROM_EMAIL, BESPIN_MAILER_ADMIN_BCC=ADMIN_BCC,
+                   JOB_NOTIFICATION_RETRY_BACKOFF_BASE_SECONDS=60, JOB_NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS=300,
+                   JOB_NOTIFICATION_MAX_ATTEMPTS=3)
+class JobStateNotificationSenderTestCase(TestCase):
+    def setUp(self):
+        EmailTemplate.objects.create(
+            name='job-finished-user',
+            body_template='Finished {{ name }}',
+            subject_template='Job {{ id }} has completed'
+        )
+        EmailTemplate.objects.create(
+            name='job-finished-sharegroup',
+            body_template='Share Group: Finished {{ name }}',
+            subject_template='Share Group: Job {{ id }} has completed'
+        )
+        user = User.objects.create_user('test_user', email='user@domain.com')
+        workflow = Workflow.objects.create(name='RnaSeq')
+        workflow_version = WorkflowVersion.objects.create(workflow=workflow, version='1', url='', fields=[])
+        share_group = ShareGroup.objects.create(name='Results Checkers', email='sharegroup@domain.com')
+        self.job = Job.objects.create(name='Job 1', workflow_version=workflow_version, job_order={}, user=user,
+                                      stage_group=JobFileStageGroup.objects.create(user=user), share_group=share_group,
+                                      job_settings=create_vm_job_settings(),
+                                      job_flavor=JobFlavor.objects.create(name='flavor1'),
+                                      state=Job.JOB_STATE_FINISHED)
+
+    @patch('data.mailer.MailerClient')
+    def test_send_batch(self, mock_mailer_client):
+        notification = queue_job_state_notification(self.job)
+        self.assertEqual(notification.state, Job.JOB_STATE_FINISHED)
+        self.job.state = Job.JOB_STATE_DELETED
+        self.job.save()
+
+        sent, failed = JobStateNotificationSender().send_batch()
+
+        self.assertEqual((sent, failed), (1, 0))
+        self.assertFalse(JobStateNotification.objects.exists())
+        # messages are for the state recorded in the notification, not the current job state
+        self.assertEqual(sorted(EmailMessage.objects.values_list('subject', flat=True)), [
+            'Job {} has completed'.format(self.job.id),
+            'Share Group: Job {} has completed'.format(self.job.id),
+        ])
+        self.assertEqual(mock_mailer_client.return_value.send.call_count, 2)
+
+    @patch('data.mailer.MailerClient')
+    def test_send_batch_records_failures_with_backoff(self, mock_mailer_client):
+        queue_job_state_notification(self.job)
+        EmailTemplate.objects.get(name='job-finished-user').delete()
+
+        sent, failed = JobStateNotificationSender().send_batch()
+
+        self.assertEqual((sent, failed), (0, 1))
+        notification = JobStateNotification.objects.get()
+        self.assertEqual(notification.attempts, 1)
+        self.assertGreater(notification.next_attempt, timezone.now() + datetime.timedelta(seconds=50))
+        self.assertNotEqual(notification.last_error, '')
+        self.assertFalse(EmailMessage.objects.exists())
+        # the failed notification waits for its backoff
+        self.assertEqual(JobStateNotificationSender().send_batch(), (0, 0))
+
+    @patch('data.mailer.MailerClient')
+    def test_send_batch_skips_exhausted_notifications(self, mock_mailer_client):
+        exhausted = queue_job_state_notification(self.job)
+        JobStateNotification.objects.filter(pk=exhausted.pk).update(attempts=3, last_error='Template missing')
+        ready = queue_job_state_notification(self.job)
+
+        sender = JobStateNotificationSender(batch_size=1)
+        self.assertEqual(list(sender.get_ready_notifications()), [ready])
+        self.assertEqual(sender.send_batch(), (1, 0))
+        self.assertEqual(list(JobStateNotification.objects.all()), [exhausted])
+
+    def test_backoff_seconds(self):
+        self.assertEqual(JobStateNotificationSender.backoff_seconds(1), 60)
+        self.assertEqual(JobStateNotificationSender.backoff_seconds(2), 120)
+        self.assertEqual(JobStateNotificationSender.backoff_seconds(4), 300)
+
+
+class PurgeEmailMessagesTestCase(TestCase):
+    def setUp(self):
+        self.old_sent = self.create_message(EmailMessage.MESSAGE_STATE_SENT, days_old=100)
+        self.old_error = self.create_message(EmailMessage.MESSAGE_STATE_ERROR, days_old=100)
+        self.new_sent = self.create_message(EmailMessage.MESSAGE_STATE_SENT, days_old=1)
+
+    @staticmethod
+    def create_message(state, days_old):
+        message = EmailMessage.objects.create(body='Body', subject='Subject', sender_email='sender@example.com',
+                                              to_email='user@example.com', state=state)
+        EmailMessage.objects.filter(pk=message.pk).update(created=timezone.now() - datetime.timedelta(days=days_old))
+        return message
+
+    def test_purges_old_sent_messages(self):
+        deleted = purge_email_messages(timezone.now() - datetime.timedelta(days=90))
+        self.assertEqual(deleted, 1)
+        self.assertEqual(set(EmailMessage.objects.values_list('id', flat=True)),
+                         set([self.old_error.id, self.new_sent.id]))
+
+    def test_purges_in_batches_with_states(self):
+        self.create_message(EmailMessage.MESSAGE_STATE_SENT, days_old=100)
+        deleted = purge_email_messages(timezone.now() - datetime.timedelta(days=90), batch_size=1,
+                                       states=[EmailMessage.MESSAGE_STATE_SENT, EmailMessage.MESSAGE_STATE_ERROR])
+        self.assertEqual(deleted, 3)
+        self.assertEqual(list(EmailMessage.objects.values_list('id', flat=True)), [self.new_sent.id])
+
 
 class MailerConfigTestCase(TestCase):
     @patch('data.mailer.LandoConnection', autospec=True)
@@ -232,14 +596,12 @@ class MailerConfigTestCase(TestCase):
 
 
 class MailerClientTestCase(TestCase):
-    @patch('data.mailer.MailerConfig', autospec=True)
-    @patch('data.mailer.WorkQueueConnection')  # autospec was unable to find connection property
-    def test_send(self, mock_work_queue_connection, mock_mailer_config):
+    @patch('data.mailer.MailerConfig')
+    @patch('data.mailer.enqueue_message')
+    def test_send(self, mock_enqueue_message, mock_mailer_config):
         client = MailerClient(job_id=23)
         client.send(send_email_id=45)
 
         mock_mailer_config.assert_called_with(23)
-        mock_work_queue_connection.assert_called_with(mock_mailer_config.return_value)
-
-        mock_channel = mock_work_queue_connection.return_value.connection.channel.return_value
-        mock_channel.basic_publish.assert_called_with(exchange=EMAIL_EXCHANGE, routing_key=ROUTING_KEY, body=ANY)
+        mock_enqueue_message.assert_called_with(mock_mailer_config.return_value.work_queue_config,
+                                                exchange=EMAIL_EXCHANGE, routing_key=ROUTING_KEY, body=ANY)
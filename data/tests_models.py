@@ -2,7 +2,7 @@ from django.test import TestCase
 from data.models import DDSEndpoint, DDSUserCredential
 from data.models import Workflow, WorkflowVersion
 from data.models import Job, JobFileStageGroup, DDSJobInputFile, URLJobInputFile, JobDDSOutputProject, JobError
-from data.models import LandoConnection
+from data.models import LandoConnection, lando_connection_cache
 from data.models import JobQuestionnaire, JobQuestionnaireType, JobAnswerSet, JobFlavor, VMProject, JobSettings, \
     CloudSettingsOpenStack, JobRuntimeOpenStack, JobRuntimeStepK8s, JobRuntimeK8s
 from data.models import JobToken
@@ -13,6 +13,7 @@ from data.models import JobStrategy, WorkflowConfiguration
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.conf import settings
 import json
 from mock import patch
 
@@ -186,6 +187,20 @@ class WorkflowVersionTests(TestCase):
         self.assertEqual(WorkflowVersion.sort_workflow_then_version_key(wf),
                          [self.workflow.id, '0000000001', '0000000000', '0000000005', '00000alpha'])
 
+    def test_version_sort_key_set_on_save(self):
+        wf = WorkflowVersion.objects.create(workflow=self.workflow, description="one", version='1.2', fields=[])
+        self.assertEqual(WorkflowVersion.objects.get(pk=wf.pk).version_sort_key, ['0000000001', '0000000002'])
+        wf.version = '1.10-dev'
+        wf.save()
+        self.assertEqual(WorkflowVersion.objects.get(pk=wf.pk).version_sort_key,
+                         ['0000000001', '0000000010', '0000000dev'])
+
+    def test_sorted_queryset(self):
+        for version in ['10', '2', '1.3.1', '1.3']:
+            WorkflowVersion.objects.create(workflow=self.workflow, description="one", version=version, fields=[])
+        versions = WorkflowVersion.sorted_queryset(WorkflowVersion.objects.all())
+        self.assertEqual([wf.version for wf in versions], ['1.3', '1.3.1', '2', '10'])
+
 
 class JobTests(TestCase):
     def setUp(self):
@@ -624,11 +639,46 @@ class LandoConnectionTests(TestCase):
         self.assertEqual('lando', connection.queue_name)
         self.assertEqual(LandoConnection.K8S_TYPE, connection.cluster_type)
 
-    @patch('data.models.Job', autospec=True)
-    def test_get_for_job_id(self, mock_job):
+    @patch('data.models.lando_connection_cache')
+    @patch('data.models.Job')
+    def test_get_for_job_id(self, mock_job, mock_lando_connection_cache):
+        mock_job.objects.filter.return_value.values_list.return_value.get.return_value = 5
         result = LandoConnection.get_for_job_id(23)
-        self.assertEqual(result, mock_job.objects.get.return_value.job_settings.lando_connection)
-        mock_job.objects.get.assert_called_with(pk=23)
+        self.assertEqual(result, mock_lando_connection_cache.get.return_value)
+        mock_job.objects.filter.assert_called_with(pk=23)
+        mock_lando_connection_cache.get.assert_called_with(5)
+
+    def test_get_for_job_settings_id_is_cached(self):
+        job_settings = create_vm_job_settings()
+        lando_connection_cache.clear()
+        self.assertEqual(LandoConnection.get_for_job_settings_id(job_settings.id), job_settings.lando_connection)
+        with self.assertNumQueries(0):
+            self.assertEqual(LandoConnection.get_for_job_settings_id(job_settings.id), job_settings.lando_connection)
+
+    def test_get_for_job_settings_id_cleared_on_save(self):
+        job_settings = create_vm_job_settings()
+        LandoConnection.get_for_job_settings_id(job_settings.id)
+
+        job_settings.lando_connection.queue_name = 'lando2'
+        job_settings.lando_connection.save()
+        self.assertEqual(LandoConnection.get_for_job_settings_id(job_settings.id).queue_name, 'lando2')
+
+        other_connection = LandoConnection.objects.create(host='otherhost', username='jpb67', password='secret',
+                                                          queue_name='lando3')
+        LandoConnection.get_for_job_settings_id(job_settings.id)
+        job_settings.lando_connection = other_connection
+        job_settings.save()
+        self.assertEqual(LandoConnection.get_for_job_settings_id(job_settings.id), other_connection)
+
+    @patch('data.models.time')
+    def test_get_for_job_settings_id_expires(self, mock_time):
+        job_settings = create_vm_job_settings()
+        mock_time.time.return_value = 1000
+        LandoConnection.get_for_job_settings_id(job_settings.id)
+        LandoConnection.objects.filter(pk=job_settings.lando_connection.id).update(queue_name='lando2')
+        self.assertEqual(LandoConnection.get_for_job_settings_id(job_settings.id).queue_name, 'lando')
+        mock_time.time.return_value = 1000 + settings.LANDO_CONNECTION_CACHE_SECONDS
+        self.assertEqual(LandoConnection.get_for_job_settings_id(job_settings.id).queue_name, 'lando2')
 
 
 class JobErrorTests(TestCase):
@@ -869,6 +919,25 @@ class WorkflowMethodsDocumentTests(TestCase):
                                                                   content='#Good Stuff\nSome text.')
         self.assertEqual('#Good Stuff\nSome text.', self.workflow_version.methods_document.content)
 
+    def test_save_renders_html(self):
+        methods_document = WorkflowMethodsDocument.objects.create(workflow_version=self.workflow_version,
+                                                                  content='#Good Stuff\nSome text.')
+        self.assertEqual('<h1>Good Stuff</h1>\n<p>Some text.</p>', methods_document.content_html)
+        methods_document.content = '#NEW CONTENT'
+        methods_document.save()
+        methods_document = WorkflowMethodsDocument.objects.first()
+        self.assertEqual('<h1>NEW CONTENT</h1>', methods_document.content_html)
+
+    def test_save_escapes_raw_html(self):
+        methods_document = WorkflowMethodsDocument.objects.create(
+            workflow_version=self.workflow_version,
+            content='# Methods\n\n<script>alert("xss")</script>\n\n[link](javascript:alert(1)) <b onclick="x()">bold</b>')
+        self.assertIn('<h1>Methods</h1>', methods_document.content_html)
+        self.assertNotIn('<script', methods_document.content_html)
+        self.assertIn('&lt;script&gt;', methods_document.content_html)
+        self.assertNotIn('javascript:', methods_document.content_html)
+        self.assertNotIn('<b onclick', methods_document.content_html)
+
 
 class WorkflowVersionToolDetailsTestCase(TestCase):
 
@@ -901,6 +970,22 @@ class WorkflowVersionToolDetailsTestCase(TestCase):
             details.clean_fields()
         self.assertIn('details', context.exception.error_dict)
 
+    def test_save_indexes_tools(self):
+        details = WorkflowVersionToolDetails.objects.create(workflow_version=self.workflow_version, details=[
+            {'tool': 'align.cwl', 'packages': [{'package': 'samtools', 'version': ['1.8', '1.9']}]},
+            {'name': 'gatk', 'version': '4.1.0'},
+            'other',
+        ])
+        tools = [(tool.name, tool.version, tool.version_sort_key) for tool in details.tools.order_by('name', 'version')]
+        self.assertEqual(tools, [
+            ('gatk', '4.1.0', WorkflowVersion.make_version_sort_key('4.1.0')),
+            ('samtools', '1.8', WorkflowVersion.make_version_sort_key('1.8')),
+            ('samtools', '1.9', WorkflowVersion.make_version_sort_key('1.9')),
+        ])
+        details.details = [{'name': 'gatk', 'version': '4.2.0'}]
+        details.save()
+        self.assertEqual([('gatk', '4.2.0')], list(details.tools.values_list('name', 'version')))
+
 
 class EmailTemplateTests(TestCase):
 
@@ -0,0 +1,96 @@
+from django.test import TestCase
+from data.models import OutboxMessage, LandoConnection
+from data.outbox import OutboxDispatcher, enqueue_message
+from django.utils import timezone
+from unittest.mock import Mock
+import pika.exceptions
+import datetime
+
+
+class OutboxDispatcherTestCase(TestCase):
+    def setUp(self):
+        self.lando_connection = LandoConnection.objects.create(host='somehost', username='user1', password='secret',
+                                                               queue_name='lando')
+        self.mock_publisher = Mock()
+        self.mock_publisher_pool = Mock()
+        self.mock_publisher_pool.get.return_value = self.mock_publisher
+        self.dispatcher = OutboxDispatcher(publisher_pool=self.mock_publisher_pool)
+
+    def test_dispatch_batch_sends_and_deletes_messages(self):
+        start_message = enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'start',
+                                        durable_queue=True)
+        email_message = enqueue_message(self.lando_connection, exchange='EmailExchange', routing_key='SendEmail',
+                                        body=b'email')
+        self.mock_publisher.publish_to_durable_queue.return_value = True
+        self.mock_publisher.publish.return_value = True
+
+        sent, failed = self.dispatcher.dispatch_batch(batch_size=10)
+
+        self.assertEqual((sent, failed), (2, False))
+        self.mock_publisher_pool.get.assert_called_with(self.lando_connection)
+        self.mock_publisher.publish_to_durable_queue.assert_called_with('lando', b'start',
+                                                                        message_id=str(start_message.id))
+        args, kwargs = self.mock_publisher.publish.call_args
+        self.assertEqual((kwargs['exchange'], kwargs['routing_key'], kwargs['body']),
+                         ('EmailExchange', 'SendEmail', b'email'))
+        self.assertEqual(kwargs['properties'].message_id, str(email_message.id))
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    def test_dispatch_batch_respects_batch_size(self):
+        for i in range(3):
+            enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'data', durable_queue=True)
+        self.mock_publisher.publish_to_durable_queue.return_value = True
+
+        sent, failed = self.dispatcher.dispatch_batch(batch_size=2)
+
+        self.assertEqual((sent, failed), (2, False))
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_dispatch_batch_stops_at_unconfirmed_message(self):
+        first = enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'one', durable_queue=True)
+        second = enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'two', durable_queue=True)
+        third = enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'three', durable_queue=True)
+        self.mock_publisher.publish_to_durable_queue.side_effect = [True, False]
+
+        sent, failed = self.dispatcher.dispatch_batch(batch_size=10)
+
+        self.assertEqual((sent, failed), (1, True))
+        self.assertEqual([message.id for message in OutboxMessage.objects.all()], [second.id, third.id])
+        self.assertEqual([message.claimed_until for message in OutboxMessage.objects.all()], [None, None],
+                         'unsent messages are released for the next batch')
+
+    def test_dispatch_batch_skips_messages_claimed_by_another_dispatcher(self):
+        first = enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'one', durable_queue=True)
+        second = enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'two', durable_queue=True)
+        OutboxMessage.objects.filter(id=first.id).update(claimed_until=timezone.now() + datetime.timedelta(minutes=5))
+        self.mock_publisher.publish_to_durable_queue.return_value = True
+
+        sent, failed = self.dispatcher.dispatch_batch(batch_size=10)
+
+        self.assertEqual((sent, failed), (1, False))
+        self.mock_publisher.publish_to_durable_queue.assert_called_once_with('lando', b'two',
+                                                                             message_id=str(second.id))
+
+        OutboxMessage.objects.filter(id=first.id).update(claimed_until=timezone.now() - datetime.timedelta(seconds=1))
+        sent, failed = self.dispatcher.dispatch_batch(batch_size=10)
+        self.assertEqual((sent, failed), (1, False), 'expired claims are sent again')
+        self.assertEqual(OutboxMessage.objects.count(), 0)
+
+    def test_dispatch_batch_keeps_messages_when_server_is_down(self):
+        enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'one', durable_queue=True)
+        self.mock_publisher.publish_to_durable_queue.side_effect = pika.exceptions.AMQPConnectionError()
+
+        sent, failed = self.dispatcher.dispatch_batch(batch_size=10)
+
+        self.assertEqual((sent, failed), (0, True))
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_dispatch_all_sends_every_batch(self):
+        for i in range(5):
+            enqueue_message(self.lando_connection, exchange='', routing_key='lando', body=b'data', durable_queue=True)
+        self.mock_publisher.publish_to_durable_queue.return_value = True
+
+        sent, failed = self.dispatcher.dispatch_all(batch_size=2)
+
+        self.assertEqual((sent, failed), (5, False))
+        self.assertEqual(OutboxMessage.objects.count(), 0)
@@ -0,0 +1,110 @@
+from django.test import TestCase
+from data.publisher import AMQPPublisher, PublisherPool
+from unittest.mock import patch, Mock
+import pika.exceptions
+
+
+class AMQPPublisherTestCase(TestCase):
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_publish_reuses_connection(self, mock_blocking_connection):
+        mock_blocking_connection.return_value.is_closed = False
+        mock_blocking_connection.return_value.channel.return_value.is_closed = False
+        publisher = AMQPPublisher('somehost', 'user', 'secret')
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'one')
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'two')
+
+        self.assertEqual(mock_blocking_connection.call_count, 1)
+        mock_channel = mock_blocking_connection.return_value.channel.return_value
+        self.assertEqual(mock_channel.basic_publish.call_count, 2)
+        mock_channel.basic_publish.assert_called_with(exchange='SomeExchange', routing_key='SomeKey', body=b'two',
+                                                      properties=None)
+
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_replaces_idle_connection(self, mock_blocking_connection):
+        mock_blocking_connection.return_value.is_closed = False
+        mock_blocking_connection.return_value.channel.return_value.is_closed = False
+        clock = Mock(side_effect=[100.0, 130.0, 130.0, 200.0, 200.0])
+        publisher = AMQPPublisher('somehost', 'user', 'secret', heartbeat_seconds=60, clock=clock)
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'one')
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'two')
+        self.assertEqual(mock_blocking_connection.call_count, 1)
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'three')
+        self.assertEqual(mock_blocking_connection.call_count, 2)
+
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_confirms_and_heartbeats_on_by_default(self, mock_blocking_connection):
+        mock_blocking_connection.return_value.is_closed = False
+        mock_channel = mock_blocking_connection.return_value.channel.return_value
+        mock_channel.is_closed = False
+        publisher = AMQPPublisher('somehost', 'user', 'secret')
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'one')
+        mock_channel.confirm_delivery.assert_called_with()
+        connection_params = mock_blocking_connection.call_args[0][0]
+        self.assertEqual(connection_params.heartbeat, 60)
+
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_publish_to_durable_queue_declares_queue_once(self, mock_blocking_connection):
+        mock_blocking_connection.return_value.is_closed = False
+        mock_blocking_connection.return_value.channel.return_value.is_closed = False
+        publisher = AMQPPublisher('somehost', 'user', 'secret')
+        publisher.publish_to_durable_queue('lando', b'one')
+        publisher.publish_to_durable_queue('lando', b'two')
+
+        mock_channel = mock_blocking_connection.return_value.channel.return_value
+        mock_channel.queue_declare.assert_called_once_with(queue='lando', durable=True)
+        args, kwargs = mock_channel.basic_publish.call_args
+        self.assertEqual(kwargs['exchange'], '')
+        self.assertEqual(kwargs['routing_key'], 'lando')
+        self.assertEqual(kwargs['properties'].delivery_mode, 2)
+
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_publish_reconnects_after_failure(self, mock_blocking_connection):
+        first_connection = Mock(is_closed=False)
+        first_connection.channel.return_value.is_closed = False
+        first_connection.channel.return_value.basic_publish.side_effect = pika.exceptions.ConnectionClosed()
+        second_connection = Mock(is_closed=False)
+        second_connection.channel.return_value.is_closed = False
+        mock_blocking_connection.side_effect = [first_connection, second_connection]
+        publisher = AMQPPublisher('somehost', 'user', 'secret')
+        publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'one')
+
+        self.assertEqual(mock_blocking_connection.call_count, 2)
+        first_connection.close.assert_called()
+        second_connection.channel.return_value.basic_publish.assert_called_with(
+            exchange='SomeExchange', routing_key='SomeKey', body=b'one', properties=None)
+
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_confirm_delivery(self, mock_blocking_connection):
+        mock_blocking_connection.return_value.is_closed = False
+        mock_channel = mock_blocking_connection.return_value.channel.return_value
+        mock_channel.is_closed = False
+        mock_channel.basic_publish.return_value = False
+        publisher = AMQPPublisher('somehost', 'user', 'secret', confirm_delivery=True)
+        confirmed = publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'one')
+
+        mock_channel.confirm_delivery.assert_called_with()
+        self.assertEqual(confirmed, False)
+
+    @patch('data.publisher.pika.BlockingConnection')
+    def test_publish_raises_when_retry_fails(self, mock_blocking_connection):
+        mock_blocking_connection.side_effect = pika.exceptions.AMQPConnectionError()
+        publisher = AMQPPublisher('somehost', 'user', 'secret')
+        with self.assertRaises(pika.exceptions.AMQPConnectionError):
+            publisher.publish(exchange='SomeExchange', routing_key='SomeKey', body=b'one')
+        self.assertEqual(mock_blocking_connection.call_count, 2)
+
+
+class PublisherPoolTestCase(TestCase):
+    def test_get_shares_publisher_per_connection(self):
+        pool = PublisherPool()
+        connection1 = Mock(pk=1, host='host1', username='user', password='secret')
+        connection2 = Mock(pk=2, host='host2', username='user', password='secret')
+        publisher = pool.get(connection1)
+        self.assertEqual(publisher.host, 'host1')
+        self.assertIs(pool.get(connection1), publisher)
+        self.assertIsNot(pool.get(connection2), publisher)
+
+    def test_get_new_publisher_when_credentials_change(self):
+        pool = PublisherPool()
+        publisher = pool.get(Mock(pk=1, host='host1', username='user', password='secret'))
+        self.assertIsNot(pool.get(Mock(pk=1, host='host1', username='user', password='secret2')), publisher)
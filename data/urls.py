@@ -37,6 +37,7 @@ router.register(r'admin/workflow-methods-documents', api.WorkflowMethodsDocument
 router.register(r'admin/email-templates', api.AdminEmailTemplateViewSet, 'admin_emailtemplate')
 router.register(r'admin/email-messages', api.AdminEmailMessageViewSet, 'admin_emailmessage')
 router.register(r'admin/import-workflow-questionnaire', api.AdminImportWorkflowQuestionnaireViewSet, 'admin_importworkflowquestionnaire')
+router.register(r'admin/dds-circuit-breakers', api.AdminDDSCircuitBreakerViewSet, 'admin_ddscircuitbreaker')
 
 urlpatterns = [
     url(r'^', include(router.urls)),
@@ -1,13 +1,34 @@
-from data.models import DDSUserCredential, DDSEndpoint
-from data.exceptions import WrappedDataServiceException
+from data.models import DDSUserCredential, DDSEndpoint, VersionInfoDocument
+from data.exceptions import WrappedDataServiceException, DataServiceUnavailable
+from data.circuitbreaker import CircuitBreaker
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
 from ddsc.core.remotestore import RemoteStore
-from ddsc.core.ddsapi import DataServiceError
+from ddsc.core.ddsapi import DataServiceError, DataServiceApi, DataServiceAuth
 from ddsc.core.ddsapi import ContentType
 from ddsc.config import Config
 from gcb_web_auth.utils import get_oauth_token, get_default_dds_endpoint
+from django.core.cache import cache
+from django.conf import settings
+from django.utils import timezone
+from requests.exceptions import RequestException
+from urllib.parse import urlparse, parse_qs
 import base64
+import datetime
+import logging
 import requests
+import time
+
+DDS_FILE_URL_CACHE_KEY = 'dds-file-url-{}'
+DDS_FILE_URL_EXPIRES_PARAM = 'temp_url_expires'
+HTTP_NOT_MODIFIED = 304
+
+logger = logging.getLogger(__name__)
+
+dds_circuit_breaker = CircuitBreaker('DukeDS',
+                                     failure_rate_threshold=settings.DDS_CIRCUIT_BREAKER_FAILURE_RATE,
+                                     minimum_calls=settings.DDS_CIRCUIT_BREAKER_MINIMUM_CALLS,
+                                     window_size=settings.DDS_CIRCUIT_BREAKER_WINDOW_SIZE,
+                                     reset_seconds=settings.DDS_CIRCUIT_BREAKER_RESET_SECONDS)
 
 
 class DDSBase(object):
@@ -67,6 +88,46 @@ class DDSFileUrl(object):
         self.http_headers = file_url_dict.get('http_headers')
 
 
+class TimeoutSession(requests.Session):
+    """
+    requests Session that applies a default timeout to every request.
+    """
+    def __init__(self, timeout):
+        super(TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(TimeoutSession, self).request(*args, **kwargs)
+
+
+class BespinDataServiceApi(DataServiceApi):
+    """
+    DataServiceApi that times out slow requests and fails instead of sleeping and retrying when DukeDS returns 503.
+    """
+    def __init__(self, auth, url, timeout):
+        self.timeout = timeout
+        super(BespinDataServiceApi, self).__init__(auth, url)
+
+    def recreate_requests_session(self):
+        self.http = TimeoutSession(self.timeout)
+
+    def set_status_message(self, msg):
+        # DataServiceApi calls this before sleeping when DukeDS is down, give up instead of holding the web worker
+        if msg:
+            raise DataServiceUnavailable()
+
+
+def create_remote_store(config):
+    """
+    Create a RemoteStore whose requests to DukeDS use DDS_REQUEST_TIMEOUT_SECONDS.
+    :param config: ddsc.config.Config: settings to use with ddsclient
+    :return: a ddsc.core.remotestore.RemoteStore object
+    """
+    data_service = BespinDataServiceApi(DataServiceAuth(config), config.url, timeout=settings.DDS_REQUEST_TIMEOUT_SECONDS)
+    return RemoteStore(config, data_service=data_service)
+
+
 def get_remote_store(user):
     """
     :param user: A Django model user object
@@ -76,7 +137,7 @@ def get_remote_store(user):
     if user.is_anonymous():
         raise PermissionDenied("Requires login")
     config = get_dds_config(user)
-    remote_store = RemoteStore(config)
+    remote_store = create_remote_store(config)
     return remote_store
 
 
@@ -138,11 +199,12 @@ def _get_dds_auth_token(app_cred, oauth_token):
         "access_token": access_token,
     }
     url = app_cred.api_root + "/user/api_token"
-    response = requests.get(url, headers=headers, params=data)
+    response = requests.get(url, headers=headers, params=data, timeout=settings.DDS_REQUEST_TIMEOUT_SECONDS)
     response.raise_for_status()
     return response.json()['api_token']
 
 
+@dds_circuit_breaker.protect
 def get_user_projects(user):
     """
     Get the Duke DS Projects for a user
@@ -157,6 +219,7 @@ def get_user_projects(user):
         raise WrappedDataServiceException(dse)
 
 
+@dds_circuit_breaker.protect
 def get_user_project(user, dds_project_id):
     """
     Get a single Duke DS Project for a user
@@ -172,6 +235,7 @@ def get_user_project(user, dds_project_id):
         raise WrappedDataServiceException(dse)
 
 
+@dds_circuit_breaker.protect
 def get_user_project_content(user, dds_project_id, search_str=None):
     """
     Get all files and folders contained in a project (includes nested files and folders).
@@ -188,6 +252,7 @@ def get_user_project_content(user, dds_project_id, search_str=None):
         raise WrappedDataServiceException(dse)
 
 
+@dds_circuit_breaker.protect
 def get_user_folder_content(user, dds_folder_id, search_str=None):
     """
     Get all files and folders contained in a project (includes nested files and folders).
@@ -209,19 +274,54 @@ def get_readme_file_url(job_output_project):
     Get url info for the readme file associated with a job output project.
     Uses system credentials so we can read this file while the job results are being still being reviewed
     and unavailable to the end user.
+    The url info is cached per readme file id until shortly before the signed url expires.
     :param job_output_project: JobDDSOutputProject: output project that contains a readme file id
     :return: DDSFileUrl
     """
+    dds_file_id = job_output_project.readme_file_id
+    cache_key = DDS_FILE_URL_CACHE_KEY.format(dds_file_id)
+    file_url_dict = cache.get(cache_key)
+    if file_url_dict is None:
+        file_url_dict = _get_file_url_dict(job_output_project.dds_user_credentials, dds_file_id)
+        cache_timeout = get_file_url_cache_timeout(file_url_dict)
+        if cache_timeout > 0:
+            cache.set(cache_key, file_url_dict, cache_timeout)
+    return DDSFileUrl(dds_file_id, file_url_dict)
+
+
+@dds_circuit_breaker.protect
+def _get_file_url_dict(user_credentials, dds_file_id):
     try:
-        dds_file_id = job_output_project.readme_file_id
-        user_credentials = job_output_project.dds_user_credentials
-        remote_store = RemoteStore(get_dds_config_for_credentials(user_credentials))
-        resources = remote_store.data_service.get_file_url(dds_file_id).json()
-        return DDSFileUrl(dds_file_id, resources)
+        remote_store = create_remote_store(get_dds_config_for_credentials(user_credentials))
+        return remote_store.data_service.get_file_url(dds_file_id).json()
     except DataServiceError as dse:
         raise WrappedDataServiceException(dse)
 
 
+def get_file_url_cache_timeout(file_url_dict, current_time=None):
+    """
+    Determine how many seconds a DukeDS file url response can be reused.
+    Signed urls contain an expiration timestamp(temp_url_expires), we stop using the url
+    DDS_FILE_URL_CACHE_EXPIRATION_MARGIN_SECONDS before that time. When the url does not contain an
+    expiration DDS_FILE_URL_CACHE_DEFAULT_SECONDS is used.
+    :param file_url_dict: dict: response from DukeDS get_file_url
+    :param current_time: float: seconds since the epoch, defaults to time.time()
+    :return: int: seconds to cache the response, zero or less means do not cache
+    """
+    if current_time is None:
+        current_time = time.time()
+    query_params = parse_qs(urlparse(file_url_dict.get('url') or '').query)
+    expires_values = query_params.get(DDS_FILE_URL_EXPIRES_PARAM)
+    if not expires_values:
+        return settings.DDS_FILE_URL_CACHE_DEFAULT_SECONDS
+    try:
+        expires = int(expires_values[0])
+    except ValueError:
+        return 0
+    return int(expires - current_time - settings.DDS_FILE_URL_CACHE_EXPIRATION_MARGIN_SECONDS)
+
+
+@dds_circuit_breaker.protect
 def get_file_name(user, dds_file_id):
     """
     Lookup a filename based on a file id.
@@ -236,6 +336,7 @@ def get_file_name(user, dds_file_id):
         raise WrappedDataServiceException(dse)
 
 
+@dds_circuit_breaker.protect
 def has_download_permissions(dds_user_credential, project_id):
     """
     Does dds_user_credential have permissions to download project project_id
@@ -245,7 +346,7 @@ def has_download_permissions(dds_user_credential, project_id):
     """
     try:
         config = get_dds_config_for_credentials(dds_user_credential)
-        remote_store = RemoteStore(config)
+        remote_store = create_remote_store(config)
         current_user = remote_store.get_current_user()
         response = remote_store.data_service.get_user_project_permission(project_id, current_user.id)
         auth_role = response.json()['auth_role']['id']
@@ -256,6 +357,7 @@ def has_download_permissions(dds_user_credential, project_id):
         raise WrappedDataServiceException(dse)
 
 
+@dds_circuit_breaker.protect
 def give_download_permissions(user, project_id, target_dds_user_id):
     """
     Using the data service permissions of user give file_downloader permissions to project_id to target_dds_user_credential
@@ -287,17 +389,60 @@ def base64_encode(content, encoding='utf-8'):
 def get_workflow_version_info(workflow_version):
     """
     Fetch the version_info_url from a WorkflowVersion, returning a dictionary with the fetched data and content type
+    Documents are cached by url in VersionInfoDocument and only revalidated once VERSION_INFO_CACHE_SECONDS old.
     :param workflow_version: A WorkflowVersion
     :return: dict with base64-encoded content and content_type
     """
-    response = requests.get(workflow_version.version_info_url)
-    response.raise_for_status()
-    content = response.content.decode(response.encoding)
-    b64_content = base64_encode(content, response.encoding)
-    content_type = response.headers.get('Content-Type')
+    url = workflow_version.version_info_url
+    document = VersionInfoDocument.objects.filter(url=url).first()
+    if document is None or document.needs_revalidation():
+        document = fetch_version_info_document(url, document)
     return {
         'workflow_version': workflow_version,
-        'content': b64_content,
-        'content_type': content_type,
-        'url': workflow_version.version_info_url
+        'content': document.content,
+        'content_type': document.content_type,
+        'url': url
     }
+
+
+def fetch_version_info_document(url, document=None):
+    """
+    Fetch a version-info document and save it in the cache.
+    When a cached document is passed it is revalidated with its ETag/Last-Modified values and returned unchanged
+    if the upstream host is down or responds with an error. The failure is recorded so the url is not tried again
+    for VERSION_INFO_RETRY_SECONDS.
+    :param url: str: url of the document
+    :param document: VersionInfoDocument: cached copy of the document or None
+    :return: VersionInfoDocument
+    """
+    headers = {}
+    if document:
+        if document.etag:
+            headers['If-None-Match'] = document.etag
+        if document.last_modified:
+            headers['If-Modified-Since'] = document.last_modified
+    try:
+        response = requests.get(url, headers=headers, timeout=settings.VERSION_INFO_REQUEST_TIMEOUT_SECONDS)
+        if document and response.status_code == HTTP_NOT_MODIFIED:
+            document.fetched = timezone.now()
+            document.retry_after = None
+            document.save()
+            return document
+        response.raise_for_status()
+    except RequestException as e:
+        if document is None:
+            raise
+        logger.warning("Serving cached version info for %s: %s", url, e)
+        document.retry_after = timezone.now() + datetime.timedelta(seconds=settings.VERSION_INFO_RETRY_SECONDS)
+        document.save()
+        return document
+    content = response.content.decode(response.encoding)
+    document, _ = VersionInfoDocument.objects.update_or_create(url=url, defaults={
+        'content': base64_encode(content, response.encoding),
+        'content_type': response.headers.get('Content-Type', ''),
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', ''),
+        'fetched': timezone.now(),
+        'retry_after': None,
+    })
+    return document